@@ -29,19 +29,29 @@
 from .colr import (  # noqa
     __version__,
     Colr,
+    ColrSpan,
+    ColrStyle,
     auto_disable,
     closing_code,
     codeformat,
     codes,
     codes_reverse,
     color,
+    color_code_cache_clear,
+    color_code_cache_info,
+    color_depth,
+    color_depths,
     disable,
     disabled,
+    downsample_code,
     enable,
     extbackformat,
     extforeformat,
     format_back,
+    format_cache_clear,
+    format_cache_info,
     format_fore,
+    FrozenColr,
     get_codes,
     get_code_num,
     get_known_codes,
@@ -52,11 +62,16 @@ from .colr import (  # noqa
     InvalidEscapeCode,
     InvalidRgbEscapeCode,
     InvalidStyle,
+    merge_codes,
     parse_colr_arg,
     name_data,
     rgbbackformat,
     rgbforeformat,
+    set_color_depth,
+    set_combined_codes,
+    split_codes,
     strip_codes,
+    visible_width,
 )
 
 try:
@@ -68,18 +83,49 @@ except ImportError:
     has_docopt = False
 
 from .trans import (
+    CodeInfo,
     ColorCode,
+    Palette,
+    TermLUT,
+    classify_code,
+    classify_codes,
+    disable_lut,
+    enable_lut,
     fix_hex,
+    get_lut,
+    get_matcher,
+    get_palette,
+    has_numpy,
     hex2rgb,
+    hex2rgb_array,
     hex2term,
     hex2term_map,
     hex2termhex,
+    hex2termnum,
+    load_palette,
+    lut_cache_dir,
+    matchers,
+    palettes,
+    register_palette,
+    rgb2basicnum,
     rgb2hex,
+    rgb2hex_array,
+    rgb2lab,
     rgb2term,
     rgb2termhex,
+    rgb2termhex_array,
+    rgb2termnum,
+    rgb2termnum_array,
+    rgb2termrgb,
+    term2basic_table,
     term2hex,
     term2hex_map,
-    term2rgb
+    term2hex_table,
+    term2packed_table,
+    term2rgb,
+    term2rgb_array,
+    term2rgb_table,
+    termnum2rgb,
 )
 
 __all__ = [
@@ -90,14 +136,24 @@ __all__ = [
     'codes',
     'codes_reverse',
     'color',
+    'color_code_cache_clear',
+    'color_code_cache_info',
+    'color_depth',
+    'color_depths',
     'Colr',
+    'ColrSpan',
+    'ColrStyle',
     'disable',
     'disabled',
+    'downsample_code',
     'enable',
     'extbackformat',
     'extforeformat',
     'format_back',
+    'format_cache_clear',
+    'format_cache_info',
     'format_fore',
+    'FrozenColr',
     'get_codes',
     'get_code_num',
     'get_known_codes',
@@ -108,24 +164,60 @@ __all__ = [
     'InvalidEscapeCode',
     'InvalidRgbEscapeCode',
     'InvalidStyle',
+    'merge_codes',
     'name_data',
     'parse_colr_arg',
     'rgbforeformat',
     'rgbbackformat',
+    'set_color_depth',
+    'set_combined_codes',
+    'split_codes',
     'strip_codes',
+    'visible_width',
     # trans functions made available.
+    'CodeInfo',
     'ColorCode',
+    'Palette',
+    'TermLUT',
+    'classify_code',
+    'classify_codes',
+    'disable_lut',
+    'enable_lut',
     'fix_hex',
+    'get_lut',
+    'get_matcher',
+    'get_palette',
+    'has_numpy',
     'hex2rgb',
+    'hex2rgb_array',
     'hex2term',
     'hex2term_map',
     'hex2termhex',
+    'hex2termnum',
+    'load_palette',
+    'lut_cache_dir',
+    'matchers',
+    'palettes',
+    'register_palette',
+    'rgb2basicnum',
     'rgb2hex',
+    'rgb2hex_array',
+    'rgb2lab',
     'rgb2term',
     'rgb2termhex',
+    'rgb2termhex_array',
+    'rgb2termnum',
+    'rgb2termnum_array',
+    'rgb2termrgb',
+    'term2basic_table',
     'term2hex',
     'term2hex_map',
-    'term2rgb'
+    'term2hex_table',
+    'term2packed_table',
+    'term2rgb',
+    'term2rgb_array',
+    'term2rgb_table',
+    'termnum2rgb',
 ]
 if has_docopt:
     __all__.append('docopt')
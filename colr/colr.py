@@ -28,16 +28,18 @@
     DEALINGS IN THE SOFTWARE.
 
 """
+from bisect import bisect_right
+from collections import Counter, OrderedDict, namedtuple
 from contextlib import suppress  # type: ignore
-from functools import partial, total_ordering
+from functools import lru_cache, total_ordering
 import math
+import operator
 import os
 import platform
 import re
 import struct
 import sys
 
-from types import GeneratorType
 from typing import (  # noqa
     Any,
     Callable,
@@ -54,11 +56,17 @@ from typing.io import IO
 
 from .trans import (
     ColorCode,
+    Palette,
+    classify_code,
+    get_palette,
     hex2rgb,
-    hex2term,
     hex2termhex,
+    hex2termnum,
+    rgb2termnum,
+    term2basic_table,
 )
 from .name_data import names as name_data
+from .width_data import widths as _width_ranges
 
 # Types for the type checker.
 CodeFormatArg = Union[str, int]
@@ -77,13 +85,23 @@ __all__ = [
     'codes',
     'codes_reverse',
     'color',
+    'color_code_cache_clear',
+    'color_code_cache_info',
+    'color_depth',
+    'color_depths',
     'Colr',
+    'ColrSpan',
+    'ColrStyle',
     'disable',
+    'downsample_code',
     'enable',
     'extbackformat',
     'extforeformat',
     'format_back',
+    'format_cache_clear',
+    'format_cache_info',
     'format_fore',
+    'FrozenColr',
     'get_code_num',
     'get_codes',
     'get_known_codes',
@@ -94,15 +112,29 @@ __all__ = [
     'InvalidEscapeCode',
     'InvalidRgbEscapeCode',
     'InvalidStyle',
+    'merge_codes',
     'name_data',
     'parse_colr_arg',
     'rgbbackformat',
     'rgbforeformat',
+    'set_color_depth',
+    'set_combined_codes',
+    'split_codes',
     'strip_codes',
+    'visible_width',
 ]
 # Set with the enable/disable functions, or on Windows without colorama.
 _disabled = False
 
+# Set with set_color_depth(), for terminals with limited colors.
+# None means that codes are used as-is.
+_color_depth = None  # type: Optional[int]
+# Accepted color depths for set_color_depth() and Colr(depth=...).
+color_depths = (None, 16, 256)
+# Set with set_combined_codes(), to merge the codes for a style/color
+# into a single escape code.
+_combined_codes = False
+
 # Windows support relies on colorama (for now).
 if platform.system() == 'Windows':
     try:
@@ -147,10 +179,119 @@ extbackformat = '\033[48;5;{}m'.format  # type: CodeFormatFunc
 rgbforeformat = '\033[38;2;{};{};{}m'.format  # type: CodeFormatRgbFunc
 rgbbackformat = '\033[48;2;{};{};{}m'.format  # type: CodeFormatRgbFunc
 
+# Prebuilt escape codes for every (basic, light, extended) fore/back color,
+# used by _format_code() instead of formatting/validating each time.
+_fore_code_tables = (
+    tuple(codeformat(30 + n) for n in range(10)),
+    tuple(codeformat(90 + n) for n in range(10)),
+    tuple(extforeformat(n) for n in range(256)),
+)  # type: Tuple[Tuple[str, ...], ...]
+_back_code_tables = (
+    tuple(codeformat(40 + n) for n in range(10)),
+    tuple(codeformat(100 + n) for n in range(10)),
+    tuple(extbackformat(n) for n in range(256)),
+)  # type: Tuple[Tuple[str, ...], ...]
+# Results of Colr.color_code(), by:
+#   (type, fore, back, style, depth, palette, combined)
+# with the least recently used results first.
+# See color_code_cache_info() and color_code_cache_clear().
+_color_code_cache = OrderedDict()  # type: Dict[Tuple[Any, ...], str]
+_color_code_cache_size = 256
+_color_code_stats = Counter()  # type: Dict[str, int]
+# Argument types that color_code() results can be cached for.
+_color_code_key_types = (type(None), str, int, tuple, list)
+# Max number of rgb escape codes kept by _format_rgb_code().
+_format_rgb_cache_size = 1024
+# Max number of hex value escape codes kept by _hex_escape_code().
+_hex_code_cache_size = 1024
+# Prebuilt table hits/misses for _format_code(), see format_cache_info().
+_format_code_stats = Counter()  # type: Dict[str, int]
+
+# Display width for each character seen by visible_width(), starting
+# with printable ascii. Other characters are looked up in _width_ranges.
+_char_widths = {
+    chr(i): 1 for i in range(0x20, 0x7f)
+}  # type: Dict[str, int]
+# First code point of each _width_ranges range, for bisect.
+_width_starts = [first for first, _, _ in _width_ranges]
+
 # Used to strip codes from a string.
 codepat = re.compile('\033\[([\d;]+)?m')
 # Used to grab codes from a string.
 codegrabpat = re.compile('\033\[[\d;]+?m')
+# Used to check for a string of nothing but codes, for merge_codes().
+codesonlypat = re.compile('(?:\033\\[[\\d;]*m)+')
+# Used to split stripped text into newlines, whitespace, and words (by
+# group number), for Colr.wrap().
+wrappat = re.compile('(\n)|([^\\S\n]+)|(\\S+)')
+
+# A piece of Colr data, rendered as: codes + text + end.
+# `text` may already have escape codes in it (see Colr.stripped()).
+ColrSpan = namedtuple('ColrSpan', ('codes', 'text', 'end'))
+
+
+def _active_codes(
+        active: Tuple[Tuple[str, ...], str, str],
+        codes: str) -> Tuple[Tuple[str, ...], str, str]:
+    """ Return the (styles, back, fore) escape codes that are still active
+        after `codes` are used, when `active` codes were used before them.
+        A reset code clears all of them, a fore/back code replaces the last
+        fore/back code, and a style code is added (or removed by its "off"
+        code, like 22 for 1 and 2). So there are only a few active codes,
+        no matter how many codes came before.
+        Use ''.join(active[0]) + active[1] + active[2] for the codes.
+    """
+    if not codes:
+        return active
+    styles, back, fore = active
+    for part in split_codes(codes):
+        num = int(part[2:-1].split(';', 1)[0] or 0)
+        if num == 0:
+            styles, back, fore = (), '', ''
+        elif (30 <= num <= 38) or (90 <= num <= 97):
+            fore = part
+        elif num == 39:
+            fore = ''
+        elif (40 <= num <= 48) or (100 <= num <= 107):
+            back = part
+        elif num == 49:
+            back = ''
+        elif 21 <= num <= 29:
+            # Style "off" codes, 22 is for bright and dim.
+            offnums = (1, 2) if num == 22 else (num - 20, )
+            styles = tuple(
+                code for code in styles
+                if int(code[2:-1]) not in offnums
+            )
+        elif part not in styles:
+            styles += (part, )
+    return (styles, back, fore)
+
+
+if hasattr(str, 'isascii'):
+    _isascii = str.isascii
+else:
+    def _isascii(s: str) -> bool:
+        """ str.isascii() for Python versions before 3.7. """
+        return (not s) or (max(s) < '\x80')
+
+
+def _char_width(char: str) -> int:
+    """ Return the display width (0, 1, or 2) for a single character,
+        from a binary search of _width_ranges. Results are kept in
+        _char_widths.
+    """
+    width = _char_widths.get(char, None)
+    if width is None:
+        codepoint = ord(char)
+        i = bisect_right(_width_starts, codepoint) - 1
+        width = 1
+        if i >= 0:
+            _, last, rangewidth = _width_ranges[i]
+            if codepoint <= last:
+                width = rangewidth
+        _char_widths[char] = width
+    return width
 
 
 def _build_codes() -> Dict[str, Dict[str, str]]:
@@ -205,6 +346,34 @@ def _build_codes_reverse(
     return built
 
 
+def _build_escape_code_index(
+        codes: Dict[str, Dict[str, str]],
+        names: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[Any, str]]:
+    """ Build a map of all known names/numbers to escape code, for each
+        code type, based on an existing name to escape-code map and the
+        known color names.
+        Code numbers are also available as ints.
+        Color names that are also hex values are left out, because hex
+        values are used before color names.
+    """
+    built = {}  # type: Dict[str, Dict[Any, str]]
+    for codetype, codemap in codes.items():
+        built[codetype] = index = {}  # type: Dict[Any, str]
+        index.update(codemap)
+        for name, escapecode in codemap.items():
+            with suppress(ValueError):
+                index.setdefault(int(name), escapecode)
+        if codetype == 'style':
+            continue
+        formatter = extbackformat if codetype == 'back' else extforeformat
+        for name, info in names.items():
+            try:
+                hex2rgb(name, allow_short=True)
+            except ValueError:
+                index.setdefault(name, formatter(info['code']))
+    return built
+
+
 def auto_disable(
         enabled: Optional[bool]=True,
         fds: Optional[Sequence[IO]]=(sys.stdout, sys.stderr)) -> None:
@@ -226,6 +395,33 @@ def auto_disable(
         enable()
 
 
+def color_code_cache_clear() -> None:
+    """ Clear the Colr.color_code() cache, and reset the hit counts. """
+    _color_code_cache.clear()
+    _color_code_stats.clear()
+
+
+def color_code_cache_info() -> Dict[str, Optional[int]]:
+    """ Return statistics for the Colr.color_code() cache, as a dict of:
+            hits     : Number of calls that used a cached code.
+            misses   : Number of calls that built and cached a code.
+            maxsize  : Max number of codes kept.
+            currsize : Number of codes currently kept.
+        Calls with arguments that can't be cached are not counted.
+    """
+    return {
+        'hits': _color_code_stats['hits'],
+        'misses': _color_code_stats['misses'],
+        'maxsize': _color_code_cache_size,
+        'currsize': len(_color_code_cache),
+    }
+
+
+def color_depth() -> Optional[int]:
+    """ Public access to _color_depth. """
+    return _color_depth
+
+
 def disable() -> None:
     """ Disable color codes for Colr and the convenience color() function.
         Created to be used by auto_disable(), for piping output to file or
@@ -240,6 +436,45 @@ def disabled() -> bool:
     return _disabled
 
 
+@lru_cache(maxsize=1024)
+def downsample_code(
+        code: str,
+        depth: Optional[int],
+        palette: Optional[Palette]=None) -> str:
+    """ Convert an extended or rgb escape code into the nearest code that
+        fits within a color depth (see `color_depths`).
+        For a depth of 16, the nearest basic/light code is used.
+        For a depth of 256, rgb codes are converted into extended codes.
+        Other codes are returned as-is.
+        When a Palette is given, the nearest codes are found using its
+        colors.
+    """
+    info = classify_code(code)
+    if max(info.numbers, default=0) > 255:
+        # Not a valid code, there is nothing to match.
+        return code
+    if info.kind == 'rgb' and depth == 256:
+        number = rgb2termnum(*info.numbers, palette=palette)
+        if info.target == 'back':
+            return extbackformat(number)
+        return extforeformat(number)
+    elif info.kind == 'rgb' and depth == 16:
+        # Matched directly, snapping to the cube first would miss the
+        # nearest basic color for some rgb values.
+        basic = rgb2termnum(*info.numbers, match='basic', palette=palette)
+    elif info.kind == 'extended' and depth == 16:
+        number = info.numbers[0]
+        if palette is None:
+            basic = term2basic_table[number]
+        else:
+            basic = palette.basic_table[number]
+    else:
+        return code
+    if info.target == 'back':
+        return codeformat(40 + basic if basic < 8 else 100 + basic - 8)
+    return codeformat(30 + basic if basic < 8 else 90 + basic - 8)
+
+
 def enable() -> None:
     """ Enable color codes for Colr and the convenience color() function.
         This only needs to be called if disable() was called previously.
@@ -248,24 +483,15 @@ def enable() -> None:
     _disabled = False
 
 
-def _format_code(
+def _build_format_code(
         number: Union[int, Sequence[int]],
         backcolor: Optional[bool]=False,
         light: Optional[bool]=False,
         extended: Optional[bool]=False) -> str:
-    """ Return an escape code for a fore/back color, by number.
-        This is a convenience method for handling the different code types
-        all in one shot.
-        It also handles some validation.
-        format_fore/format_back wrap this function to reduce code duplication.
-
-        Arguments:
-            number    : Integer or RGB tuple to format into an escape code.
-            backcolor : Whether this is for a back color, otherwise it's fore.
-            light     : Whether this should be a 'light' color.
-            extended  : Whether this should be an extended (256) color.
-
-        If `light` and `extended` are both given, only `light` is used.
+    """ Build an escape code for a fore/back color, by number.
+        This handles the different code types, and all of the validation.
+        _format_code() uses this when a code is not in the prebuilt tables.
+        See _format_code() for arguments.
     """
     if backcolor:
         codetype = 'back'
@@ -335,6 +561,99 @@ def _format_code(
     return formatters['rgb'](r, g, b)
 
 
+def _format_code(
+        number: Union[int, Sequence[int]],
+        backcolor: Optional[bool]=False,
+        light: Optional[bool]=False,
+        extended: Optional[bool]=False) -> str:
+    """ Return an escape code for a fore/back color, by number.
+        This is a convenience method for handling the different code types
+        all in one shot.
+        It also handles some validation.
+        format_fore/format_back wrap this function to reduce code duplication.
+
+        Arguments:
+            number    : Integer or RGB tuple to format into an escape code.
+            backcolor : Whether this is for a back color, otherwise it's fore.
+            light     : Whether this should be a 'light' color.
+            extended  : Whether this should be an extended (256) color.
+
+        If `light` and `extended` are both given, only `light` is used.
+    """
+    numtype = type(number)
+    if numtype is int:
+        tables = _back_code_tables if backcolor else _fore_code_tables
+        if light:
+            table = tables[1]
+        elif extended:
+            table = tables[2]
+        else:
+            table = tables[0]
+        if 0 <= cast(int, number) < len(table):
+            _format_code_stats['hits'] += 1
+            return table[cast(int, number)]
+    elif numtype is tuple:
+        try:
+            return _format_rgb_code(cast(tuple, number), bool(backcolor))
+        except TypeError:
+            # Unhashable/invalid values are handled (and rejected) below.
+            pass
+    _format_code_stats['misses'] += 1
+    return _build_format_code(
+        number,
+        backcolor=backcolor,
+        light=light,
+        extended=extended
+    )
+
+
+@lru_cache(maxsize=_format_rgb_cache_size)
+def _format_rgb_code(rgb: Tuple[Any, ...], backcolor: bool) -> str:
+    """ Return a cached escape code for an rgb tuple.
+        Invalid values raise InvalidColr, and are never cached.
+    """
+    return _build_format_code(rgb, backcolor=backcolor)
+
+
+@lru_cache(maxsize=_hex_code_cache_size)
+def _hex_escape_code(
+        hexval: str,
+        backcolor: bool,
+        palette: Optional[Palette]) -> Optional[str]:
+    """ Return a cached extended escape code for a hex value, or None if
+        it is not a valid hex value.
+    """
+    try:
+        termnum = hex2termnum(hexval, allow_short=True, palette=palette)
+    except ValueError:
+        return None
+    return _format_code(termnum, backcolor=backcolor, extended=True)
+
+
+def format_cache_clear() -> None:
+    """ Clear the rgb/hex escape code caches, and reset the hit counts. """
+    _format_rgb_code.cache_clear()
+    _hex_escape_code.cache_clear()
+    _format_code_stats.clear()
+
+
+def format_cache_info() -> Dict[str, Any]:
+    """ Return statistics for the escape code caches used by format_fore()
+        and format_back(), as a dict of:
+            table : A Counter of 'hits' and 'misses' for the prebuilt
+                    basic, light, and extended code tables.
+                    Misses are values that were not ints in range.
+            rgb   : A functools.lru_cache() CacheInfo for rgb codes.
+            hex   : A functools.lru_cache() CacheInfo for hex values used
+                    with Colr.get_escape_code().
+    """
+    return {
+        'table': _format_code_stats.copy(),
+        'rgb': _format_rgb_code.cache_info(),
+        'hex': _hex_escape_code.cache_info(),
+    }
+
+
 def format_back(
         number: Union[int, Sequence[int]],
         light: Optional[bool]=False,
@@ -382,6 +701,15 @@ def get_code_num(s: str) -> Optional[int]:
     """ Get code number from an escape code.
         Raises InvalidEscapeCode if an invalid number is found.
     """
+    info = classify_code(s)
+    if info.kind != 'unknown':
+        # The last number, like the split below would give.
+        num = info.numbers[-1]
+        if num > 255:
+            raise InvalidEscapeCode(num)
+        return num
+
+    # Not a well-formed code, try to find a number anyway.
     if ';' in s:
         # Extended fore/back codes.
         numberstr = s.rpartition(';')[-1][:-1]
@@ -404,6 +732,13 @@ def get_code_num_rgb(s: str) -> Optional[Tuple[int, int, int]]:
     """ Get rgb code numbers from an RGB escape code.
         Raises InvalidRgbEscapeCode if an invalid number is found.
     """
+    info = classify_code(s)
+    if info.kind == 'rgb':
+        if max(info.numbers) > 255:
+            raise InvalidRgbEscapeCode(s, reason='Not in range 0-255.')
+        return info.numbers
+
+    # Not a well-formed rgb code, find out why.
     parts = s.split(';')
     if len(parts) != 5:
         raise InvalidRgbEscapeCode(s, reason='Count is off.')
@@ -434,10 +769,14 @@ def get_known_codes(
         unique: Optional[bool]=True,
         rgb_mode: Optional[bool]=False):
     """ Get all known escape codes from a string, and yield the explanations.
+        Combined codes are explained for each part (see split_codes()).
     """
 
     isdisabled = disabled()
-    orderedcodes = tuple((c, get_known_name(c)) for c in get_codes(s))
+    orderedcodes = tuple(
+        (c, get_known_name(c))
+        for c in split_codes(''.join(get_codes(s)))
+    )
     codesdone = set()  # type: Set[str]
 
     for code, codeinfo in orderedcodes:
@@ -471,44 +810,39 @@ def get_known_codes(
         ))
 
 
-def get_known_name(s: str) -> Optional[Tuple[str, ColorArg]]:
+def get_known_name(s: str) -> Optional[Tuple[str, Any]]:
     """ Reverse translate a terminal code to a known color name, if possible.
         Returns a tuple of (codetype, knownname) on success.
+        For a combined code (see merge_codes()), this is
+        ('combined', ((codetype, knownname), ...)), with a tuple for each
+        part, if all of the parts are known.
         Returns None on failure.
     """
-
-    if not s.endswith('m'):
-        # All codes end with 'm', so...
-        return None
-    if s.startswith('\033[38;5;'):
-        # Extended fore.
-        name = codes_reverse['fore'].get(s, None)
+    info = classify_code(s)
+    kind = info.kind
+    if kind == 'unknown':
+        parts = split_codes(s)
+        if len(parts) > 1:
+            names = tuple(get_known_name(part) for part in parts)
+            if None not in names:
+                return ('combined', names)
+            return None
+    if kind == 'extended':
+        # Extended fore/back.
+        codetype = 'extended {}'.format(info.target)
+        name = codes_reverse[info.target].get(s, None)
         if name is None:
-            num = get_code_num(s)
-            return ('extended fore', num)
-        else:
-            return ('extended fore', name)
-    elif s.startswith('\033[48;5;'):
-        # Extended back.
-        name = codes_reverse['back'].get(s, None)
-        if name is None:
-            num = get_code_num(s)
-            return ('extended back', num)
-        else:
-            return ('extended back', name)
-    elif s.startswith('\033[38;2'):
-        # RGB fore.
-        vals = get_code_num_rgb(s)
-        if vals is not None:
-            return ('rgb fore', vals)
-    elif s.startswith('\033[48;2'):
-        # RGB back.
-        vals = get_code_num_rgb(s)
-        if vals is not None:
-            return ('rgb back', vals)
-    elif s.startswith('\033['):
+            num = info.numbers[0]
+            if num > 255:
+                raise InvalidEscapeCode(num)
+            return (codetype, num)
+        return (codetype, name)
+    elif kind == 'rgb':
+        # RGB fore/back.
+        return ('rgb {}'.format(info.target), get_code_num_rgb(s))
+    elif kind == 'basic':
         # Fore, back, style.
-        number = get_code_num(s)
+        number = info.numbers[0]
         # Get code type based on number.
         if (number <= 7) or (number == 22):
             codetype = 'style'
@@ -566,10 +900,28 @@ def in_range(x: int, minimum: int, maximum: int) -> bool:
     return (x >= minimum and x <= maximum)
 
 
+def merge_codes(s: str) -> str:
+    """ Merge a string of escape codes into a single escape code.
+        Strings that are not only escape codes are returned as-is.
+        Example:
+            merge_codes('\033[1m\033[48;5;20m\033[38;5;196m')
+            >> '\033[1;48;5;20;38;5;196m'
+    """
+    if not codesonlypat.fullmatch(s):
+        return s
+    params = codepat.findall(s)
+    if len(params) < 2:
+        return s
+    # An empty code ('\033[m') is a reset code.
+    return codeformat(';'.join(param or '0' for param in params))
+
+
 def parse_colr_arg(
         s: str,
         default: Optional[Any]=None,
-        rgb_mode: Optional[bool]=False) -> ColorArg:
+        rgb_mode: Optional[bool]=False,
+        match: Optional[str]=None,
+        palette: Optional[Union[str, Palette]]=None) -> ColorArg:
     """ Parse a user argument into a usable fore/back color value for Colr.
         If a falsey value is passed, default is returned.
         Raises InvalidColr if the argument is unusable.
@@ -580,8 +932,16 @@ def parse_colr_arg(
         This validates the length/range for rgb values (0-255, 0-255, 0-255).
 
         Arguments:
-            s  : User's color value argument.
-                 Example: "1", "255", "black", "25,25,25"
+            s        : User's color value argument.
+                       Example: "1", "255", "black", "25,25,25"
+            default  : Value to return when `s` is falsey.
+            rgb_mode : Return hex values as rgb, instead of the nearest
+                       terminal color's hex value.
+            match    : Matching mode for hex values when not in rgb_mode.
+                       See: colr.trans.matchers
+            palette  : Palette, or registered palette name, to match hex
+                       values against when not in rgb_mode.
+                       See: colr.trans.palettes
     """
     if not s:
         return default
@@ -615,7 +975,12 @@ def parse_colr_arg(
             try:
                 if rgb_mode:
                     return hex2rgb(val, allow_short=True)
-                return hex2termhex(val, allow_short=True)
+                return hex2termhex(
+                    val,
+                    allow_short=True,
+                    match=match,
+                    palette=palette
+                )
             except ValueError:
                 raise InvalidColr(val)
         else:
@@ -632,7 +997,12 @@ def parse_colr_arg(
                 try:
                     if rgb_mode:
                         return hex2rgb(val, allow_short=True)
-                    return hex2termhex(val, allow_short=True)
+                    return hex2termhex(
+                        val,
+                        allow_short=True,
+                        match=match,
+                        palette=palette
+                    )
                 except ValueError:
                     raise InvalidColr(val)
             raise InvalidColr(intval)
@@ -640,6 +1010,52 @@ def parse_colr_arg(
         return intval
 
 
+def set_color_depth(depth: Optional[int]=None) -> None:
+    """ Downsample all extended/rgb codes from Colr and the convenience
+        color() function to a color depth, for terminals that can't
+        display them. Colr(depth=...) overrides this for one Colr.
+        Arguments:
+            depth  : 16 for basic/light codes only, 256 for extended codes,
+                     or None to use codes as-is.
+    """
+    global _color_depth
+    _color_depth = validate_color_depth(depth)
+
+
+def set_combined_codes(enabled: Optional[bool]=True) -> None:
+    """ Merge the reset, style, back, and fore codes that Colr and the
+        convenience color() function use for each piece of text into a
+        single escape code (see merge_codes()).
+        Colr(combined=...) overrides this for one Colr.
+    """
+    global _combined_codes
+    _combined_codes = bool(enabled)
+
+
+def split_codes(s: str) -> List[str]:
+    """ Split escape codes into a single escape code for each part. This is
+        the opposite of merge_codes().
+        Codes that are not combined are returned as-is, and anything that
+        is not an escape code is ignored.
+        Example:
+            split_codes('\033[1;48;5;20;38;5;196m')
+            >> ['\033[1m', '\033[48;5;20m', '\033[38;5;196m']
+    """
+    parts = []  # type: List[str]
+    for params in codepat.findall(s):
+        nums = params.split(';')
+        numcount = len(nums)
+        i = 0
+        while i < numcount:
+            size = 1
+            if (nums[i] in ('38', '48')) and (i + 1 < numcount):
+                # Extended (38;5;n) or rgb (38;2;r;g;b) fore/back.
+                size = {'5': 3, '2': 5}.get(nums[i + 1], 1)
+            parts.append(codeformat(';'.join(nums[i:i + size])))
+            i += size
+    return parts
+
+
 def strip_codes(s: str) -> str:
     """ Strip all color codes from a string. """
     return codepat.sub('', str(s or ''))
@@ -667,32 +1083,96 @@ def try_parse_int(
     return n
 
 
+def validate_color_depth(depth: Optional[int]) -> Optional[int]:
+    """ Return `depth` if it is one of `color_depths`, otherwise raise
+        ValueError.
+    """
+    if depth not in color_depths:
+        raise ValueError(
+            'Expecting a color depth of {}, got: {!r}'.format(
+                ', '.join(str(d) for d in color_depths),
+                depth,
+            )
+        )
+    return depth
+
+
+def visible_width(s: str) -> int:
+    """ Return the number of terminal columns a string takes up, without
+        escape codes. Wide (East Asian/emoji) characters count as 2 columns,
+        and combining/zero-width characters count as 0.
+    """
+    s = str(s or '')
+    if '\033' in s:
+        s = strip_codes(s)
+    if _isascii(s):
+        return len(s)
+    return sum(map(_char_width, s))
+
+
 @total_ordering
 class Colr(object):
 
     """ This class colorizes text for an ansi terminal. """
+    __slots__ = (
+        '__weakref__',
+        '_data',
+        '_runs',
+        '_segments',
+        '_stripped',
+        '_width',
+        'combined',
+        'depth',
+        'palette',
+    )
+    # Attributes that are built from the spans when they are needed.
+    # They are not copied/pickled (see __getstate__()).
+    _cache_attrs = ('_data', '_runs', '_stripped', '_width')
 
     def __init__(
             self,
             text: Optional[str]=None,
             fore: Optional[ColorArg]=None,
             back: Optional[ColorArg]=None,
-            style: Optional[str]=None) -> None:
-        """ Initialize a Colr object with text and color options. """
+            style: Optional[str]=None,
+            depth: Optional[int]=None,
+            palette: Optional[Union[str, Palette]]=None,
+            combined: Optional[bool]=None) -> None:
+        """ Initialize a Colr object with text and color options.
+            If `depth` is set, all codes for this Colr are downsampled to
+            that color depth (see set_color_depth()).
+            If `palette` is set, hex/rgb values are matched against that
+            Palette, or registered palette name (see colr.trans.palettes).
+            If `combined` is set, it overrides set_combined_codes() for
+            codes from this Colr.
+        """
+        self.depth = validate_color_depth(depth)
+        self.palette = None if palette is None else get_palette(palette)
+        self.combined = combined
         # Can be initialized with colored text, not required though.
-        self.data = self.color(
-            text,
-            fore=fore,
-            back=back,
-            style=style
-        )
+        # Spans are rendered into .data when it is needed (see data).
+        self._segments = [
+            self._color_span(text, fore=fore, back=back, style=style)
+        ]  # type: List[ColrSpan]
+        # Rendered .data, stripped() text, _slice_index(), and
+        # visible_width(), until the spans change.
+        self._data = None  # type: Optional[str]
+        self._stripped = None  # type: Optional[str]
+        self._runs = None  # type: Optional[Tuple[List[int], List[Any]]]
+        self._width = None  # type: Optional[int]
 
     def __add__(self, other: 'Colr') -> 'Colr':
         """ Allow the old string concat methods through addition. """
         if isinstance(other, self.__class__):
-            return self.__class__(''.join((self.data, other.data)))
+            return self._from_spans(
+                self._segments + other._segments,
+                like=self,
+            )
         elif isinstance(other, str):
-            return self.__class__(''.join((self.data, other)))
+            return self._from_spans(
+                self._segments + [ColrSpan('', other, '')],
+                like=self,
+            )
 
         raise TypeError(
             'Colr cannot be added to non Colr/str type: {}'.format(
@@ -713,10 +1193,10 @@ class Colr(object):
 
     def __call__(self, text=None, fore=None, back=None, style=None):
         """ Append text to this Colr object. """
-        self.data = ''.join((
-            self.data,
-            self.color(text=text, fore=fore, back=back, style=style)
-        ))
+        self._segments.append(
+            self._color_span(text=text, fore=fore, back=back, style=style)
+        )
+        self._data = self._stripped = self._runs = self._width = None
         return self
 
     def __dir__(self):
@@ -787,28 +1267,96 @@ class Colr(object):
 
     def __getattr__(self, attr):
         """ If the attribute matches a fore, back, or style name,
-            return the color() function. Otherwise, return known
-            attributes and raise AttributeError for others.
+            return the chained() method for it. Methods for valid codes are
+            added to the class, so they are found like any other method
+            after the first time (see _attr_is_cacheable()).
+            Otherwise, return str attributes for self.data, and raise
+            AttributeError for others.
         """
+        if attr in (
+                '_data', '_runs', '_segments', '_stripped', '_width',
+                'data'):
+            # Not initialized yet (copy/unpickle), .data is not usable.
+            raise AttributeError(attr)
         knownmethod = self._attr_to_method(attr)
         if knownmethod is not None:
-            return knownmethod
+            cls = type(self)
+            if cls._attr_is_cacheable(attr):
+                setattr(cls, attr, knownmethod)
+            return knownmethod.__get__(self, cls)
 
         try:
-            val = self.__getattribute__(attr)
-        except AttributeError as ex:
-            try:
-                val = self.data.__getattribute__(attr)
-            except AttributeError:
-                raise AttributeError(ex)
-        return val
+            return getattr(self.data, attr)
+        except AttributeError:
+            raise AttributeError(
+                '\'{}\' object has no attribute \'{}\''.format(
+                    type(self).__name__,
+                    attr,
+                )
+            )
+
+    def __getstate__(self):
+        """ Copy/pickle a new list of spans, so copies never share it.
+            Only the spans and settings are kept, the caches are built
+            again when they are needed.
+        """
+        # Subclasses without __slots__ may have a __dict__.
+        state = dict(getattr(self, '__dict__', {}))
+        skipped = ('__weakref__', ) + self._cache_attrs
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, '__slots__', ()):
+                if attr not in skipped:
+                    state[attr] = getattr(self, attr)
+        state['_segments'] = list(self._segments)
+        return state
 
     def __getitem__(self, key):
-        """ Allow subscripting self.data. This will ignore any escape codes,
-            because otherwise it would be just about useless.
+        """ Allow subscripting self.data. Indexes are for the text without
+            escape codes, because otherwise it would be just about useless,
+            but each character keeps its colors/style.
             Returns another Colr instance.
         """
-        return self.__class__(self.stripped()[key])
+        length = self.visible_len()
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+        else:
+            start = operator.index(key)
+            if start < 0:
+                start += length
+            if not (0 <= start < length):
+                raise IndexError('Colr index out of range')
+            stop, step = start + 1, 1
+
+        starts, runs = self._slice_index()
+        # Pieces of text for each run of codes: [codes, [text, ...]]
+        pieces = []  # type: List[List[Any]]
+        if step == 1:
+            i = bisect_right(starts, start) - 1
+            while (i < len(runs)) and (start < stop):
+                text, codes = runs[i]
+                runstart = starts[i]
+                pieces.append(
+                    [codes, [text[start - runstart:stop - runstart]]]
+                )
+                start = runstart + len(text)
+                i += 1
+        else:
+            for offset in range(start, stop, step):
+                i = bisect_right(starts, offset) - 1
+                text, codes = runs[i]
+                char = text[offset - starts[i]]
+                if pieces and (pieces[-1][0] == codes):
+                    pieces[-1][1].append(char)
+                else:
+                    pieces.append([codes, [char]])
+
+        return self._from_spans(
+            [
+                ColrSpan(codes, ''.join(texts), closing_code if codes else '')
+                for codes, texts in pieces
+            ],
+            like=self,
+        )
 
     def __hash__(self):
         """ A Colr's hash value is based on self.data. """
@@ -816,7 +1364,7 @@ class Colr(object):
 
     def __len__(self):
         """ Return len() for any built up string data. This will count color
-            codes, so it's not that useful.
+            codes, so it's not that useful. See visible_len().
         """
         return len(self.data)
 
@@ -841,14 +1389,20 @@ class Colr(object):
                 )
             )
 
-        return self.__class__(self.data * n)
+        return self._from_spans(self._segments * n, like=self)
 
     def __radd__(self, other):
         """ Allow a Colr to be added to a str. """
         if isinstance(other, self.__class__):
-            return self.__class__(''.join((other.data, self.data)))
+            return self._from_spans(
+                other._segments + self._segments,
+                like=other,
+            )
         elif isinstance(other, str):
-            return self.__class__(''.join((other, self.data)))
+            return self._from_spans(
+                [ColrSpan('', other, '')] + self._segments,
+                like=self,
+            )
 
         raise TypeError(
             'Colr cannot be added to non Colr/str type: {}'.format(
@@ -862,41 +1416,131 @@ class Colr(object):
     def __repr__(self):
         return repr(self.data)
 
+    def __setstate__(self, state):
+        """ Restore a copied/pickled Colr. Older pickles may only have a
+            rendered `data` string, so the settings start with their
+            defaults. Caches are never restored, even from older pickles
+            that have them.
+        """
+        state = dict(state)
+        data = state.pop('data', None)
+        for attr in ('depth', 'palette', 'combined'):
+            object.__setattr__(self, attr, None)
+        object.__setattr__(self, '_segments', [ColrSpan('', data or '', '')])
+        for attr in self._cache_attrs:
+            state.pop(attr, None)
+            object.__setattr__(self, attr, None)
+        for attr, value in state.items():
+            object.__setattr__(self, attr, value)
+
     def __str__(self):
         return self.data
 
-    def _attr_to_method(self, attr):
-        """ Return the correct color function by method name.
-            Uses `partial` to build kwargs on the `chained` func.
+    @classmethod
+    def _attr_is_cacheable(cls, attr):
+        """ Return True if a color method name can be added to the class.
+            Only names with valid codes are added, written one way, so
+            there is a limited number of them. Others, like 'f_999' or
+            'f_0001', still work but are looked up each time.
+        """
+        kwarg = cls._attr_to_kwarg(attr)
+        if kwarg is None:
+            return False
+        kwarg_key, value = kwarg
+        if not isinstance(value, int):
+            # Fore/back/style names, validated by _attr_to_kwarg().
+            return (kwarg_key != 'back') or (
+                attr in ('bg{}'.format(value), 'bg_{}'.format(value))
+            )
+        name = attr.partition('_')[2]
+        if (name != str(value)) and (name not in name_data):
+            return False
+        formatter = format_back if kwarg_key == 'back' else format_fore
+        try:
+            formatter(value, extended=True)
+        except InvalidColr:
+            return False
+        return True
+
+    @classmethod
+    def _attr_to_method(cls, attr):
+        """ Return the correct color method function by method name.
+            The function calls `chained` with the fore/back/style keyword
+            argument for the name, like functools.partial would.
             On failure/unknown name, returns None.
         """
+        kwarg = cls._attr_to_kwarg(attr)
+        if kwarg is None:
+            return None
+        kwarg_key, value = kwarg
+
+        def color_method(self, *args, **kwargs):
+            kwargs.setdefault(kwarg_key, value)
+            return self.chained(*args, **kwargs)
+
+        color_method.__name__ = attr
+        color_method.__qualname__ = '{}.{}'.format(cls.__name__, attr)
+        color_method.__doc__ = (
+            'Chained method for {}={!r}, see chained().'.format(
+                kwarg_key,
+                value,
+            )
+        )
+        return color_method
 
+    @classmethod
+    def _attr_to_kwarg(cls, attr):
+        """ Return the (kwarg_key, value) for chained() for a method name.
+            On failure/unknown name, returns None.
+        """
         if attr in codes['fore']:
             # Fore method
-            return partial(self.chained, fore=attr)
+            return ('fore', attr)
         elif attr in codes['style']:
             # Style method
-            return partial(self.chained, style=attr)
+            return ('style', attr)
         elif attr.startswith('bg'):
             # Back method
             name = attr[2:].lstrip('_')
             if name in codes['back']:
-                return partial(self.chained, back=name)
+                return ('back', name)
         elif attr.startswith(('b256_', 'b_')):
             # Back 256 method
             # Remove the b256_ portion.
             name = attr.partition('_')[2]
-            return self._ext_attr_to_partial(name, 'back')
+            return cls._ext_attr_to_kwarg(name, 'back')
         elif attr.startswith(('f256_', 'f_')):
             # Fore 256 method
             name = attr.partition('_')[2]
-            return self._ext_attr_to_partial(name, 'fore')
+            return cls._ext_attr_to_kwarg(name, 'fore')
 
         return None
 
-    def _ext_attr_to_partial(self, name, kwarg_key):
-        """ Convert a string like '233' or 'aliceblue' into partial for
-            self.chained.
+    def _expand_tabs(self, tabsize=8):
+        """ Return a Colr with the tabs in the text replaced by spaces,
+            like str.expandtabs(), keeping the colors/style for each
+            piece of text. Columns are counted across the pieces of text,
+            and start over after each newline.
+        """
+        spans = []  # type: List[ColrSpan]
+        column = 0
+        for text, codes in self._slice_index()[1]:
+            if '\t' in text:
+                # Only the column within a tab stop changes the result.
+                pad = column % tabsize
+                text = ('x' * pad + text).expandtabs(tabsize)[pad:]
+            lastline = text.rfind('\n')
+            if lastline == -1:
+                column += len(text)
+            else:
+                column = len(text) - lastline - 1
+            spans.append(ColrSpan(codes, text, closing_code if codes else ''))
+        return self._from_spans(spans, like=self)
+
+    @staticmethod
+    def _ext_attr_to_kwarg(name, kwarg_key):
+        """ Convert a string like '233' or 'aliceblue' into a
+            (kwarg_key, value) for chained().
         """
         try:
             intval = int(name)
@@ -906,16 +1550,45 @@ class Colr(object):
             if info is None:
                 # Not an int value or name_data name.
                 return None
-            kws = {kwarg_key: info['code']}
-            return partial(self.chained, **kws)
+            return (kwarg_key, info['code'])
         # Integer str passed, use the int value.
-        kws = {kwarg_key: intval}
-        return partial(self.chained, **kws)
+        return (kwarg_key, intval)
+
+    @classmethod
+    def _from_data(cls, data, like=None):
+        """ Create a Colr from an already rendered str, without parsing any
+            color arguments. This is the same as cls(data), only faster.
+            See _from_spans() for `like`.
+        """
+        return cls._from_spans([ColrSpan('', data, '')], like=like)
+
+    @classmethod
+    def _from_spans(cls, spans, like=None):
+        """ Create a Colr from a list of ColrSpans, without parsing any
+            color arguments. The list is used as-is, not copied.
+            Operators and methods that return a new Colr use this, or
+            _from_data(), passing themselves as `like` so the
+            depth/palette/combined settings are kept by the new Colr.
+            Arguments:
+                spans : A list of ColrSpans.
+                like  : A Colr to copy the settings from.
+                        Default: No settings, like Colr().
+        """
+        colr = cls.__new__(cls)
+        if like is None:
+            colr.depth = colr.palette = colr.combined = None
+        else:
+            colr.depth = like.depth
+            colr.palette = like.palette
+            colr.combined = like.combined
+        colr._segments = spans
+        colr._data = colr._stripped = colr._runs = colr._width = None
+        return colr
 
     def _gradient_black_line(
             self, text, start, step=1,
             fore=None, back=None, style=None, reverse=False, rgb_mode=False):
-        """ Yield colorized characters,
+        """ Return a list of ColrSpans for colorized characters,
             within the 24-length black gradient.
         """
         if start < 232:
@@ -926,7 +1599,7 @@ class Colr(object):
             codes = list(range(start, 231, -1))
         else:
             codes = list(range(start, 256))
-        return ''.join((
+        return self._render_spans(
             self._iter_text_wave(
                 text,
                 codes,
@@ -936,13 +1609,13 @@ class Colr(object):
                 style=style,
                 rgb_mode=rgb_mode
             )
-        ))
+        )
 
     def _gradient_black_lines(
             self, text, start, step=1,
             fore=None, back=None, style=None, reverse=False,
             movefactor=2, rgb_mode=False):
-        """ Yield colorized characters,
+        """ Return a list of ColrSpans for colorized characters,
             within the 24-length black gradient,
             treating each line separately.
         """
@@ -953,7 +1626,7 @@ class Colr(object):
             # Increase the start for each line.
             def factor(i):
                 return start + (i * movefactor)
-        return '\n'.join((
+        return self._join_span_lines(
             self._gradient_black_line(
                 line,
                 start=factor(i),
@@ -965,13 +1638,13 @@ class Colr(object):
                 rgb_mode=rgb_mode,
             )
             for i, line in enumerate(text.splitlines())
-        ))
+        )
 
     def _gradient_rgb_line(
             self, text, start, stop, step=1,
             fore=None, back=None, style=None):
-        """ Yield colorized characters, morphing from one rgb value to
-            another.
+        """ Return a list of ColrSpans for colorized characters, morphing
+            from one rgb value to another.
         """
         return self._gradient_rgb_line_from_morph(
             text,
@@ -983,8 +1656,8 @@ class Colr(object):
 
     def _gradient_rgb_line_from_morph(
             self, text, morphlist, fore=None, back=None, style=None):
-        """ Yield colorized characters, morphing from one rgb value to
-            another.
+        """ Return a list of ColrSpans for colorized characters, morphing
+            from one rgb value to another.
         """
         try:
             listlen = len(morphlist)
@@ -1000,7 +1673,7 @@ class Colr(object):
         if iterstep > 1:
             # Rebuild the morphlist, skipping some.
             usevals = [usevals[i] for i in range(0, listlen, iterstep)]
-        return ''.join((
+        return self._render_spans(
             self._iter_text_wave(
                 text,
                 usevals,
@@ -1009,13 +1682,13 @@ class Colr(object):
                 style=style,
                 rgb_mode=False,
             )
-        ))
+        )
 
     def _gradient_rgb_lines(
             self, text, start, stop, step=1,
             fore=None, back=None, style=None, movefactor=None):
-        """ Yield colorized characters, morphing from one rgb value to
-            another. This treats each line separately.
+        """ Return a list of ColrSpans for colorized characters, morphing
+            from one rgb value to another. This treats each line separately.
         """
         morphlist = list(self._morph_rgb(start, stop, step=step))
         if movefactor:
@@ -1044,7 +1717,7 @@ class Colr(object):
                             morphlist.insert(0, val)
                     return morphlist
 
-        return '\n'.join((
+        return self._join_span_lines(
             self._gradient_rgb_line_from_morph(
                 line,
                 move() if movefactor else morphlist,
@@ -1053,12 +1726,121 @@ class Colr(object):
                 style=style,
             )
             for i, line in enumerate(text.splitlines())
-        ))
+        )
+
+    @staticmethod
+    def _iter_flat(items):
+        """ Yield items from nested iterables, without building any lists.
+            str, bytes, and Colrs are not flattened, and items that are not
+            iterable are yielded as-is.
+        """
+        # Iterators for each level of nesting, the innermost is last.
+        stack = [iter(items)]
+        while stack:
+            for item in stack[-1]:
+                if not isinstance(item, (str, bytes, Colr)):
+                    try:
+                        stack.append(iter(item))
+                    except TypeError:
+                        # Not iterable.
+                        pass
+                    else:
+                        break
+                yield item
+            else:
+                stack.pop()
+
+    def _iter_render_codes(self, runs):
+        """ Render (text, fore, back, style) runs, yielding (codes, text)
+            for each run while tracking the terminal's current attributes.
+            `runs` may be any iterable, and is only consumed once.
+            Only the codes that change between runs are used, and a single
+            reset code is used at the end, as (closing_code, ''). Text that
+            already has escape codes is used as-is, with all codes used
+            again for the run after it.
+            The output looks the same as joining self.color() for each run.
+        """
+        if _disabled:
+            for text, _, _, _ in runs:
+                if text:
+                    yield ('', text)
+            return
+        combined = _combined_codes if self.combined is None else self.combined
+        color_code = self.color_code
+        # (style, back, fore) codes for each (fore, back, style) used.
+        states = {}  # type: Dict[Tuple[Any, ...], Tuple[str, str, str]]
+        # Codes used to go from one state to another.
+        transitions = {}  # type: Dict[Tuple[Any, Any], str]
+        # Current (style, back, fore) codes, or None when unknown.
+        current = ('', '', '')  # type: Optional[Tuple[str, str, str]]
+        for text, fore, back, style in runs:
+            if not text:
+                continue
+            if isinstance(style, ColrStyle):
+                # Precompiled codes, fore/back are not used.
+                state = style.codes
+            else:
+                key = (fore, back, style)
+                try:
+                    state = states[key]
+                except (KeyError, TypeError):
+                    state = (
+                        color_code(style=style),
+                        color_code(back=back),
+                        color_code(fore=fore),
+                    )
+                    with suppress(TypeError):
+                        states[key] = state
+            try:
+                code = transitions[(current, state)]
+            except KeyError:
+                if current is None:
+                    codes = [closing_code]
+                    codes.extend(state)
+                elif state == current:
+                    codes = []
+                elif (
+                        (current[0] and (current[0] != state[0])) or
+                        (current[1] and not state[1]) or
+                        (current[2] and not state[2])):
+                    # Attributes can only be removed by resetting them all.
+                    codes = [closing_code]
+                    codes.extend(state)
+                else:
+                    codes = [
+                        new for old, new in zip(current, state) if new != old
+                    ]
+                code = ''.join(codes)
+                if code and combined:
+                    code = merge_codes(code)
+                transitions[(current, state)] = code
+            yield (code, text)
+            if '\033[' in text:
+                # Unknown attributes, unless the text resets them.
+                current = (
+                    ('', '', '') if text.rstrip().endswith(closing_code)
+                    else None
+                )
+            else:
+                current = state
+        if (current is None) or any(current):
+            yield (closing_code, '')
+
+    def _iter_render_runs(self, runs):
+        """ Render (text, fore, back, style) runs, yielding str chunks.
+            See _iter_render_codes().
+        """
+        for code, text in self._iter_render_codes(runs):
+            if code:
+                yield code
+            if text:
+                yield text
 
     def _iter_text_wave(
             self, text, numbers, step=1,
             fore=None, back=None, style=None, rgb_mode=False):
-        """ Yield colorized characters from `text`, using a wave of `numbers`.
+        """ Yield (text, fore, back, style) runs of characters from `text`,
+            using a wave of `numbers`, for _render_spans().
             Arguments:
                 text      : String to be colorized.
                 numbers   : A list/tuple of numbers (256 colors).
@@ -1090,14 +1872,14 @@ class Colr(object):
 
         for value in numbergen:
             lastchar = pos + step
-            yield self.color(
+            yield (
                 text[pos:lastchar],
-                fore=make_color(value) if fore is None else fore,
-                back=make_color(value) if fore is not None else back,
-                style=style
+                make_color(value) if fore is None else fore,
+                make_color(value) if fore is not None else back,
+                style,
             )
             if lastchar >= end:
-                numbergen.send(True)
+                break
             pos = lastchar
 
     @staticmethod
@@ -1150,6 +1932,18 @@ class Colr(object):
                     pos = 1
             i += 1
 
+    @staticmethod
+    def _join_span_lines(lines):
+        """ Join lists of ColrSpans with a newline span, like '\\n'.join().
+            Returns a list of ColrSpans.
+        """
+        spans = []  # type: List[ColrSpan]
+        for i, line in enumerate(lines):
+            if i:
+                spans.append(ColrSpan('', '\n', ''))
+            spans.extend(line)
+        return spans
+
     def _morph_rgb(self, rgb1, rgb2, step=1):
         """ Morph an rgb value into another, yielding each step along the way.
         """
@@ -1184,37 +1978,11 @@ class Colr(object):
                         pos1[x] = pos2[x]
         yield tuple(pos1)
 
-    def _rainbow_color(self, freq, i):
-        """ Calculate a single hexcode value for a piece of a rainbow.
-            Arguments:
-                freq  : "Tightness" of colors (see self.rainbow())
-                i     : Index of character in string to colorize.
-        """
-        return '{:02x}{:02x}{:02x}'.format(*self._rainbow_rgb(freq, i))
-
-    def _rainbow_hex_chars(self, s, freq=0.1, spread=3.0, offset=0):
-        """ Iterate over characters in a string to build data needed for a
-            rainbow effect.
-            Yields tuples of (char, hexcode).
-            Arguments:
-                s      : String to colorize.
-                freq   : Frequency/"tightness" of colors in the rainbow.
-                         Best results when in the range 0.0-1.0.
-                         Default: 0.1
-                spread : Spread/width of colors.
-                         Default: 3.0
-                offset : Offset for start of rainbow.
-                         Default: 0
-        """
-        return (
-            (c, self._rainbow_color(freq, offset + i / spread))
-            for i, c in enumerate(s)
-        )
-
     def _rainbow_line(
             self, text, freq=0.1, spread=3.0, offset=0,
             rgb_mode=False, **colorargs):
         """ Create rainbow using the same offset for all text.
+            Returns a list of ColrSpans.
             Arguments:
                 text       : String to colorize.
                 freq       : Frequency/"tightness" of colors in the rainbow.
@@ -1235,36 +2003,33 @@ class Colr(object):
         fore = colorargs.get('fore', None)
         back = colorargs.get('back', None)
         style = colorargs.get('style', None)
-        if fore:
-            color_args = (lambda value: {
-                'back': value if rgb_mode else hex2term(value),
-                'style': style,
-                'fore': fore
-            })
-        else:
-            color_args = (lambda value: {
-                'fore': value if rgb_mode else hex2term(value),
-                'style': style,
-                'back': back
-            })
-
         if rgb_mode:
-            method = self._rainbow_rgb_chars
+            def convert(value):
+                return value
         else:
-            method = self._rainbow_hex_chars
-        return ''.join(
-            self.color(c, **color_args(hval))
-            for c, hval in method(
-                text,
-                freq=freq,
-                spread=spread,
-                offset=offset)
+            def convert(value):
+                return rgb2termnum(*value, palette=self.palette)
+        chars = self._rainbow_rgb_chars(
+            text,
+            freq=freq,
+            spread=spread,
+            offset=offset
         )
+        if fore:
+            runs = (
+                (c, fore, convert(rgbval), style) for c, rgbval in chars
+            )
+        else:
+            runs = (
+                (c, convert(rgbval), back, style) for c, rgbval in chars
+            )
+        return self._render_spans(runs)
 
     def _rainbow_lines(
             self, text, freq=0.1, spread=3.0, offset=0, movefactor=0,
             rgb_mode=False, **colorargs):
         """ Create rainbow text, using the same offset for each line.
+            Returns a list of ColrSpans.
             Arguments:
                 text       : String to colorize.
                 freq       : Frequency/"tightness" of colors in the rainbow.
@@ -1289,7 +2054,7 @@ class Colr(object):
             # Increase the offset for each line.
             def factor(i):
                 return offset + (i * movefactor)
-        return '\n'.join(
+        return self._join_span_lines(
             self._rainbow_line(
                 line,
                 freq=freq,
@@ -1330,6 +2095,84 @@ class Colr(object):
             for i, c in enumerate(s)
         )
 
+    def _render_runs(self, runs):
+        """ Render (text, fore, back, style) runs into one string.
+            See _iter_render_runs().
+        """
+        return ''.join(self._iter_render_runs(runs))
+
+    def _render_spans(self, runs):
+        """ Render (text, fore, back, style) runs into a list of ColrSpans,
+            one for each run of text with the same colors/style, so the
+            codes are kept out of the text. The last span ends with the
+            reset code. See _iter_render_codes().
+        """
+        spans = []  # type: List[ColrSpan]
+        spancodes = ''
+        texts = []  # type: List[str]
+        end = ''
+        for code, text in self._iter_render_codes(runs):
+            if not text:
+                # The reset code at the end.
+                end = code
+            elif code or not texts:
+                if texts:
+                    spans.append(ColrSpan(spancodes, ''.join(texts), ''))
+                spancodes = code
+                texts = [text]
+            else:
+                texts.append(text)
+        if texts:
+            spans.append(ColrSpan(spancodes, ''.join(texts), end))
+        return spans
+
+    def _slice_index(self):
+        """ Return (starts, runs) for slicing/indexing this Colr.
+            `runs` is a list of (text, codes) for each piece of text without
+            escape codes, with all of the codes that are active for it.
+            `starts` is the offset of each run in the stripped() text, for
+            bisect.
+            The index is kept until this Colr is changed.
+        """
+        if self._runs is not None:
+            return self._runs
+        starts = []  # type: List[int]
+        runs = []  # type: List[Tuple[str, str]]
+        offset = 0
+        combined = _combined_codes if self.combined is None else self.combined
+        # Codes string for each active (styles, back, fore) state.
+        activecodes = {}  # type: Dict[Tuple[Any, str, str], str]
+
+        def add_run(text, active):
+            nonlocal offset
+            codes = activecodes.get(active, None)
+            if codes is None:
+                codes = ''.join(active[0]) + active[1] + active[2]
+                if combined:
+                    codes = merge_codes(codes)
+                activecodes[active] = codes
+            starts.append(offset)
+            runs.append((text, codes))
+            offset += len(text)
+
+        active = ((), '', '')
+        for codes, text, end in self._segments:
+            active = _active_codes(active, codes)
+            if '\033' in text:
+                # Text that already has escape codes in it.
+                pos = 0
+                for match in codepat.finditer(text):
+                    if match.start() > pos:
+                        add_run(text[pos:match.start()], active)
+                    active = _active_codes(active, match.group())
+                    pos = match.end()
+                text = text[pos:]
+            if text:
+                add_run(text, active)
+            active = _active_codes(active, end)
+        self._runs = (starts, runs)
+        return self._runs
+
     def _str_just(
             self, methodname, width, fillchar=' ', squeeze=False,
             **colorkwargs):
@@ -1353,31 +2196,145 @@ class Colr(object):
             newtext = str(colorkwargs.pop('text'))
 
         strfunc = getattr(str, methodname)
+        # The str methods pad by len(), so the width is adjusted for
+        # escape codes and characters that are not 1 column wide.
         if newtext:
             # Operating on text argument, self.data is left alone.
-            strippedtxt = strip_codes(newtext)
-            codelen = len(newtext) - len(strippedtxt)
-            width = width + codelen
+            width = width + (len(newtext) - visible_width(newtext))
             if squeeze:
-                realoldlen = len(self.stripped())
-                width -= realoldlen
-            return self.__class__().join(
-                self,
-                self.__class__(
-                    strfunc(newtext, width, fillchar),
-                    **colorkwargs
-                )
+                width -= self.visible_width()
+            return self + self._from_spans(
+                [
+                    self._color_span(
+                        strfunc(newtext, width, fillchar),
+                        **colorkwargs
+                    ),
+                ],
+                like=self,
             )
 
         # Operating on self.data.
-        strippedtxt = self.stripped()
-        codelen = len(self.data) - len(strippedtxt)
-        width = width + codelen
-        return self.__class__(
-            strfunc(self.data, width, fillchar),
-            **colorkwargs
+        width = width + (len(self.data) - self.visible_width())
+        if not colorkwargs:
+            return self._from_data(
+                strfunc(self.data, width, fillchar),
+                like=self,
+            )
+        return self._from_spans(
+            [
+                self._color_span(
+                    strfunc(self.data, width, fillchar),
+                    **colorkwargs
+                ),
+            ],
+            like=self,
         )
 
+    def _wrap_lines(self, width):
+        """ Yield a list of ColrSpans for each line of text when it is
+            wrapped to `width` columns (see wrap()).
+            Each line only uses the runs from _slice_index() that overlap
+            it, so the whole text is handled in one pass.
+        """
+        if '\t' in self.stripped():
+            # Tabs are expanded first, like textwrap does.
+            yield from self._expand_tabs()._wrap_lines(width)
+            return
+        starts, runs = self._slice_index()
+        runcount = len(runs)
+        i = 0
+        for start, stop in self._wrap_offsets(width):
+            # Skip runs that ended before this line.
+            while (i < runcount) and (starts[i] + len(runs[i][0]) <= start):
+                i += 1
+            spans = []  # type: List[ColrSpan]
+            j = i
+            while (j < runcount) and (starts[j] < stop):
+                text, codes = runs[j]
+                runstart = starts[j]
+                text = text[max(start - runstart, 0):stop - runstart]
+                if text:
+                    spans.append(
+                        ColrSpan(codes, text, closing_code if codes else '')
+                    )
+                j += 1
+            yield spans
+
+    def _wrap_offsets(self, width):
+        """ Return a list of (start, stop) offsets in the stripped() text
+            for each line when it is wrapped to `width` columns.
+            Newlines in the text are kept, and whitespace is dropped where a
+            line is broken, except for indentation at the start of a line
+            from the text. Words longer than `width` are broken up.
+        """
+        try:
+            width = int(width)
+        except ValueError as exint:
+            raise ValueError('Expecting a number for width.') from exint
+        if width < 1:
+            raise ValueError(
+                'Expecting a width of at least 1, got: {}'.format(width)
+            )
+        text = self.stripped()
+        isascii = _isascii(text)
+        lines = []  # type: List[Tuple[int, int]]
+        linestart = lineend = linewidth = 0
+        # Whitespace before the next word, only used if the word fits on
+        # the line.
+        spacestart = spacewidth = 0
+        empty = newline = True
+        for match in wrappat.finditer(text):
+            start, end = match.span()
+            kind = match.lastindex
+            if kind == 1:
+                # Newline.
+                if not empty or newline:
+                    lines.append((linestart, lineend))
+                linestart = lineend = end
+                spacewidth = 0
+                empty = newline = True
+                continue
+            if isascii:
+                wordwidth = end - start
+            else:
+                wordwidth = sum(map(_char_width, match.group()))
+            if kind == 2:
+                # Whitespace.
+                spacestart, spacewidth = start, wordwidth
+                continue
+            if (not empty) and (linewidth + spacewidth + wordwidth > width):
+                if wordwidth <= width:
+                    # The word fits on the next line.
+                    lines.append((linestart, lineend))
+                    empty = True
+                    spacewidth = 0
+            if not empty:
+                linewidth += spacewidth
+            elif newline and spacewidth and (spacewidth < width):
+                # Indentation from the text.
+                linestart, lineend, linewidth = spacestart, start, spacewidth
+            else:
+                linestart, linewidth = start, 0
+            if linewidth + wordwidth > width:
+                # Break up a long word, starting on this line.
+                for offset, char in enumerate(match.group(), start):
+                    cwidth = 1 if isascii else _char_width(char)
+                    if (linewidth + cwidth > width) and (offset > linestart):
+                        # No whitespace is kept at the end of a line.
+                        lines.append(
+                            (linestart, lineend if offset == start else offset)
+                        )
+                        linestart, linewidth = offset, 0
+                    linewidth += cwidth
+            else:
+                linewidth += wordwidth
+            lineend = end
+            spacewidth = 0
+            empty = newline = False
+        if not empty:
+            lines.append((linestart, lineend))
+        return lines
+
     def b_hex(self, value, text=None, fore=None, style=None, rgb_mode=False):
         """ A chained method that sets the back color to an hex value.
             Arguments:
@@ -1396,7 +2353,11 @@ class Colr(object):
                 raise InvalidColr(value)
         else:
             try:
-                colrval = hex2term(value, allow_short=True)
+                colrval = hex2termnum(
+                    value,
+                    allow_short=True,
+                    palette=self.palette
+                )
             except ValueError:
                 raise InvalidColr(value)
         return self.chained(text=text, fore=fore, back=colrval, style=style)
@@ -1444,10 +2405,10 @@ class Colr(object):
                 back  : Name of back color to use.
                 style : Name of style to use.
         """
-        self.data = ''.join((
-            self.data,
-            self.color(text=text, fore=fore, back=back, style=style),
-        ))
+        self._segments.append(
+            self._color_span(text=text, fore=fore, back=back, style=style)
+        )
+        self._data = self._stripped = self._runs = self._width = None
         return self
 
     def color(self, text=None, fore=None, back=None, style=None):
@@ -1455,9 +2416,17 @@ class Colr(object):
             Raises InvalidColr for invalid color names.
             The 'reset_all' code is appended if text is given.
         """
+        return ''.join(
+            self._color_span(text=text, fore=fore, back=back, style=style)
+        )
+
+    def _color_span(self, text=None, fore=None, back=None, style=None):
+        """ Like color(), but returns the (codes, text, end) ColrSpan
+            instead of joining it.
+        """
         text = str(text) if text is not None else ''
         if _disabled:
-            return text
+            return ColrSpan('', text, '')
         has_args = (
             (fore is not None) or
             (back is not None) or
@@ -1470,14 +2439,18 @@ class Colr(object):
             end = closing_code
         else:
             end = ''
-        return ''.join((
+        return ColrSpan(
             self.color_code(fore=fore, back=back, style=style),
             text,
             end,
-        ))
+        )
 
-    def color_code(self, fore=None, back=None, style=None):
-        """ Return the codes for this style/colors. """
+    def _build_color_code(
+            self, fore=None, back=None, style=None, depth=None,
+            combined=False):
+        """ Build the codes for this style/colors, without the cache.
+            See color_code().
+        """
         # Map from style type to raw code formatter function.
         colorcodes = []
         resetcodes = []
@@ -1489,13 +2462,62 @@ class Colr(object):
                 continue
             # Get escape code for this style.
             code = self.get_escape_code(stype, stylearg)
+            if depth and (stype != 'style'):
+                code = downsample_code(code, depth, palette=self.palette)
             stylename = str(stylearg).lower()
             if stylename.startswith('reset'):
                 resetcodes.append(code)
             else:
                 colorcodes.append(code)
         # Reset codes come first, to not override colors.
-        return ''.join((''.join(resetcodes), ''.join(colorcodes)))
+        code = ''.join((''.join(resetcodes), ''.join(colorcodes)))
+        if combined:
+            return merge_codes(code)
+        return code
+
+    def color_code(self, fore=None, back=None, style=None):
+        """ Return the codes for this style/colors.
+            Results are cached by argument, see color_code_cache_info().
+        """
+        depth = self.depth or _color_depth
+        combined = _combined_codes if self.combined is None else self.combined
+        cacheable = (
+            (type(fore) in _color_code_key_types) and
+            (type(back) in _color_code_key_types) and
+            (type(style) in _color_code_key_types)
+        )
+        if not cacheable:
+            return self._build_color_code(fore, back, style, depth, combined)
+        key = (
+            type(self),
+            tuple(fore) if type(fore) is list else fore,
+            tuple(back) if type(back) is list else back,
+            style,
+            depth,
+            self.palette,
+            bool(combined),
+        )
+        try:
+            code = _color_code_cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable values inside of a tuple/list.
+            return self._build_color_code(fore, back, style, depth, combined)
+        else:
+            _color_code_stats['hits'] += 1
+            with suppress(KeyError):
+                # May have been evicted by another thread.
+                _color_code_cache.move_to_end(key)
+            return code
+
+        code = self._build_color_code(fore, back, style, depth, combined)
+        _color_code_stats['misses'] += 1
+        _color_code_cache[key] = code
+        if len(_color_code_cache) > _color_code_cache_size:
+            with suppress(KeyError):
+                _color_code_cache.popitem(last=False)
+        return code
 
     def color_dummy(self, text=None, **kwargs):
         """ A wrapper for str() that matches self.color().
@@ -1503,12 +2525,88 @@ class Colr(object):
         """
         return str(text) if text is not None else ''
 
+    @property
+    def data(self):
+        """ The colorized string for this Colr.
+            The spans are rendered the first time .data is used after a
+            change, and the string is kept until the next change.
+        """
+        data = self._data
+        if data is None:
+            segments = self._segments
+            if len(segments) == 1 and not (segments[0][0] or segments[0][2]):
+                # Plain text (or anything assigned to .data) is used as-is.
+                data = segments[0][1]
+            else:
+                data = ''.join([''.join(span) for span in segments])
+            self._data = data
+        return data
+
+    @data.setter
+    def data(self, value):
+        """ Replace the spans with a rendered string, which may already
+            have escape codes in it.
+        """
+        self._segments = [ColrSpan('', value, '')]
+        self._data = value
+        self._stripped = self._runs = self._width = None
+
+    def fill(self, width=70):
+        """ Like textwrap.fill(), wrap the text to `width` columns and
+            join the lines with newlines (see wrap()).
+            Returns a Colr() object.
+        """
+        spans = []  # type: List[ColrSpan]
+        for i, line in enumerate(self._wrap_lines(width)):
+            if i:
+                spans.append(ColrSpan('', '\n', ''))
+            spans.extend(line)
+        return self._from_spans(spans, like=self)
+
     def format(self, *args, **kwargs):
         """ Like str.format, except it returns a Colr. """
-        return self.__class__(self.data.format(*args, **kwargs))
+        return self._from_data(self.data.format(*args, **kwargs), like=self)
+
+    def freeze(self):
+        """ Return an immutable, hashable FrozenColr with the same data. """
+        return FrozenColr._from_spans(list(self._segments), like=self)
 
     def get_escape_code(self, codetype, value):
-        """ Convert user arg to escape code. """
+        """ Convert user arg to escape code.
+            Names, code numbers, and rgb tuples are resolved with a single
+            lookup (see _escape_code_index), hex values are converted
+            once and cached. Anything else, including invalid values, goes
+            through _parse_escape_code().
+        """
+        valuetype = type(value)
+        if valuetype is str:
+            code = _escape_code_index[codetype].get(value.lower(), None)
+            if code is not None:
+                return code
+            if codetype != 'style':
+                code = _hex_escape_code(
+                    value,
+                    codetype == 'back',
+                    self.palette
+                )
+                if code is not None:
+                    return code
+        elif valuetype is int:
+            code = _escape_code_index[codetype].get(value, None)
+            if code is not None:
+                return code
+        elif (valuetype is tuple) and (codetype != 'style'):
+            try:
+                return _format_code(value, backcolor=(codetype == 'back'))
+            except ValueError as ex:
+                raise InvalidColr(value) from ex
+        return self._parse_escape_code(codetype, value)
+
+    def _parse_escape_code(self, codetype, value):
+        """ Convert any user arg to escape code, trying each kind of value
+            in turn. This handles all of the validation for
+            get_escape_code().
+        """
         valuefmt = str(value).lower()
         code = codes[codetype].get(valuefmt, None)
         if code:
@@ -1532,7 +2630,11 @@ class Colr(object):
             )
         # Try as hex.
         with suppress(ValueError):
-            value = int(hex2term(value, allow_short=True))
+            value = hex2termnum(
+                value,
+                allow_short=True,
+                palette=self.palette
+            )
             return converter(value, extended=True)
 
         named_data = name_data.get(valuefmt, None)
@@ -1692,22 +2794,21 @@ class Colr(object):
             method = self._gradient_black_line
 
         if text:
-            return self.__class__(
-                ''.join((
-                    self.data or '',
-                    method(
-                        text,
-                        start or (255 if reverse else 232),
-                        **gradargs)
-                ))
+            return self._from_spans(
+                self._segments + method(
+                    text,
+                    start or (255 if reverse else 232),
+                    **gradargs),
+                like=self,
             )
 
         # Operating on self.data.
-        return self.__class__(
+        return self._from_spans(
             method(
                 self.stripped(),
                 start or (255 if reverse else 232),
-                **gradargs)
+                **gradargs),
+            like=self,
         )
 
     def gradient_rgb(
@@ -1745,26 +2846,25 @@ class Colr(object):
             method = self._gradient_rgb_line
 
         if text:
-            return self.__class__(
-                ''.join((
-                    self.data or '',
-                    method(
-                        text,
-                        start,
-                        stop,
-                        **gradargs
-                    ),
-                ))
+            return self._from_spans(
+                self._segments + method(
+                    text,
+                    start,
+                    stop,
+                    **gradargs
+                ),
+                like=self,
             )
 
         # Operating on self.data.
-        return self.__class__(
+        return self._from_spans(
             method(
                 self.stripped(),
                 start,
                 stop,
                 **gradargs
-            )
+            ),
+            like=self,
         )
 
     def hex(self, value, text=None, back=None, style=None, rgb_mode=False):
@@ -1785,37 +2885,86 @@ class Colr(object):
                 raise InvalidColr(value)
         else:
             try:
-                colrval = hex2term(value, allow_short=True)
+                colrval = hex2termnum(
+                    value,
+                    allow_short=True,
+                    palette=self.palette
+                )
             except ValueError:
                 raise InvalidColr(value)
         return self.chained(text=text, fore=colrval, back=back, style=style)
 
+    def iter_join(self, *colrs, **colorkwargs):
+        """ Like join(), except it yields str chunks of the result, instead
+            of building it.
+            Lists, tuples, generators, and other iterables (dicts, sets,
+            ranges, ...) are flattened lazily, at any depth, so large or
+            nested iterables are never copied.
+            Arguments:
+                colrs  : One or more Colrs/strs, or iterables of them.
+            Keyword Arguments:
+                fore, back, style...
+                see color().
+                style may also be a ColrStyle, for precompiled codes.
+        """
+        sep = self.data
+        items = self._iter_flat(colrs)
+        if not colorkwargs:
+            for i, item in enumerate(items):
+                if i and sep:
+                    yield sep
+                yield str(item)
+            return
+
+        fore = colorkwargs.get('fore', None)
+        back = colorkwargs.get('back', None)
+        style = colorkwargs.get('style', None)
+
+        def iter_runs():
+            for i, item in enumerate(items):
+                if i and sep:
+                    yield (sep, None, None, None)
+                yield (str(item), fore, back, style)
+
+        yield from self._iter_render_runs(iter_runs())
+
     def join(self, *colrs, **colorkwargs):
         """ Like str.join, except it returns a Colr.
             Arguments:
-                colrs  : One or more Colrs. If a list or tuple is passed as an
-                         argument it will be flattened.
+                colrs  : One or more Colrs. If a list, tuple, or other
+                         iterable is passed as an argument it will be
+                         flattened, at any depth (see iter_join()).
+                         str, bytes, and Colrs are never flattened.
             Keyword Arguments:
                 fore, back, style...
                 see color().
-        """
-        flat = []
-        for clr in colrs:
-            if isinstance(clr, (list, tuple, GeneratorType)):
-                # Flatten any lists, at least once.
-                flat.extend(str(c) for c in clr)
-            else:
-                flat.append(str(clr))
+                style may also be a ColrStyle, for precompiled codes.
 
+            Note: Only lists, tuples, and generators were flattened in
+            older versions, and only one level deep. Other iterables,
+            like dicts, sets, and ranges, were passed through str().
+            They are flattened now, so wrap them in str() to keep the
+            old output.
+        """
         if colorkwargs:
-            fore = colorkwargs.get('fore', None)
-            back = colorkwargs.get('back', None)
-            style = colorkwargs.get('style', None)
-            flat = (
-                self.color(s, fore=fore, back=back, style=style)
-                for s in flat
-            )
-        return self.__class__(self.data.join(flat))
+            data = ''.join(self.iter_join(*colrs, **colorkwargs))
+        else:
+            data = self.data.join(map(str, self._iter_flat(colrs)))
+        return self._from_data(data, like=self)
+
+    def join_to(self, file, *colrs, **colorkwargs):
+        """ Like join(), except the result is written to a file-like object
+            as it is built, and this Colr is returned for chaining.
+            Arguments:
+                file   : A file-like object with a writelines() method.
+                colrs  : One or more Colrs/strs, or iterables of them.
+            Keyword Arguments:
+                fore, back, style...
+                see color().
+                style may also be a ColrStyle, for precompiled codes.
+        """
+        file.writelines(self.iter_join(*colrs, **colorkwargs))
+        return self
 
     def ljust(self, width, fillchar=' ', squeeze=False, **kwargs):
         """ s.ljust() doesn't work well on strings with color codes.
@@ -1895,16 +3044,15 @@ class Colr(object):
 
         if text:
             # Prepend existing self.data to the rainbow text.
-            return self.__class__(
-                ''.join((
-                    self.data,
-                    method(text, **rainbowargs)
-                ))
+            return self._from_spans(
+                self._segments + method(text, **rainbowargs),
+                like=self,
             )
 
         # Operate on self.data.
-        return self.__class__(
-            method(self.stripped(), **rainbowargs)
+        return self._from_spans(
+            method(self.stripped(), **rainbowargs),
+            like=self,
         )
 
     def rgb(self, r, g, b, text=None, back=None, style=None):
@@ -1945,8 +3093,247 @@ class Colr(object):
         return str(self)
 
     def stripped(self):
-        """ Return str(strip_codes(self.data)) """
-        return strip_codes(self.data)
+        """ Return str(strip_codes(self.data)), using the text from each
+            span. Only text with escape codes already in it is stripped.
+            The result is kept until this Colr is changed.
+        """
+        stripped = self._stripped
+        if stripped is None:
+            stripped = self._stripped = ''.join([
+                strip_codes(text) if '\033' in text else text
+                for _, text, _ in self._segments
+            ])
+        return stripped
+
+    def visible_len(self):
+        """ Return the length of the text without escape codes, for layout.
+            Unlike len(), escape codes are not counted.
+        """
+        return len(self.stripped())
+
+    def visible_width(self):
+        """ Return the number of terminal columns for the text, for layout.
+            Unlike visible_len(), wide characters count as 2 columns, and
+            combining characters count as 0 (see visible_width()).
+            The result is kept until this Colr is changed.
+        """
+        width = self._width
+        if width is None:
+            stripped = self.stripped()
+            if _isascii(stripped):
+                width = len(stripped)
+            else:
+                width = sum(map(_char_width, stripped))
+            self._width = width
+        return width
+
+    def wrap(self, width=70):
+        """ Like textwrap.wrap(), wrap the text to `width` columns, but
+            escape codes are not counted and each piece of text keeps its
+            colors/style. Every line starts with the codes that are active
+            for it, and ends with a closing code.
+            Newlines in the text are kept, tabs are expanded to spaces
+            (with a tab size of 8, like textwrap), and wide characters
+            count as 2 columns (see visible_width()).
+            Returns a list of Colr() objects, one for each line.
+        """
+        return [
+            self._from_spans(spans, like=self)
+            for spans in self._wrap_lines(width)
+        ]
+
+
+class ColrStyle(object):
+    """ A precompiled fore/back/style, for applying the same colors to many
+        strings. The color arguments are parsed and validated once, into
+        escape code `prefix` and `suffix` strings.
+        ColrStyles can be called on text, used as the style for
+        Colr.join(), and pickled without parsing the arguments again.
+        Example:
+            warning = ColrStyle(fore='red', style='bright')
+            print(warning('Something happened.'))
+            print(Colr(', ').join(names, style=warning))
+    """
+    __slots__ = ('back', 'codes', 'fore', 'prefix', 'style', 'suffix')
+
+    def __init__(
+            self,
+            fore: Optional[ColorArg]=None,
+            back: Optional[ColorArg]=None,
+            style: Optional[str]=None,
+            depth: Optional[int]=None,
+            palette: Optional[Union[str, Palette]]=None,
+            combined: Optional[bool]=None) -> None:
+        """ Compile fore, back, and style into escape codes.
+            Raises InvalidColr/InvalidStyle for invalid values.
+            See Colr() for the `depth`, `palette`, and `combined` arguments.
+            The global settings (set_color_depth(), set_combined_codes())
+            are used when the ColrStyle is created.
+        """
+        colr = Colr(depth=depth, palette=palette, combined=combined)
+        self.fore = fore
+        self.back = back
+        self.style = style
+        # (style, back, fore) codes, for Colr._iter_render_codes().
+        self.codes = (
+            colr.color_code(style=style),
+            colr.color_code(back=back),
+            colr.color_code(fore=fore),
+        )
+        self.prefix = colr.color_code(fore=fore, back=back, style=style)
+        has_args = (fore is not None) or (back is not None) or (
+            style is not None
+        )
+        self.suffix = closing_code if has_args else ''
+
+    def __call__(self, text: Optional[str]=None) -> str:
+        """ Colorize a string, like Colr.color(). """
+        text = str(text) if text is not None else ''
+        if _disabled:
+            return text
+        if (text and self.suffix and
+                (not text.rstrip().endswith(closing_code))):
+            return ''.join((self.prefix, text, self.suffix))
+        return ''.join((self.prefix, text))
+
+    def __eq__(self, other: Any) -> bool:
+        """ ColrStyles are equal when their codes are equal. """
+        if not isinstance(other, ColrStyle):
+            return NotImplemented
+        return (
+            (self.prefix, self.suffix, self.codes) ==
+            (other.prefix, other.suffix, other.codes)
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """ Pickle the compiled codes, so they are not parsed again. """
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def __hash__(self) -> int:
+        return hash((self.prefix, self.suffix, self.codes))
+
+    def __repr__(self) -> str:
+        return '{}(fore={!r}, back={!r}, style={!r})'.format(
+            type(self).__name__,
+            self.fore,
+            self.back,
+            self.style,
+        )
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+
+class FrozenColr(Colr):
+    """ An immutable Colr, for dict keys and caches.
+        The hash is computed once, and equality checks identity first.
+        Appending text or using a color method returns a new FrozenColr,
+        and operations that would not change anything return the same
+        FrozenColr.
+        Example:
+            cell = FrozenColr('ok', 'green')
+            cache[cell] = cell.center(10)
+            warning = cell.bright('!')  # `cell` is not changed.
+    """
+    __slots__ = ('_hash',)
+    # The hash is not pickled either, str hashes are different in other
+    # processes.
+    _cache_attrs = Colr._cache_attrs + ('_hash', )
+
+    def __init__(self, *args, **kwargs) -> None:
+        """ Initialize a FrozenColr, with the same arguments as Colr(). """
+        super().__init__(*args, **kwargs)
+        self._hash = None  # type: Optional[int]
+
+    def __add__(self, other: Union[str, Colr]) -> Colr:
+        if isinstance(other, (Colr, str)) and not other:
+            return self
+        if isinstance(other, Colr):
+            return self._from_spans(
+                self._segments + other._segments,
+                like=self,
+            )
+        return super().__add__(other)
+
+    def __call__(self, text=None, fore=None, back=None, style=None):
+        """ Return a new FrozenColr with text appended. """
+        return self.chained(text=text, fore=fore, back=back, style=style)
+
+    def __eq__(self, other: Any) -> bool:
+        """ FrozenColrs are equal to Colrs with the same .data. """
+        if other is self:
+            return True
+        return isinstance(other, Colr) and (other.data == self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            length = self.visible_len()
+            if key.indices(length) == (0, length, 1):
+                return self
+        return super().__getitem__(key)
+
+    def __hash__(self) -> int:
+        """ Same as Colr's hash, computed once. """
+        if self._hash is None:
+            self._hash = super().__hash__()
+        return self._hash
+
+    def __mul__(self, n: int) -> Colr:
+        if n == 1:
+            return self
+        return super().__mul__(n)
+
+    def __radd__(self, other: Union[str, Colr]) -> Colr:
+        if isinstance(other, (Colr, str)) and not other:
+            return self
+        if isinstance(other, Colr):
+            return self._from_spans(
+                other._segments + self._segments,
+                like=other,
+            )
+        return super().__radd__(other)
+
+    @classmethod
+    def _from_spans(cls, spans, like=None):
+        colr = super()._from_spans(spans, like=like)
+        colr._hash = None
+        return colr
+
+    def chained(self, text=None, fore=None, back=None, style=None):
+        """ Return a new FrozenColr with text appended, or this one if
+            there is nothing to append.
+        """
+        if (text is None) and (fore is None) and (back is None) and (
+                style is None):
+            return self
+        return self._from_spans(
+            self._segments + [
+                self._color_span(text=text, fore=fore, back=back, style=style)
+            ],
+            like=self,
+        )
+
+    @property
+    def data(self):
+        """ The colorized string for this FrozenColr. It can't be set. """
+        return Colr.data.fget(self)
+
+    @data.setter
+    def data(self, value):
+        raise AttributeError(
+            '{} data can\'t be changed.'.format(type(self).__name__)
+        )
+
+    def freeze(self):
+        """ A FrozenColr is already frozen, this returns itself. """
+        return self
+
+    def print(self, *args, **kwargs):
+        """ Chainable print method. Prints self.data, which is not cleared.
+        """
+        print(self, *args, **kwargs)
+        return self
 
 
 class InvalidArg(ValueError):
@@ -2068,6 +3455,8 @@ class InvalidStyle(InvalidColr):
 # Raw code map, available to users.
 codes = _build_codes()
 codes_reverse = _build_codes_reverse(codes)
+# All known names/numbers to escape code, used by Colr.get_escape_code().
+_escape_code_index = _build_escape_code_index(codes, name_data)
 closing_code = '\033[0m'
 
 # Shortcuts.
@@ -19,282 +19,325 @@ Resources:
 
 
 """
+import importlib.util
+import json
+import mmap
+import os
 import re
+import tempfile
+import zlib
+from collections import namedtuple
+from contextlib import suppress
+from functools import lru_cache
 from types import GeneratorType
-from typing import cast, Any, Optional, Sequence, Union
+from typing import (
+    cast,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 # Custom types.
 Numeric = Union[int, str]
 RGB = Sequence[int]
+Lab = Tuple[float, float, float]
+# A function that converts (R, G, B) into a terminal code number.
+Matcher = Callable[[int, int, int], int]
+# A Palette, or the name of a registered one.
+PaletteArg = Union[str, 'Palette']
 
 # Original lookup table provided by Micah Elliott (colortrans.py).
 # Modified to dict by Christopher Welborn.
-term2hex_map = {
-    #    8-bit, RGB hex
+# Now a tuple of RGB hex values, indexed by terminal code number.
+term2hex_table = (
+    # RGB hex, 8-bit
     # Primary 3-bit (8 colors). Unique representation!
-    '00': '000000',
-    '01': '800000',
-    '02': '008000',
-    '03': '808000',
-    '04': '000080',
-    '05': '800080',
-    '06': '008080',
-    '07': 'c0c0c0',
+    '000000',  # 0
+    '800000',  # 1
+    '008000',  # 2
+    '808000',  # 3
+    '000080',  # 4
+    '800080',  # 5
+    '008080',  # 6
+    'c0c0c0',  # 7
 
     # Equivalent "bright" versions of original 8 colors.
-    '08': '808080',
-    '09': 'ff0000',
-    '10': '00ff00',
-    '11': 'ffff00',
-    '12': '0000ff',
-    '13': 'ff00ff',
-    '14': '00ffff',
-    '15': 'ffffff',
+    '808080',  # 8
+    'ff0000',  # 9
+    '00ff00',  # 10
+    'ffff00',  # 11
+    '0000ff',  # 12
+    'ff00ff',  # 13
+    '00ffff',  # 14
+    'ffffff',  # 15
 
     # Strictly ascending.
-    '16': '000000',
-    '17': '00005f',
-    '18': '000087',
-    '19': '0000af',
-    '20': '0000d7',
-    '21': '0000ff',
-    '22': '005f00',
-    '23': '005f5f',
-    '24': '005f87',
-    '25': '005faf',
-    '26': '005fd7',
-    '27': '005fff',
-    '28': '008700',
-    '29': '00875f',
-    '30': '008787',
-    '31': '0087af',
-    '32': '0087d7',
-    '33': '0087ff',
-    '34': '00af00',
-    '35': '00af5f',
-    '36': '00af87',
-    '37': '00afaf',
-    '38': '00afd7',
-    '39': '00afff',
-    '40': '00d700',
-    '41': '00d75f',
-    '42': '00d787',
-    '43': '00d7af',
-    '44': '00d7d7',
-    '45': '00d7ff',
-    '46': '00ff00',
-    '47': '00ff5f',
-    '48': '00ff87',
-    '49': '00ffaf',
-    '50': '00ffd7',
-    '51': '00ffff',
-    '52': '5f0000',
-    '53': '5f005f',
-    '54': '5f0087',
-    '55': '5f00af',
-    '56': '5f00d7',
-    '57': '5f00ff',
-    '58': '5f5f00',
-    '59': '5f5f5f',
-    '60': '5f5f87',
-    '61': '5f5faf',
-    '62': '5f5fd7',
-    '63': '5f5fff',
-    '64': '5f8700',
-    '65': '5f875f',
-    '66': '5f8787',
-    '67': '5f87af',
-    '68': '5f87d7',
-    '69': '5f87ff',
-    '70': '5faf00',
-    '71': '5faf5f',
-    '72': '5faf87',
-    '73': '5fafaf',
-    '74': '5fafd7',
-    '75': '5fafff',
-    '76': '5fd700',
-    '77': '5fd75f',
-    '78': '5fd787',
-    '79': '5fd7af',
-    '80': '5fd7d7',
-    '81': '5fd7ff',
-    '82': '5fff00',
-    '83': '5fff5f',
-    '84': '5fff87',
-    '85': '5fffaf',
-    '86': '5fffd7',
-    '87': '5fffff',
-    '88': '870000',
-    '89': '87005f',
-    '90': '870087',
-    '91': '8700af',
-    '92': '8700d7',
-    '93': '8700ff',
-    '94': '875f00',
-    '95': '875f5f',
-    '96': '875f87',
-    '97': '875faf',
-    '98': '875fd7',
-    '99': '875fff',
-    '100': '878700',
-    '101': '87875f',
-    '102': '878787',
-    '103': '8787af',
-    '104': '8787d7',
-    '105': '8787ff',
-    '106': '87af00',
-    '107': '87af5f',
-    '108': '87af87',
-    '109': '87afaf',
-    '110': '87afd7',
-    '111': '87afff',
-    '112': '87d700',
-    '113': '87d75f',
-    '114': '87d787',
-    '115': '87d7af',
-    '116': '87d7d7',
-    '117': '87d7ff',
-    '118': '87ff00',
-    '119': '87ff5f',
-    '120': '87ff87',
-    '121': '87ffaf',
-    '122': '87ffd7',
-    '123': '87ffff',
-    '124': 'af0000',
-    '125': 'af005f',
-    '126': 'af0087',
-    '127': 'af00af',
-    '128': 'af00d7',
-    '129': 'af00ff',
-    '130': 'af5f00',
-    '131': 'af5f5f',
-    '132': 'af5f87',
-    '133': 'af5faf',
-    '134': 'af5fd7',
-    '135': 'af5fff',
-    '136': 'af8700',
-    '137': 'af875f',
-    '138': 'af8787',
-    '139': 'af87af',
-    '140': 'af87d7',
-    '141': 'af87ff',
-    '142': 'afaf00',
-    '143': 'afaf5f',
-    '144': 'afaf87',
-    '145': 'afafaf',
-    '146': 'afafd7',
-    '147': 'afafff',
-    '148': 'afd700',
-    '149': 'afd75f',
-    '150': 'afd787',
-    '151': 'afd7af',
-    '152': 'afd7d7',
-    '153': 'afd7ff',
-    '154': 'afff00',
-    '155': 'afff5f',
-    '156': 'afff87',
-    '157': 'afffaf',
-    '158': 'afffd7',
-    '159': 'afffff',
-    '160': 'd70000',
-    '161': 'd7005f',
-    '162': 'd70087',
-    '163': 'd700af',
-    '164': 'd700d7',
-    '165': 'd700ff',
-    '166': 'd75f00',
-    '167': 'd75f5f',
-    '168': 'd75f87',
-    '169': 'd75faf',
-    '170': 'd75fd7',
-    '171': 'd75fff',
-    '172': 'd78700',
-    '173': 'd7875f',
-    '174': 'd78787',
-    '175': 'd787af',
-    '176': 'd787d7',
-    '177': 'd787ff',
-    '178': 'd7af00',
-    '179': 'd7af5f',
-    '180': 'd7af87',
-    '181': 'd7afaf',
-    '182': 'd7afd7',
-    '183': 'd7afff',
-    '184': 'd7d700',
-    '185': 'd7d75f',
-    '186': 'd7d787',
-    '187': 'd7d7af',
-    '188': 'd7d7d7',
-    '189': 'd7d7ff',
-    '190': 'd7ff00',
-    '191': 'd7ff5f',
-    '192': 'd7ff87',
-    '193': 'd7ffaf',
-    '194': 'd7ffd7',
-    '195': 'd7ffff',
-    '196': 'ff0000',
-    '197': 'ff005f',
-    '198': 'ff0087',
-    '199': 'ff00af',
-    '200': 'ff00d7',
-    '201': 'ff00ff',
-    '202': 'ff5f00',
-    '203': 'ff5f5f',
-    '204': 'ff5f87',
-    '205': 'ff5faf',
-    '206': 'ff5fd7',
-    '207': 'ff5fff',
-    '208': 'ff8700',
-    '209': 'ff875f',
-    '210': 'ff8787',
-    '211': 'ff87af',
-    '212': 'ff87d7',
-    '213': 'ff87ff',
-    '214': 'ffaf00',
-    '215': 'ffaf5f',
-    '216': 'ffaf87',
-    '217': 'ffafaf',
-    '218': 'ffafd7',
-    '219': 'ffafff',
-    '220': 'ffd700',
-    '221': 'ffd75f',
-    '222': 'ffd787',
-    '223': 'ffd7af',
-    '224': 'ffd7d7',
-    '225': 'ffd7ff',
-    '226': 'ffff00',
-    '227': 'ffff5f',
-    '228': 'ffff87',
-    '229': 'ffffaf',
-    '230': 'ffffd7',
-    '231': 'ffffff',
+    '000000',  # 16
+    '00005f',  # 17
+    '000087',  # 18
+    '0000af',  # 19
+    '0000d7',  # 20
+    '0000ff',  # 21
+    '005f00',  # 22
+    '005f5f',  # 23
+    '005f87',  # 24
+    '005faf',  # 25
+    '005fd7',  # 26
+    '005fff',  # 27
+    '008700',  # 28
+    '00875f',  # 29
+    '008787',  # 30
+    '0087af',  # 31
+    '0087d7',  # 32
+    '0087ff',  # 33
+    '00af00',  # 34
+    '00af5f',  # 35
+    '00af87',  # 36
+    '00afaf',  # 37
+    '00afd7',  # 38
+    '00afff',  # 39
+    '00d700',  # 40
+    '00d75f',  # 41
+    '00d787',  # 42
+    '00d7af',  # 43
+    '00d7d7',  # 44
+    '00d7ff',  # 45
+    '00ff00',  # 46
+    '00ff5f',  # 47
+    '00ff87',  # 48
+    '00ffaf',  # 49
+    '00ffd7',  # 50
+    '00ffff',  # 51
+    '5f0000',  # 52
+    '5f005f',  # 53
+    '5f0087',  # 54
+    '5f00af',  # 55
+    '5f00d7',  # 56
+    '5f00ff',  # 57
+    '5f5f00',  # 58
+    '5f5f5f',  # 59
+    '5f5f87',  # 60
+    '5f5faf',  # 61
+    '5f5fd7',  # 62
+    '5f5fff',  # 63
+    '5f8700',  # 64
+    '5f875f',  # 65
+    '5f8787',  # 66
+    '5f87af',  # 67
+    '5f87d7',  # 68
+    '5f87ff',  # 69
+    '5faf00',  # 70
+    '5faf5f',  # 71
+    '5faf87',  # 72
+    '5fafaf',  # 73
+    '5fafd7',  # 74
+    '5fafff',  # 75
+    '5fd700',  # 76
+    '5fd75f',  # 77
+    '5fd787',  # 78
+    '5fd7af',  # 79
+    '5fd7d7',  # 80
+    '5fd7ff',  # 81
+    '5fff00',  # 82
+    '5fff5f',  # 83
+    '5fff87',  # 84
+    '5fffaf',  # 85
+    '5fffd7',  # 86
+    '5fffff',  # 87
+    '870000',  # 88
+    '87005f',  # 89
+    '870087',  # 90
+    '8700af',  # 91
+    '8700d7',  # 92
+    '8700ff',  # 93
+    '875f00',  # 94
+    '875f5f',  # 95
+    '875f87',  # 96
+    '875faf',  # 97
+    '875fd7',  # 98
+    '875fff',  # 99
+    '878700',  # 100
+    '87875f',  # 101
+    '878787',  # 102
+    '8787af',  # 103
+    '8787d7',  # 104
+    '8787ff',  # 105
+    '87af00',  # 106
+    '87af5f',  # 107
+    '87af87',  # 108
+    '87afaf',  # 109
+    '87afd7',  # 110
+    '87afff',  # 111
+    '87d700',  # 112
+    '87d75f',  # 113
+    '87d787',  # 114
+    '87d7af',  # 115
+    '87d7d7',  # 116
+    '87d7ff',  # 117
+    '87ff00',  # 118
+    '87ff5f',  # 119
+    '87ff87',  # 120
+    '87ffaf',  # 121
+    '87ffd7',  # 122
+    '87ffff',  # 123
+    'af0000',  # 124
+    'af005f',  # 125
+    'af0087',  # 126
+    'af00af',  # 127
+    'af00d7',  # 128
+    'af00ff',  # 129
+    'af5f00',  # 130
+    'af5f5f',  # 131
+    'af5f87',  # 132
+    'af5faf',  # 133
+    'af5fd7',  # 134
+    'af5fff',  # 135
+    'af8700',  # 136
+    'af875f',  # 137
+    'af8787',  # 138
+    'af87af',  # 139
+    'af87d7',  # 140
+    'af87ff',  # 141
+    'afaf00',  # 142
+    'afaf5f',  # 143
+    'afaf87',  # 144
+    'afafaf',  # 145
+    'afafd7',  # 146
+    'afafff',  # 147
+    'afd700',  # 148
+    'afd75f',  # 149
+    'afd787',  # 150
+    'afd7af',  # 151
+    'afd7d7',  # 152
+    'afd7ff',  # 153
+    'afff00',  # 154
+    'afff5f',  # 155
+    'afff87',  # 156
+    'afffaf',  # 157
+    'afffd7',  # 158
+    'afffff',  # 159
+    'd70000',  # 160
+    'd7005f',  # 161
+    'd70087',  # 162
+    'd700af',  # 163
+    'd700d7',  # 164
+    'd700ff',  # 165
+    'd75f00',  # 166
+    'd75f5f',  # 167
+    'd75f87',  # 168
+    'd75faf',  # 169
+    'd75fd7',  # 170
+    'd75fff',  # 171
+    'd78700',  # 172
+    'd7875f',  # 173
+    'd78787',  # 174
+    'd787af',  # 175
+    'd787d7',  # 176
+    'd787ff',  # 177
+    'd7af00',  # 178
+    'd7af5f',  # 179
+    'd7af87',  # 180
+    'd7afaf',  # 181
+    'd7afd7',  # 182
+    'd7afff',  # 183
+    'd7d700',  # 184
+    'd7d75f',  # 185
+    'd7d787',  # 186
+    'd7d7af',  # 187
+    'd7d7d7',  # 188
+    'd7d7ff',  # 189
+    'd7ff00',  # 190
+    'd7ff5f',  # 191
+    'd7ff87',  # 192
+    'd7ffaf',  # 193
+    'd7ffd7',  # 194
+    'd7ffff',  # 195
+    'ff0000',  # 196
+    'ff005f',  # 197
+    'ff0087',  # 198
+    'ff00af',  # 199
+    'ff00d7',  # 200
+    'ff00ff',  # 201
+    'ff5f00',  # 202
+    'ff5f5f',  # 203
+    'ff5f87',  # 204
+    'ff5faf',  # 205
+    'ff5fd7',  # 206
+    'ff5fff',  # 207
+    'ff8700',  # 208
+    'ff875f',  # 209
+    'ff8787',  # 210
+    'ff87af',  # 211
+    'ff87d7',  # 212
+    'ff87ff',  # 213
+    'ffaf00',  # 214
+    'ffaf5f',  # 215
+    'ffaf87',  # 216
+    'ffafaf',  # 217
+    'ffafd7',  # 218
+    'ffafff',  # 219
+    'ffd700',  # 220
+    'ffd75f',  # 221
+    'ffd787',  # 222
+    'ffd7af',  # 223
+    'ffd7d7',  # 224
+    'ffd7ff',  # 225
+    'ffff00',  # 226
+    'ffff5f',  # 227
+    'ffff87',  # 228
+    'ffffaf',  # 229
+    'ffffd7',  # 230
+    'ffffff',  # 231
 
     # Gray-scale range.
-    '232': '080808',
-    '233': '121212',
-    '234': '1c1c1c',
-    '235': '262626',
-    '236': '303030',
-    '237': '3a3a3a',
-    '238': '444444',
-    '239': '4e4e4e',
-    '240': '585858',
-    '241': '626262',
-    '242': '6c6c6c',
-    '243': '767676',
-    '244': '808080',
-    '245': '8a8a8a',
-    '246': '949494',
-    '247': '9e9e9e',
-    '248': 'a8a8a8',
-    '249': 'b2b2b2',
-    '250': 'bcbcbc',
-    '251': 'c6c6c6',
-    '252': 'd0d0d0',
-    '253': 'dadada',
-    '254': 'e4e4e4',
-    '255': 'eeeeee',
-}
+    '080808',  # 232
+    '121212',  # 233
+    '1c1c1c',  # 234
+    '262626',  # 235
+    '303030',  # 236
+    '3a3a3a',  # 237
+    '444444',  # 238
+    '4e4e4e',  # 239
+    '585858',  # 240
+    '626262',  # 241
+    '6c6c6c',  # 242
+    '767676',  # 243
+    '808080',  # 244
+    '8a8a8a',  # 245
+    '949494',  # 246
+    '9e9e9e',  # 247
+    'a8a8a8',  # 248
+    'b2b2b2',  # 249
+    'bcbcbc',  # 250
+    'c6c6c6',  # 251
+    'd0d0d0',  # 252
+    'dadada',  # 253
+    'e4e4e4',  # 254
+    'eeeeee',  # 255
+)  # type: Tuple[str, ...]
+
+# Terminal code number -> (R, G, B).
+term2rgb_table = tuple(
+    (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16))
+    for h in term2hex_table
+)  # type: Tuple[Tuple[int, int, int], ...]
+# Terminal code number -> packed 0xRRGGBB int.
+term2packed_table = tuple(
+    int(h, 16) for h in term2hex_table
+)  # type: Tuple[int, ...]
+
+# The original map of zero-padded code str -> hex, for compatibility.
+term2hex_map = {
+    '{:02}'.format(code): hexval
+    for code, hexval in enumerate(term2hex_table)
+}  # type: Dict[str, str]
 
 # Create a map from hex to escape codes.
 # WARNING: This map must be sorted first, for consistency.
@@ -305,6 +348,610 @@ term2hex_map = {
 # Sorting it means that the last duplicated value will always be used.
 hex2term_map = {term2hex_map[k]: k for k in sorted(term2hex_map)}
 
+# Channel values used by the 6x6x6 color cube (codes 16-231).
+_cube_levels = (0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff)
+
+
+def _build_cube_index() -> Tuple[int, ...]:
+    """ Build a 256-entry table of channel value -> nearest cube level index.
+        Ties go to the bigger level, like the original rgb2termhex did.
+    """
+    table = []
+    for part in range(256):
+        for i in range(len(_cube_levels) - 1):
+            s, b = _cube_levels[i], _cube_levels[i + 1]
+            if s <= part <= b:
+                table.append(i if (part - s) < (b - part) else i + 1)
+                break
+    return tuple(table)
+
+
+# Channel value -> nearest cube level index.
+_cube_index = _build_cube_index()
+# Channel value -> that channel's contribution to a cube code number.
+# A terminal code is _cube_red[r] + _cube_green[g] + _cube_blue[b].
+_cube_red = tuple(16 + (i * 36) for i in _cube_index)
+_cube_green = tuple(i * 6 for i in _cube_index)
+_cube_blue = _cube_index
+
+# sRGB channel value -> linear light value, used for CIELAB conversion.
+_srgb_linear = tuple(
+    (c / 255) / 12.92 if (c / 255) <= 0.04045 else
+    (((c / 255) + 0.055) / 1.055) ** 2.4
+    for c in range(256)
+)
+
+
+class _PaletteIndex(object):
+    """ A k-d tree over palette colors in CIELAB space.
+        Finds the perceptually nearest palette entry for a color by
+        visiting roughly O(log n) nodes instead of scanning every entry.
+    """
+    __slots__ = ('root', 'size')
+
+    def __init__(self, colors: Sequence[Tuple[int, RGB]]) -> None:
+        """ Initialize the index from a sequence of (code, (R, G, B)).
+            When several codes share the same color, the last one wins.
+        """
+        unique = {}  # type: Dict[Tuple[int, ...], int]
+        for code, rgb in colors:
+            unique[tuple(rgb)] = code
+        points = [(rgb2lab(*rgb), code) for rgb, code in unique.items()]
+        self.size = len(points)
+        self.root = self._build(points, 0)
+
+    @classmethod
+    def _build(cls, points: List[Tuple[Lab, int]], depth: int) -> Any:
+        """ Recursively build tree nodes of:
+                (lab, code, axis, left_node, right_node)
+        """
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        lab, code = points[mid]
+        return (
+            lab,
+            code,
+            axis,
+            cls._build(points[:mid], depth + 1),
+            cls._build(points[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lab: Lab) -> int:
+        """ Return the code for the nearest palette color to a Lab value.
+            Equally distant colors resolve to the highest code number.
+        """
+        best = [float('inf'), -1]
+
+        def search(node: Any) -> None:
+            nodelab, code, axis, left, right = node
+            dl = lab[0] - nodelab[0]
+            da = lab[1] - nodelab[1]
+            db = lab[2] - nodelab[2]
+            dist = (dl * dl) + (da * da) + (db * db)
+            if (dist < best[0]) or ((dist == best[0]) and (code > best[1])):
+                best[0] = dist
+                best[1] = code
+            diff = lab[axis] - nodelab[axis]
+            if diff < 0:
+                near, far = left, right
+            else:
+                near, far = right, left
+            if near is not None:
+                search(near)
+            if (far is not None) and ((diff * diff) <= best[0]):
+                search(far)
+
+        search(self.root)
+        return best[1]
+
+
+# Lazily built by _get_lab_index(), most users never need it.
+_lab_index = None  # type: Optional[_PaletteIndex]
+
+
+def _get_lab_index() -> _PaletteIndex:
+    """ Return the CIELAB index for all 256 terminal colors, building it
+        on first use.
+    """
+    global _lab_index
+    if _lab_index is None:
+        _lab_index = _PaletteIndex(tuple(enumerate(term2rgb_table)))
+    return _lab_index
+
+
+def _match_cube(r: int, g: int, b: int) -> int:
+    """ Nearest code in the 6x6x6 color cube, matching each channel alone.
+    """
+    return _cube_red[r] + _cube_green[g] + _cube_blue[b]
+
+
+def _match_lab(r: int, g: int, b: int) -> int:
+    """ Perceptually nearest code in all 256 colors (CIELAB distance). """
+    return _get_lab_index().nearest(rgb2lab(r, g, b))
+
+
+def _match_basic(r: int, g: int, b: int) -> int:
+    """ Perceptually nearest code in the 16 basic colors (CIELAB distance).
+    """
+    return _basic_index.nearest(rgb2lab(r, g, b))
+
+
+# Matching modes for rgb -> terminal code conversion.
+# 'cube'  : Snap each channel to the 6x6x6 color cube (codes 16-231).
+# 'lab'   : Nearest of all 256 codes, including the system colors and
+#           the grayscale ramp, by CIELAB distance.
+# 'basic' : Nearest of the 16 basic/light codes (0-15), by CIELAB distance.
+matchers = {
+    'basic': _match_basic,
+    'cube': _match_cube,
+    'lab': _match_lab,
+}  # type: Dict[str, Matcher]
+
+
+# NumPy is optional, and only imported when a batch conversion needs it.
+# Without it, the batch conversions use plain python loops.
+has_numpy = importlib.util.find_spec('numpy') is not None
+_numpy = None  # type: Any
+# Lookup tables as numpy arrays, built by _get_numpy().
+_np_tables = {}  # type: Dict[str, Any]
+# Used to validate joined hex strings for hex2rgb_array().
+_hexpat = re.compile('[0-9a-fA-F]*')
+
+# Classifies a single escape code, used by classify_code().
+# Groups: basic number, 38/48 target, extended number, red, green, blue.
+# Numbers of any length are matched, so out of range codes can be rejected
+# by the caller instead of being mistaken for unknown codes.
+_codeclasspat = re.compile(
+    '\033\\[(?:'
+    '(\\d+)|'
+    '([34]8);(?:5;(\\d+)|2;(\\d+);(\\d+);(\\d+))'
+    ')m'
+)
+# Highest number for a basic SGR code, the light back colors end at 107.
+_max_basic_code = 107
+# Result from classify_code().
+# kind    : 'basic', 'extended', 'rgb', or 'unknown'.
+# target  : 'fore' or 'back' for extended/rgb codes, otherwise None.
+# numbers : Tuple of numbers from the code, (n,) or (r, g, b).
+CodeInfo = namedtuple('CodeInfo', ('kind', 'target', 'numbers'))
+_unknown_code = CodeInfo('unknown', None, ())
+# Max number of distinct escape codes remembered by classify_code().
+_classify_cache_size = 1024
+
+# Version for lookup table cache files, bump when the file format changes.
+_lut_version = 1
+# Lookup tables already built/loaded, by (match, bits, matcher).
+_luts = {}  # type: Dict[Tuple[str, int, Matcher], TermLUT]
+# Colors that a matcher is run on for _lut_fingerprint(): grid cell centers,
+# plus the grayscale ramp.
+_lut_probes = tuple(
+    (r, g, b)
+    for r in range(16, 256, 32)
+    for g in range(16, 256, 32)
+    for b in range(16, 256, 32)
+) + tuple((v, v, v) for v in range(0, 256, 8))
+# Original matchers replaced by enable_lut(), by match name.
+_lut_matchers = {}  # type: Dict[str, Matcher]
+
+
+class TermLUT(object):
+    """ A dense RGB -> terminal code lookup table over a reduced RGB grid.
+        Each grid cell holds a single byte (the code number), so the
+        default 6-bit grid is 64 ** 3 bytes (256KB), and the full 8-bit grid
+        is 256 ** 3 bytes (16MB).
+        Tables can be saved to a cache file and memory-mapped on later runs,
+        so an expensive matcher only runs once per host, and processes on
+        the same host share the table pages.
+    """
+    __slots__ = ('bits', 'name', 'path', 'shift', 'table', '_redshift')
+
+    def __init__(
+            self,
+            table: Any,
+            name: str,
+            bits: Optional[int]=6,
+            path: Optional[str]=None) -> None:
+        """ Initialize a TermLUT from an existing table.
+            Arguments:
+                table : A bytes-like object (bytes, bytearray, mmap).
+                name  : Name of the matching mode used to build the table.
+                bits  : Bits per channel used for the grid (1-8).
+                path  : File path, if the table was loaded from a file.
+        """
+        if not (0 < bits <= 8):
+            raise ValueError(
+                'Expecting 1-8 for lookup table bits, got: {!r}'.format(bits)
+            )
+        if len(table) != (1 << (bits * 3)):
+            raise ValueError(
+                'Expecting {} bytes for a {}-bit lookup table, got: {}'.format(
+                    1 << (bits * 3),
+                    bits,
+                    len(table),
+                )
+            )
+        self.table = table
+        self.name = name
+        self.bits = bits
+        self.path = path
+        self.shift = 8 - bits
+        self._redshift = bits * 2
+
+    def __getitem__(self, rgb: RGB) -> int:
+        """ Return the code number for an (R, G, B) tuple. """
+        r, g, b = rgb
+        return self.lookup(r, g, b)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __repr__(self) -> str:
+        return '{}(name={!r}, bits={!r}, path={!r})'.format(
+            type(self).__name__,
+            self.name,
+            self.bits,
+            self.path,
+        )
+
+    @classmethod
+    def build(
+            cls,
+            matcher: Matcher,
+            name: str,
+            bits: Optional[int]=6) -> 'TermLUT':
+        """ Build a new TermLUT by running `matcher` on the center value of
+            each grid cell.
+        """
+        size = 1 << bits
+        shift = 8 - bits
+        # Center of each grid cell, for each channel.
+        centers = [
+            (i << shift) | ((1 << shift) >> 1)
+            for i in range(size)
+        ]
+        table = bytearray(size ** 3)
+        i = 0
+        for r in centers:
+            for g in centers:
+                for b in centers:
+                    table[i] = matcher(r, g, b)
+                    i += 1
+        return cls(bytes(table), name, bits=bits)
+
+    @classmethod
+    def load(
+            cls,
+            path: str,
+            name: str,
+            bits: Optional[int]=6) -> Optional['TermLUT']:
+        """ Memory-map a TermLUT from a cache file.
+            Returns None if the file is missing or is the wrong size.
+        """
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size != (1 << (bits * 3)):
+                    return None
+                table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
+        return cls(table, name, bits=bits, path=path)
+
+    def lookup(self, r: int, g: int, b: int) -> int:
+        """ Return the code number for an rgb value.
+            No range checking is done, rgb2termnum handles that.
+        """
+        shift = self.shift
+        return self.table[
+            ((r >> shift) << self._redshift) |
+            ((g >> shift) << self.bits) |
+            (b >> shift)
+        ]
+
+    def save(self, path: str) -> None:
+        """ Write this table to a file.
+            The file is written to a temporary file and then moved into place,
+            so other processes never see a partial table.
+        """
+        dirpath = os.path.dirname(path) or '.'
+        os.makedirs(dirpath, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=dirpath, prefix='.colr-lut-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.table)
+            # mkstemp() files are private, the table is meant to be shared.
+            os.chmod(tmppath, 0o644)
+            os.replace(tmppath, path)
+        except EnvironmentError:
+            with suppress(EnvironmentError):
+                os.remove(tmppath)
+            raise
+        self.path = path
+
+
+# Nearest-match indexes already built for palettes, by palette colors.
+# Palettes with the same colors share indexes.
+_palette_indexes = {}  # type: Dict[Tuple[RGB, ...], _PaletteIndex]
+# code -> nearest basic code tables already built, by palette colors.
+_palette_basic_tables = {}  # type: Dict[Tuple[RGB, ...], Tuple[int, ...]]
+# Max number of rgb values remembered by _palette_nearest().
+_palette_nearest_cache_size = 4096
+# Lines in a palette file that set a color. These look like:
+#   1 #dc322f
+#   color1 = dc322f
+#   *.color1: #dc322f   (Xresources)
+_palettelinepat = re.compile(
+    r'^\s*(?:[\w*.-]*?color)?(?P<code>\d{1,3})\s*[:=\s]\s*'
+    r'#?(?P<hexval>[0-9a-fA-F]{6}|[0-9a-fA-F]{3})\s*$'
+)
+
+
+class Palette(object):
+    """ The colors a terminal actually uses for each of the 256 codes.
+        Themes usually change the 16 basic colors, so matching against the
+        xterm defaults picks the wrong codes. Colors that a palette does not
+        set are the xterm defaults.
+        Nearest-match indexes are built on first use, and shared by every
+        palette with the same colors, so switching palettes never rebuilds
+        an index that already exists.
+    """
+    __slots__ = ('colors', 'hexvals', 'name', '_hash', '_xterm')
+
+    def __init__(self, name: str, colors: Optional[Any]=None) -> None:
+        """ Initialize a palette from a dict of {code: color}, or a sequence
+            of colors starting at code 0.
+            Arguments:
+                name   : Name for this palette.
+                colors : Colors for the palette.
+                         Each color can be a hex string or (R, G, B).
+                         Codes can be ints or number strings.
+        """
+        table = list(term2rgb_table)
+        if isinstance(colors, dict):
+            items = colors.items()  # type: Iterable[Tuple[Any, Any]]
+        else:
+            items = enumerate(colors or ())
+        for code, color in items:
+            try:
+                termnum = int(code)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    'Expecting an int or number string for code, got: '
+                    '{!r}'.format(code)
+                )
+            if not (0 <= termnum <= 255):
+                raise ValueError(
+                    'Expecting 0-255 for terminal code, got: {!r}'.format(
+                        termnum
+                    )
+                )
+            table[termnum] = self._parse_color(color)
+        self.name = name
+        self.colors = tuple(table)  # type: Tuple[RGB, ...]
+        self.hexvals = tuple(rgb2hex(*rgb) for rgb in table)
+        self._hash = hash(self.colors)
+        # Palettes with the default colors match like no palette at all.
+        self._xterm = (self.colors == term2rgb_table)
+
+    def __eq__(self, other: Any) -> bool:
+        """ Palettes are equal when their colors are equal. """
+        if not isinstance(other, Palette):
+            return NotImplemented
+        return (self._hash == other._hash) and (self.colors == other.colors)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return '{}({!r})'.format(type(self).__name__, self.name)
+
+    @staticmethod
+    def _parse_color(color: Any) -> RGB:
+        """ Return an (R, G, B) tuple from a hex string or rgb value. """
+        if isinstance(color, str):
+            return tuple(hex2rgb(color, allow_short=True))
+        try:
+            r, g, b = (int(x) for x in color)
+        except (TypeError, ValueError):
+            raise ValueError(
+                'Expecting a hex string or (R, G, B), got: {!r}'.format(color)
+            )
+        if not ((0 <= r <= 255) and (0 <= g <= 255) and (0 <= b <= 255)):
+            raise ValueError(
+                'Expecting 0-255 for RGB code, got: {!r}'.format((r, g, b))
+            )
+        return (r, g, b)
+
+    @property
+    def basic_table(self) -> Tuple[int, ...]:
+        """ Terminal code number -> nearest basic code number (0-15) for
+            this palette. Like term2basic_table, for downsampling.
+        """
+        table = _palette_basic_tables.get(self.colors, None)
+        if table is None:
+            index = self.index(16)
+            table = tuple(
+                index.nearest(rgb2lab(*rgb)) for rgb in self.colors
+            )
+            _palette_basic_tables[self.colors] = table
+        return table
+
+    @classmethod
+    def from_file(cls, path: str, name: Optional[str]=None) -> 'Palette':
+        """ Load a palette from a file.
+            The file can be JSON (a {code: color} object, or a list of
+            colors starting at code 0), or lines of `code hexval`.
+            Lines can also use `code = hexval`, `colorN: #hexval`, or
+            Xresources style (`*.colorN: #hexval`). Lines that don't set a
+            color are ignored.
+            Arguments:
+                path : File to read.
+                name : Name for the palette.
+                       Default: The file name, without the extension.
+        """
+        with open(path, 'r') as f:
+            content = f.read()
+        if content.lstrip().startswith(('{', '[')):
+            colors = json.loads(content)
+        else:
+            colors = {}
+            for line in content.splitlines():
+                match = _palettelinepat.match(line)
+                if match is not None:
+                    colors[match.group('code')] = match.group('hexval')
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        return cls(name, colors)
+
+    def index(self, count: Optional[int]=256) -> _PaletteIndex:
+        """ Return the nearest-match index for the first `count` codes,
+            building it if needed.
+        """
+        colors = self.colors[:count]
+        index = _palette_indexes.get(colors, None)
+        if index is None:
+            index = _PaletteIndex(tuple(enumerate(colors)))
+            _palette_indexes[colors] = index
+        return index
+
+    def nearest(
+            self, r: int, g: int, b: int, match: Optional[str]=None) -> int:
+        """ Return the perceptually nearest code number in this palette.
+            A palette with the xterm colors gives the same codes as
+            rgb2termnum() without a palette, using `match` (and any
+            lookup table from enable_lut()).
+            Arguments:
+                r, g, b : Red, green, and blue values (0-255).
+                match   : 'basic' to only use the 16 basic codes, or 'cube'
+                          to snap to the standard 6x6x6 cube.
+                          Default: All 256 codes, or the 'cube' for a
+                          palette with the xterm colors.
+        """
+        if self._xterm:
+            if not match:
+                return _cube_red[r] + _cube_green[g] + _cube_blue[b]
+            return get_matcher(match)(r, g, b)
+        if match == 'cube':
+            return _match_cube(r, g, b)
+        return _palette_nearest(self, r, g, b, 16 if match == 'basic' else 256)
+
+
+def _get_numpy() -> Any:
+    """ Import numpy and build the array lookup tables on first use. """
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _np_tables['red'] = numpy.array(_cube_red, dtype=numpy.uint8)
+        _np_tables['green'] = numpy.array(_cube_green, dtype=numpy.uint8)
+        _np_tables['blue'] = numpy.array(_cube_blue, dtype=numpy.uint8)
+        _np_tables['term2rgb'] = numpy.array(
+            term2rgb_table,
+            dtype=numpy.uint8
+        )
+        _numpy = numpy
+    return _numpy
+
+
+def _lut_fingerprint(matcher: Matcher) -> str:
+    """ Return a short hex fingerprint of a matcher's results for
+        _lut_probes. It is part of the cache file name for get_lut(), so a
+        table is not loaded for a matcher that was replaced or changed.
+    """
+    return '{:08x}'.format(
+        zlib.crc32(bytes(matcher(r, g, b) for r, g, b in _lut_probes))
+    )
+
+
+@lru_cache(maxsize=_palette_nearest_cache_size)
+def _palette_nearest(
+        palette: Palette, r: int, g: int, b: int, count: int) -> int:
+    """ Return the nearest code number in the first `count` colors of a
+        palette, for Palette.nearest(). Results are cached, because
+        rainbows/gradients look up the same colors for every line.
+    """
+    return palette.index(count).nearest(rgb2lab(r, g, b))
+
+
+def _rgb_array(rgbs: Any) -> Any:
+    """ Convert rgb values into a validated (N, 3) uint8 numpy array.
+        Raises ValueError for bad shapes, types, or values.
+    """
+    np = _get_numpy()
+    arr = np.asarray(rgbs)
+    if arr.size == 0:
+        return np.empty((0, 3), dtype=np.uint8)
+    if (arr.ndim != 2) or (arr.shape[1] != 3):
+        raise ValueError(
+            'Expecting an (N, 3) array of RGB values, got shape: {}'.format(
+                arr.shape
+            )
+        )
+    if not np.issubdtype(arr.dtype, np.integer):
+        raise ValueError(
+            'Expecting integer RGB values, got: {}'.format(arr.dtype)
+        )
+    if (arr.min() < 0) or (arr.max() > 255):
+        bad = arr[((arr < 0) | (arr > 255)).any(axis=1)][0]
+        raise ValueError(
+            'Expecting 0-255 for RGB code, got: {!r}'.format(
+                tuple(bad.tolist())
+            )
+        )
+    return arr.astype(np.uint8, copy=False)
+
+
+@lru_cache(maxsize=_classify_cache_size)
+def classify_code(s: str) -> CodeInfo:
+    """ Classify a single escape code, and parse it's numbers in one pass.
+        Returns a CodeInfo(kind, target, numbers), where `kind` is one of
+        'basic', 'extended', 'rgb', or 'unknown'.
+        Numbers are not range checked, see is_code(), is_ext_code(), and
+        is_rgb_code() for that.
+    """
+    match = _codeclasspat.fullmatch(s)
+    if match is None:
+        return _unknown_code
+    basic, target, ext, r, g, b = match.groups()
+    if basic is not None:
+        return CodeInfo('basic', None, (int(basic),))
+    target = 'fore' if target == '38' else 'back'
+    if ext is not None:
+        return CodeInfo('extended', target, (int(ext),))
+    return CodeInfo('rgb', target, (int(r), int(g), int(b)))
+
+
+def classify_codes(codes: Iterable[str]) -> Iterator[CodeInfo]:
+    """ Batch version of classify_code(), yields a CodeInfo for each code.
+    """
+    return map(classify_code, codes)
+
+
+def disable_lut(match: Optional[str]='lab') -> None:
+    """ Stop using a TermLUT for a matching mode, if enable_lut() was used.
+    """
+    matcher = _lut_matchers.pop(match or 'cube', None)
+    if matcher is not None:
+        matchers[match or 'cube'] = matcher
+
+
+def enable_lut(
+        match: Optional[str]='lab',
+        bits: Optional[int]=6,
+        cache_dir: Optional[str]=None,
+        use_cache: Optional[bool]=True) -> TermLUT:
+    """ Use a TermLUT for a matching mode, instead of running the matcher
+        for every conversion.
+        See get_lut() for arguments.
+        Returns the TermLUT that is used.
+    """
+    match = match or 'cube'
+    lut = get_lut(match, bits=bits, cache_dir=cache_dir, use_cache=use_cache)
+    _lut_matchers.setdefault(match, get_matcher(match))
+    matchers[match] = lut.lookup
+    return lut
+
 
 def fix_hex(hexval: str) -> str:
     hexval = hexval.strip().lstrip('#').lower()
@@ -319,6 +966,91 @@ def fix_hex(hexval: str) -> str:
     return hexval
 
 
+def get_lut(
+        match: Optional[str]='lab',
+        bits: Optional[int]=6,
+        cache_dir: Optional[str]=None,
+        use_cache: Optional[bool]=True) -> TermLUT:
+    """ Return a TermLUT for a matching mode, building it if needed.
+        Tables are kept for the life of the process. When `use_cache` is
+        truthy, tables are memory-mapped from `cache_dir`, and newly built
+        tables are saved there. If the cache can't be written, the table is
+        kept in memory.
+        Arguments:
+            match     : Matching mode name from `matchers`.
+            bits      : Bits per channel for the grid (1-8).
+                        Lower values use less memory and build faster,
+                        but may pick a different color for a few values.
+                        8 bits gives the same results as the matcher.
+            cache_dir : Directory for cache files.
+                        Default: lut_cache_dir()
+            use_cache : Whether to load/save cache files.
+    """
+    match = match or 'cube'
+    # Tables are always built from the real matcher, not a table that
+    # enable_lut() put in its place.
+    matcher = _lut_matchers.get(match, None) or get_matcher(match)
+    key = (match, bits, matcher)
+    lut = _luts.get(key, None)
+    if lut is not None:
+        return lut
+    path = None
+    if use_cache:
+        path = os.path.join(
+            cache_dir or lut_cache_dir(),
+            'lut-v{}-{}-{}-{}.bin'.format(
+                _lut_version,
+                match,
+                bits,
+                _lut_fingerprint(matcher),
+            )
+        )
+        lut = TermLUT.load(path, match, bits=bits)
+    if lut is None:
+        lut = TermLUT.build(matcher, match, bits=bits)
+        if path is not None:
+            with suppress(EnvironmentError):
+                lut.save(path)
+    _luts[key] = lut
+    return lut
+
+
+def get_matcher(match: Optional[str]=None) -> Matcher:
+    """ Return the rgb -> terminal code function for a matching mode name.
+        If `match` is falsey, the default ('cube') is used.
+        Raises ValueError for unknown modes.
+    """
+    if not match:
+        return _match_cube
+    try:
+        return matchers[match]
+    except KeyError:
+        raise ValueError(
+            'Expecting a matching mode ({}), got: {!r}'.format(
+                ', '.join(sorted(matchers)),
+                match,
+            )
+        )
+
+
+def get_palette(palette: PaletteArg) -> Palette:
+    """ Return a registered Palette by name.
+        Palette instances are returned as-is.
+        Raises ValueError for unknown names.
+    """
+    if isinstance(palette, Palette):
+        return palette
+    try:
+        return palettes[palette]
+    except KeyError:
+        raise ValueError(
+            'Expecting a palette name ({}), got: {!r}'.format(
+                ', '.join(sorted(palettes)),
+                palette,
+            )
+        )
+
+
 def hex2rgb(hexval: str, allow_short: bool=False) -> Sequence[int]:
     """ Return a tuple of (R, G, B) from a hex color. """
     if not hexval:
@@ -355,31 +1087,116 @@ def hex2rgb(hexval: str, allow_short: bool=False) -> Sequence[int]:
     return val
 
 
-def hex2term(hexval: str, allow_short: bool=False) -> str:
+def hex2rgb_array(
+        hexvals: Iterable[str],
+        allow_short: bool=False) -> Any:
+    """ Batch version of hex2rgb().
+        Returns an (N, 3) uint8 numpy array, or a list of (R, G, B) tuples
+        when numpy is not installed.
+    """
+    if not has_numpy:
+        return [hex2rgb(h, allow_short=allow_short) for h in hexvals]
+    np = _get_numpy()
+    hexvals = list(hexvals)
+    try:
+        if allow_short:
+            fixed = [fix_hex(h) for h in hexvals]
+        else:
+            fixed = [h.strip().lstrip('#') for h in hexvals]
+    except (AttributeError, TypeError, ValueError):
+        fixed = None
+    if fixed is not None:
+        joined = ''.join(fixed)
+        if (all(len(h) == 6 for h in fixed) and
+                (_hexpat.fullmatch(joined) is not None)):
+            return np.frombuffer(
+                bytes.fromhex(joined),
+                dtype=np.uint8
+            ).reshape(-1, 3).copy()
+    # Bad values somewhere, let hex2rgb() sort them out and raise errors.
+    return np.array(
+        [hex2rgb(h, allow_short=allow_short) for h in hexvals],
+        dtype=np.uint8
+    ).reshape(-1, 3)
+
+
+def hex2term(
+        hexval: str,
+        allow_short: bool=False,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> str:
     """ Convert a hex value into the nearest terminal code number. """
-    return rgb2term(*hex2rgb(hexval, allow_short=allow_short))
+    return rgb2term(
+        *hex2rgb(hexval, allow_short=allow_short),
+        match=match,
+        palette=palette
+    )
 
 
-def hex2termhex(hexval: str, allow_short: bool=False) -> str:
+def hex2termhex(
+        hexval: str,
+        allow_short: bool=False,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> str:
     """ Convert a hex value into the nearest terminal color matched hex. """
-    return rgb2termhex(*hex2rgb(hexval, allow_short=allow_short))
+    return rgb2termhex(
+        *hex2rgb(hexval, allow_short=allow_short),
+        match=match,
+        palette=palette
+    )
+
+
+def hex2termnum(
+        hexval: str,
+        allow_short: bool=False,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> int:
+    """ Convert a hex value into the nearest terminal code number, as an int.
+    """
+    return rgb2termnum(
+        *hex2rgb(hexval, allow_short=allow_short),
+        match=match,
+        palette=palette
+    )
 
 
 def is_code(s: str) -> bool:
     """ Returns True if `s` appears to be a single basic escape code. """
-    return re.match('^\033\\[\\d{1,2}m$', s) is not None
+    info = classify_code(s)
+    return (info.kind == 'basic') and (info.numbers[0] <= _max_basic_code)
 
 
 def is_ext_code(s: str) -> bool:
     """ Returns True if `s` appears to be a single extended 256 escape code.
     """
-    return re.match('^\033\\[((38)|(48));5;\\d{1,3}m$', s) is not None
+    info = classify_code(s)
+    return (info.kind == 'extended') and (info.numbers[0] <= 255)
 
 
 def is_rgb_code(s: str) -> bool:
     """ Returns True if `s` appears to be a single rgb escape code. """
-    pattern = '^\033\\[((38)|(48));2;\\d{1,3};\\d{1,3};\\d{1,3}m'
-    return re.match(pattern, s) is not None
+    info = classify_code(s)
+    return (info.kind == 'rgb') and (max(info.numbers) <= 255)
+
+
+def load_palette(path: str, name: Optional[str]=None) -> Palette:
+    """ Load a palette from a file, and register it by name.
+        See Palette.from_file() for the file format.
+    """
+    palette = Palette.from_file(path, name=name)
+    palettes[palette.name] = palette
+    return palette
+
+
+def lut_cache_dir() -> str:
+    """ Return the default directory for lookup table cache files.
+        This is $XDG_CACHE_HOME/colr, or ~/.cache/colr.
+    """
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME', None) or
+        os.path.join(os.path.expanduser('~'), '.cache'),
+        'colr',
+    )
 
 
 def print_all() -> None:
@@ -391,65 +1208,277 @@ def print_all() -> None:
         )).format(code=code, hexval=term2hex_map[code]))
 
 
+def register_palette(name: str, colors: Any) -> Palette:
+    """ Create a Palette from colors (see Palette()), and register it by
+        name, replacing any palette with the same name.
+    """
+    palette = Palette(name, colors)
+    palettes[name] = palette
+    return palette
+
+
+def rgb2basicnum(r: int, g: int, b: int) -> int:
+    """ Convert an rgb value to the nearest basic code number (0-15), using
+        the color cube and term2basic_table.
+        For the perceptually nearest basic color, use:
+            rgb2termnum(r, g, b, match='basic')
+    """
+    return term2basic_table[rgb2termnum(r, g, b)]
+
+
 def rgb2hex(r: int, g: int, b: int) -> str:
     """ Convert rgb values to a hex code. """
     return '{:02x}{:02x}{:02x}'.format(r, g, b)
 
 
-def rgb2term(r: int, g: int, b: int) -> str:
+def rgb2hex_array(rgbs: Any) -> Any:
+    """ Batch version of rgb2hex().
+        Returns a numpy array of hex strings, or a list of hex strings
+        when numpy is not installed.
+    """
+    if not has_numpy:
+        return [rgb2hex(*rgb) for rgb in rgbs]
+    np = _get_numpy()
+    hexstr = _rgb_array(rgbs).tobytes().hex()
+    return np.array(
+        [hexstr[i:i + 6] for i in range(0, len(hexstr), 6)],
+        dtype='<U6'
+    )
+
+
+def rgb2lab(r: int, g: int, b: int) -> Lab:
+    """ Convert an sRGB value to CIELAB (D65 white point). """
+    def f(t: float) -> float:
+        if t > 0.008856:
+            return t ** (1 / 3)
+        return (7.787 * t) + (16 / 116)
+
+    lr, lg, lb = _srgb_linear[r], _srgb_linear[g], _srgb_linear[b]
+    x = ((lr * 0.4124) + (lg * 0.3576) + (lb * 0.1805)) / 0.95047
+    y = (lr * 0.2126) + (lg * 0.7152) + (lb * 0.0722)
+    z = ((lr * 0.0193) + (lg * 0.1192) + (lb * 0.9505)) / 1.08883
+    fx, fy, fz = f(x), f(y), f(z)
+    return (116 * fy) - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def rgb2term(
+        r: int, g: int, b: int,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> str:
     """ Convert an rgb value to a terminal code. """
-    return hex2term_map[rgb2termhex(r, g, b)]
+    return str(rgb2termnum(r, g, b, match=match, palette=palette))
 
 
-def rgb2termhex(r: int, g: int, b: int) -> str:
+def rgb2termhex(
+        r: int, g: int, b: int,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> str:
     """ Convert an rgb value to the nearest hex value that matches a term code.
-        The hex value will be one in `hex2term_map`.
+        The hex value will be one in `hex2term_map`, or one of the palette's
+        colors when a palette is used.
     """
-    incs = [0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff]
+    termnum = rgb2termnum(r, g, b, match=match, palette=palette)
+    if palette is None:
+        return term2hex_table[termnum]
+    return get_palette(palette).hexvals[termnum]
+
+
+def rgb2termhex_array(rgbs: Any, match: Optional[str]=None) -> Any:
+    """ Batch version of rgb2termhex().
+        Returns a numpy array of hex strings, or a list of hex strings
+        when numpy is not installed.
+    """
+    if not has_numpy:
+        return [rgb2termhex(*rgb, match=match) for rgb in rgbs]
+    return rgb2hex_array(term2rgb_array(rgb2termnum_array(rgbs, match=match)))
 
-    res = []
-    parts = r, g, b
-    for part in parts:
-        if (part < 0) or (part > 255):
-            raise ValueError(
-                'Expecting 0-255 for RGB code, got: {!r}'.format(parts)
-            )
-        i = 0
-        while i < len(incs) - 1:
-            s, b = incs[i], incs[i + 1]  # smaller, bigger
-            if s <= part <= b:
-                s1 = abs(s - part)
-                b1 = abs(b - part)
-                if s1 < b1:
-                    closest = s
-                else:
-                    closest = b
-                res.append(closest)
-                break
-            i += 1
 
-    # Convert back into nearest hex value.
-    return rgb2hex(*res)
+def rgb2termnum(
+        r: int, g: int, b: int,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> int:
+    """ Convert an rgb value to the nearest terminal code number, as an int.
+        No intermediate hex strings are built, each channel is looked up
+        in a precomputed table.
+        Arguments:
+            r, g, b : Red, green, and blue values (0-255).
+            match   : Matching mode name from `matchers`.
+                      Default: 'cube'
+            palette : Palette, or registered palette name, to match against
+                      (see Palette.nearest()).
+                      Default: The xterm colors, using `match`.
+    """
+    if not ((0 <= r <= 255) and (0 <= g <= 255) and (0 <= b <= 255)):
+        raise ValueError(
+            'Expecting 0-255 for RGB code, got: {!r}'.format((r, g, b))
+        )
+    if palette is not None:
+        return get_palette(palette).nearest(r, g, b, match=match)
+    if not match:
+        return _cube_red[r] + _cube_green[g] + _cube_blue[b]
+    return get_matcher(match)(r, g, b)
+
+
+def rgb2termnum_array(rgbs: Any, match: Optional[str]=None) -> Any:
+    """ Batch version of rgb2termnum().
+        Returns a numpy uint8 array of code numbers, or a list of ints
+        when numpy is not installed.
+        Arguments:
+            rgbs  : An (N, 3) array, or an iterable of (R, G, B) values.
+            match : Matching mode name from `matchers`.
+                    Default: 'cube'
+    """
+    if not has_numpy:
+        return [rgb2termnum(*rgb, match=match) for rgb in rgbs]
+    np = _get_numpy()
+    arr = _rgb_array(rgbs)
+    if not match:
+        return (
+            _np_tables['red'][arr[:, 0]] +
+            _np_tables['green'][arr[:, 1]] +
+            _np_tables['blue'][arr[:, 2]]
+        )
+    # Other matchers only run once for each distinct color.
+    matcher = get_matcher(match)
+    wide = arr.astype(np.uint32)
+    packed = (wide[:, 0] << 16) | (wide[:, 1] << 8) | wide[:, 2]
+    uniq, inverse = np.unique(packed, return_inverse=True)
+    codes = np.fromiter(
+        (matcher(v >> 16, (v >> 8) & 0xff, v & 0xff) for v in uniq.tolist()),
+        dtype=np.uint8,
+        count=len(uniq)
+    )
+    return codes[inverse.reshape(-1)]
+
+
+def rgb2termrgb(
+        r: int, g: int, b: int,
+        match: Optional[str]=None,
+        palette: Optional[PaletteArg]=None) -> Tuple[int, int, int]:
+    """ Convert an rgb value to the nearest rgb value that matches a term
+        code.
+    """
+    termnum = rgb2termnum(r, g, b, match=match, palette=palette)
+    if palette is None:
+        return term2rgb_table[termnum]
+    return get_palette(palette).colors[termnum]
 
 
 def term2hex(code: Numeric, default: Optional[str]=None) -> str:
-    """ Convenience function for term2hex_map.get(code, None).
+    """ Convenience function for term2hex_table[int(code)].
         Accepts strs or ints in the form of: 1, 01, 123.
         Returns `default` if the code is not found.
     """
     try:
-        val = term2hex_map.get('{:02}'.format(int(code), default))
+        code = int(code)
     except ValueError:
         raise ValueError(
             'Expecting an int or number string, got: {} ({})'.format(
                 code,
                 getattr(code, '__name__', type(code).__name__)))
-    return val
+    if 0 <= code <= 255:
+        return term2hex_table[code]
+    return default
 
 
 def term2rgb(code: Numeric) -> Sequence[int]:
     """ Convert a terminal code to an rgb value. """
-    return hex2rgb(term2hex(code))
+    return termnum2rgb(int(code))
+
+
+def term2rgb_array(codes: Any) -> Any:
+    """ Batch version of term2rgb().
+        Returns an (N, 3) uint8 numpy array, or a list of (R, G, B) tuples
+        when numpy is not installed.
+    """
+    if not has_numpy:
+        return [termnum2rgb(int(code)) for code in codes]
+    np = _get_numpy()
+    arr = np.asarray(codes)
+    if arr.size == 0:
+        return np.empty((0, 3), dtype=np.uint8)
+    if not np.issubdtype(arr.dtype, np.integer):
+        try:
+            arr = arr.astype(np.intp)
+        except (TypeError, ValueError):
+            raise ValueError(
+                'Expecting ints or number strings, got: {}'.format(arr.dtype)
+            )
+    arr = arr.reshape(-1)
+    if (arr.min() < 0) or (arr.max() > 255):
+        raise ValueError(
+            'Expecting 0-255 for terminal code, got: {!r}'.format(
+                int(arr[(arr < 0) | (arr > 255)][0])
+            )
+        )
+    return _np_tables['term2rgb'][arr]
+
+
+def termnum2rgb(code: int) -> Tuple[int, int, int]:
+    """ Convert an int terminal code number to an (R, G, B) tuple.
+        Raises ValueError if the code is not in the range 0-255.
+    """
+    if not (0 <= code <= 255):
+        raise ValueError(
+            'Expecting 0-255 for terminal code, got: {!r}'.format(code)
+        )
+    return term2rgb_table[code]
+
+
+# Index of the 16 basic colors, for downsampling.
+_basic_index = _PaletteIndex(tuple(enumerate(term2rgb_table[:16])))
+# Terminal code number -> nearest basic code number (0-15).
+term2basic_table = tuple(
+    _match_basic(*rgb) for rgb in term2rgb_table
+)  # type: Tuple[int, ...]
+
+
+# Registered palettes, by name. See register_palette() and load_palette().
+palettes = {
+    'xterm': Palette('xterm'),
+    'solarized': Palette(
+        'solarized',
+        (
+            '073642', 'dc322f', '859900', 'b58900',
+            '268bd2', 'd33682', '2aa198', 'eee8d5',
+            '002b36', 'cb4b16', '586e75', '657b83',
+            '839496', '6c71c4', '93a1a1', 'fdf6e3',
+        )
+    ),
+}  # type: Dict[str, Palette]
+
+# Max number of rgb_mode ColorCodes kept by _rgb_colorcode().
+_colorcode_rgb_cache_size = 1024
+
+
+@lru_cache(maxsize=None)
+def _palette_colorcode(
+        cls: type,
+        termnum: int,
+        rgb_mode: bool,
+        palette: Optional[Palette]=None) -> 'ColorCode':
+    """ Return the shared ColorCode for a terminal code number.
+        There are only 256 codes for each palette, so every one of them
+        can be kept.
+    """
+    colors = term2rgb_table if palette is None else palette.colors
+    return cls._new(termnum, colors[termnum], rgb_mode)
+
+
+@lru_cache(maxsize=_colorcode_rgb_cache_size)
+def _rgb_colorcode(
+        cls: type,
+        r: int,
+        g: int,
+        b: int,
+        match: Optional[str],
+        palette: Optional[Palette]=None) -> 'ColorCode':
+    """ Return a shared true color (rgb_mode) ColorCode. """
+    return cls._new(
+        rgb2termnum(r, g, b, match=match, palette=palette),
+        (r, g, b),
+        True
+    )
 
 
 class ColorCode(object):
@@ -460,18 +1489,28 @@ class ColorCode(object):
             code   : Terminal code number as a string.
             hexval : Nearest matching hex value.
             rgb    : Tuple of nearest matching (Red, Green, Blue) values.
+
+        When `rgb_mode` is False, `match` selects how the nearest terminal
+        code is found (see `matchers`).
+        When `palette` is set, codes are matched against that Palette (or
+        registered palette name), and use its colors.
+
+        ColorCodes are immutable and shared. There is one instance for each
+        of the 256 terminal codes, and recently used rgb_mode instances are
+        kept in a bounded cache (see ColorCode.cache_info()).
     """
     __slots__ = ('code', 'hexval', 'rgb', 'rgb_mode')
 
-    def __init__(
-            self,
+    def __new__(
+            cls,
             code: Optional[Any]=None,
-            rgb_mode: Optional[bool]=False) -> None:
-        self.rgb = tuple()  # type: Sequence[int]
-        self.hexval = None  # type: str
-        self.code = None  # type: str
-        self.rgb_mode = rgb_mode  # type: bool
-        # Init tries to be smart about converting code types.
+            rgb_mode: Optional[bool]=False,
+            match: Optional[str]=None,
+            palette: Optional[PaletteArg]=None) -> 'ColorCode':
+        """ Return the shared ColorCode for a hex str, code str/int, or
+            rgb tuple/list/generator.
+        """
+        # Tries to be smart about converting code types.
         typeerrmsg = 'Expecting hex, term-code, or rgb. Got: {}'.format(
             getattr(code, '__name__', type(code).__name__)
         )
@@ -481,32 +1520,99 @@ class ColorCode(object):
                 r, g, b = cast(Sequence[int], code)
             except ValueError:
                 raise TypeError(typeerrmsg)
-            self._init_rgb(r, g, b)
+            return cls.from_rgb(
+                r, g, b,
+                rgb_mode=rgb_mode,
+                match=match,
+                palette=palette
+            )
         elif isinstance(code, str):
             try:
                 # Try hex str.
-                rgb = hex2rgb(code)
-                self._init_rgb(*rgb)
+                r, g, b = hex2rgb(code)
             except (TypeError, ValueError):
                 # Int as str.
                 try:
                     termcode = int(code)
                 except (TypeError, ValueError):
                     # Must be hex value.
-                    self._init_hex(code)
-                else:
-                    # Term code was passed by str.
-                    self._init_code(termcode)
+                    return cls.from_hex(
+                        code,
+                        rgb_mode=rgb_mode,
+                        match=match,
+                        palette=palette
+                    )
+                # Term code was passed by str.
+                return cls.from_code(
+                    termcode,
+                    rgb_mode=rgb_mode,
+                    palette=palette
+                )
+            return cls.from_rgb(
+                r, g, b,
+                rgb_mode=rgb_mode,
+                match=match,
+                palette=palette
+            )
         elif isinstance(code, int):
             # Term code was passed.
-            self._init_code(code)
-        else:
-            raise TypeError(typeerrmsg)
+            return cls.from_code(code, rgb_mode=rgb_mode, palette=palette)
+        raise TypeError(typeerrmsg)
+
+    def __init__(
+            self,
+            code: Optional[Any]=None,
+            rgb_mode: Optional[bool]=False,
+            match: Optional[str]=None,
+            palette: Optional[PaletteArg]=None) -> None:
+        """ Everything is done in __new__, this only matches it's signature.
+        """
+        pass
+
+    def __delattr__(self, attr: str) -> None:
+        raise AttributeError(
+            '{} is immutable.'.format(type(self).__name__)
+        )
+
+    def __eq__(self, other: Any) -> bool:
+        """ ColorCodes are equal when all of their values are equal. """
+        if self is other:
+            return True
+        if not isinstance(other, ColorCode):
+            return NotImplemented
+        return (
+            (self.code, self.rgb, self.rgb_mode) ==
+            (other.code, other.rgb, other.rgb_mode)
+        )
 
     def __format__(self, fmt: str) -> str:
         """ Pass on any format calls to str(self). """
         return format(str(self), fmt)
 
+    def __hash__(self) -> int:
+        return hash((self.code, self.rgb, self.rgb_mode))
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        """ Unpickle/copy to a shared instance when possible, because
+            __setattr__ is blocked.
+        """
+        termnum = int(self.code)
+        if self.rgb == term2rgb_table[termnum]:
+            return (type(self).from_code, (termnum, self.rgb_mode))
+        return (type(self)._new, (termnum, self.rgb, self.rgb_mode))
+
+    def __repr__(self) -> str:
+        return '{}({!r}{})'.format(
+            type(self).__name__,
+            self.rgb if self.rgb_mode else int(self.code),
+            ', rgb_mode=True' if self.rgb_mode else '',
+        )
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        raise AttributeError(
+            '{} is immutable.'.format(type(self).__name__)
+        )
+
     def __str__(self) -> str:
         """ A console friendly representation. """
         return ', '.join((
@@ -515,34 +1621,41 @@ class ColorCode(object):
             'RGB: {rgb}'
         )).format(s=self, rgb=', '.join('{:>3}'.format(i) for i in self.rgb))
 
-    def _init_code(self, code: int) -> None:
-        """ Initialize from an int terminal code. """
-        if -1 < code < 256:
-            self.code = '{:02}'.format(code)
-            self.hexval = term2hex(code)
-            self.rgb = hex2rgb(self.hexval)
-        else:
-            raise ValueError(' '.join((
-                'Code must be in the range 0-255, inclusive.',
-                'Got: {} ({})'
-            )).format(code, getattr(code, '__name__', type(code).__name__)))
-
-    def _init_hex(self, hexval: str) -> None:
-        """ Initialize from a hex value string. """
-        self.hexval = hex2termhex(fix_hex(hexval))
-        self.code = hex2term(self.hexval)
-        self.rgb = hex2rgb(self.hexval)
+    @classmethod
+    def _new(
+            cls,
+            termnum: int,
+            rgb: Sequence[int],
+            rgb_mode: Optional[bool]=False) -> 'ColorCode':
+        """ Build a new instance from already resolved values.
+            Use the from_* methods instead, which share instances.
+        """
+        self = object.__new__(cls)
+        setvalue = object.__setattr__
+        setvalue(self, 'code', '{:02}'.format(termnum))
+        setvalue(self, 'rgb', tuple(rgb))
+        setvalue(self, 'hexval', rgb2hex(*rgb))
+        setvalue(self, 'rgb_mode', bool(rgb_mode))
+        return self
 
-    def _init_rgb(self, r: int, g: int, b: int) -> None:
-        """ Initialize from red, green, blue args. """
-        if self.rgb_mode:
-            self.rgb = (r, g, b)
-            self.hexval = rgb2hex(r, g, b)
-        else:
-            self.rgb = hex2rgb(rgb2termhex(r, g, b))
-            self.hexval = rgb2termhex(r, g, b)
+    @staticmethod
+    def cache_clear() -> None:
+        """ Clear the shared instance caches. """
+        _palette_colorcode.cache_clear()
+        _rgb_colorcode.cache_clear()
 
-        self.code = hex2term(self.hexval)
+    @staticmethod
+    def cache_info() -> Dict[str, Any]:
+        """ Return statistics for the shared instance caches, as a dict of
+            {'palette': CacheInfo, 'rgb': CacheInfo}, where CacheInfo is a
+            functools.lru_cache() cache_info() result.
+                palette : Instances for the 256 terminal codes.
+                rgb     : Instances for true color (rgb_mode) values.
+        """
+        return {
+            'palette': _palette_colorcode.cache_info(),
+            'rgb': _rgb_colorcode.cache_info(),
+        }
 
     def example(self) -> str:
         """ Same as str(self), except the color codes are actually used. """
@@ -553,25 +1666,63 @@ class ColorCode(object):
         return '{code}{s}\033[0m'.format(code=colorcode, s=self)
 
     @classmethod
-    def from_code(cls, code: int) -> 'ColorCode':
+    def from_code(
+            cls,
+            code: int,
+            rgb_mode: Optional[bool]=False,
+            palette: Optional[PaletteArg]=None) -> 'ColorCode':
         """ Return a ColorCode from a terminal code. """
-        c = cls()
-        c._init_code(code)
-        return c
+        if not (-1 < code < 256):
+            raise ValueError(' '.join((
+                'Code must be in the range 0-255, inclusive.',
+                'Got: {} ({})'
+            )).format(code, getattr(code, '__name__', type(code).__name__)))
+        return _palette_colorcode(
+            cls,
+            int(code),
+            bool(rgb_mode),
+            None if palette is None else get_palette(palette)
+        )
 
     @classmethod
-    def from_hex(cls, hexval: str) -> 'ColorCode':
-        """ Return a ColorCode from a hex string. """
-        c = cls()
-        c._init_hex(hexval)
-        return c
+    def from_hex(
+            cls,
+            hexval: str,
+            rgb_mode: Optional[bool]=False,
+            match: Optional[str]=None,
+            palette: Optional[PaletteArg]=None) -> 'ColorCode':
+        """ Return a ColorCode from a hex string.
+            This always uses the nearest terminal color.
+        """
+        if palette is not None:
+            palette = get_palette(palette)
+        return _palette_colorcode(
+            cls,
+            hex2termnum(fix_hex(hexval), match=match, palette=palette),
+            bool(rgb_mode),
+            palette
+        )
 
     @classmethod
-    def from_rgb(cls, r: int, g: int, b: int) -> 'ColorCode':
+    def from_rgb(
+            cls,
+            r: int,
+            g: int,
+            b: int,
+            rgb_mode: Optional[bool]=False,
+            match: Optional[str]=None,
+            palette: Optional[PaletteArg]=None) -> 'ColorCode':
         """ Return a ColorCode from a RGB tuple. """
-        c = cls()
-        c._init_rgb(r, g, b)
-        return c
+        if palette is not None:
+            palette = get_palette(palette)
+        if rgb_mode:
+            return _rgb_colorcode(cls, r, g, b, match or None, palette)
+        return _palette_colorcode(
+            cls,
+            rgb2termnum(r, g, b, match=match, palette=palette),
+            False,
+            palette
+        )
 
     def to_dict(self) -> dict:
         """ Return a dict of code, hexval, and rgb values. """
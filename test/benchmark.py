@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" benchmark.py
+    Timing benchmarks for the hot paths in the Colr library.
+    Usage:
+        ./benchmark.py [NAME...]
+    NAME is the name of a benchmark to run, or part of it.
+    Default: all benchmarks are run
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+parentdir = os.path.split(os.path.abspath(sys.path[0]))[0]
+if parentdir.endswith('colr'):
+    # Use dev version before installed version.
+    sys.path.insert(0, parentdir)
+
+try:
+    from colr import (
+        __version__,
+        Colr,
+        ColrStyle,
+        color_code_cache_info,
+        format_back,
+        format_cache_info,
+        format_fore,
+        FrozenColr,
+        strip_codes,
+        visible_width,
+    )
+except ImportError as ex:
+    print('\nUnable to import Colr!: {}'.format(ex), file=sys.stderr)
+    sys.exit(1)
+
+# Default number of calls timed for each statement, and times to repeat that.
+NUMBER = 100000
+REPEAT = 5
+
+# Benchmarks, by name: (function, number of calls).
+# Each function yields (label, callable) for the statements to time.
+benchmarks = {}
+
+
+class _DictColr(object):
+    """ A Colr's attributes in a __dict__, like Colr before it used
+        __slots__, for a memory baseline. A subclass of Colr would still
+        keep them in the slots.
+    """
+    def __init__(self, text, fore):
+        self.__dict__.update(Colr(text, fore).__getstate__())
+        self._data = self._runs = self._stripped = self._width = None
+
+    def __str__(self):
+        if self._data is None:
+            self._data = ''.join(''.join(span) for span in self._segments)
+        return self._data
+
+
+def benchmark(number=NUMBER):
+    """ Decorator to register a benchmark function by name, timing
+        `number` calls for each statement.
+    """
+    def decorator(func):
+        benchmarks[func.__name__.replace('bench_', '', 1)] = (func, number)
+        return func
+    return decorator
+
+
+def main(args):
+    """ Run all benchmarks, or only the ones matching names in `args`. """
+    print('Colr v. {}, best of {}:'.format(__version__, REPEAT))
+    names = [
+        name for name in sorted(benchmarks)
+        if (not args) or any(arg in name for arg in args)
+    ]
+    if not names:
+        print('No benchmarks found for: {}'.format(', '.join(args)))
+        return 1
+    for name in names:
+        func, number = benchmarks[name]
+        print('\n{} ({} calls per run):'.format(name, number))
+        for label, stmt in func():
+            best = min(timeit.repeat(stmt, number=number, repeat=REPEAT))
+            print('    {:<40} {:>8.3f} usec/call'.format(
+                label,
+                (best / number) * 1000000,
+            ))
+    return 0
+
+
+@benchmark()
+def bench_chained():
+    """ Fluent chains of the generated color methods. """
+    stmts = (
+        ('Colr().red', lambda: Colr().red),
+        ("Colr().red('a').bgblue('b')",
+            lambda: Colr().red('a').bgblue('b')),
+        ("Colr().f_196('a').b_aliceblue('b')",
+            lambda: Colr().f_196('a').b_aliceblue('b')),
+        ('Colr().chained(...).chained(...)',
+            lambda: Colr().chained('a', 'red').chained('b', back='blue')),
+    )
+    yield from stmts
+
+
+@benchmark()
+def bench_color_code():
+    """ Colr.color_code()/color()/ColrStyle() with the same few styles,
+        like a logger.
+    """
+    colr = Colr()
+    colrstyle = ColrStyle('red', (1, 2, 3), 'bright')
+    stmts = (
+        ('color_code(fore, back, style)',
+            lambda: colr.color_code('red', 'blue', 'bright')),
+        ('color_code(fore=(r, g, b))',
+            lambda: colr.color_code((255, 0, 0))),
+        ('color(text, fore, back, style)',
+            lambda: colr.color('log line', 'red', (1, 2, 3), 'bright')),
+        ('ColrStyle(fore, back, style)(text)',
+            lambda: colrstyle('log line')),
+    )
+    yield from stmts
+    print('    cache: {}'.format(color_code_cache_info()))
+
+
+@benchmark()
+def bench_escape_code():
+    """ Colr.get_escape_code() for each kind of color argument. """
+    colr = Colr()
+    values = (
+        ('basic name', 'fore', 'red'),
+        ('light name', 'fore', 'lightblue'),
+        ('style name', 'style', 'bright'),
+        ('extended int', 'fore', 196),
+        ('extended str', 'back', '196'),
+        ('known name', 'fore', 'aliceblue'),
+        ('hex', 'fore', '#ff0000'),
+        ('short hex', 'back', 'f00'),
+        ('rgb tuple', 'fore', (255, 0, 0)),
+    )
+    for label, codetype, value in values:
+        yield (
+            '{} ({!r})'.format(label, value),
+            lambda codetype=codetype, value=value: colr.get_escape_code(
+                codetype,
+                value
+            )
+        )
+
+
+@benchmark()
+def bench_format_code():
+    """ format_fore/format_back, using the prebuilt code tables and the
+        rgb code cache.
+    """
+    stmts = (
+        ('format_fore(1)', lambda: format_fore(1)),
+        ('format_fore(196, extended=True)',
+            lambda: format_fore(196, extended=True)),
+        ('format_back(4, light=True)', lambda: format_back(4, light=True)),
+        ('format_back((r, g, b))', lambda: format_back((10, 20, 30))),
+    )
+    yield from stmts
+    cacheinfo = format_cache_info()
+    print('    table: {}, rgb: {}'.format(
+        dict(cacheinfo['table']),
+        cacheinfo['rgb'],
+    ))
+
+
+@benchmark(number=20)
+def bench_join():
+    """ Joining many log fields, into a Colr or streamed to a file. """
+    fieldcount = 10000
+    colrstyle = ColrStyle('red', style='bright')
+    sep = Colr(', ')
+
+    def fields():
+        return ('field {}'.format(i) for i in range(fieldcount))
+
+    devnull = open(os.devnull, 'w')
+    stmts = (
+        ('join(fields)', lambda: sep.join(fields())),
+        ('join(fields, style=ColrStyle)',
+            lambda: sep.join(fields(), style=colrstyle)),
+        ('join_to(devnull, fields, style=ColrStyle)',
+            lambda: sep.join_to(devnull, fields(), style=colrstyle)),
+    )
+    yield from stmts
+    devnull.close()
+
+
+@benchmark()
+def bench_layout():
+    """ Justifying/measuring/windowing the same colored table cells, like
+        a redraw.
+    """
+    cell = Colr('status', 'green')(': ')('running', 'yellow', style='bright')
+    widecell = Colr('\u72b6\u614b', 'green')(': ')(
+        '\u5b9f\u884c\u4e2d',
+        'yellow',
+    )
+    stmts = (
+        ('visible_len()', lambda: cell.visible_len()),
+        ('ljust(20)', lambda: cell.ljust(20)),
+        ('center(20, fore=name)', lambda: cell.center(20, fore='blue')),
+        ('format(cell, "^20")', lambda: format(cell, '^20')),
+        ('cell[2:10] (keeps colors)', lambda: cell[2:10]),
+        ('visible_width(str) (ascii)',
+            lambda: visible_width('status: running')),
+        ('visible_width(str) (wide chars)',
+            lambda: visible_width('\u72b6\u614b: \u5b9f\u884c\u4e2d')),
+        ('ljust(20) (wide chars)', lambda: widecell.ljust(20)),
+    )
+    yield from stmts
+
+
+@benchmark(number=10000)
+def bench_memory():
+    """ Memory for many cached table cells, and hashing them as dict keys.
+        Memory is measured for `cellcount` cells, and shown per instance
+        (bytes per cell is also MB per million cells).
+    """
+    cellcount = 100000
+    texts = ['cell {}'.format(i) for i in range(cellcount)]
+    for cls in (_DictColr, Colr, FrozenColr):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        cells = [cls(text, 'red') for text in texts]
+        for cell in cells:
+            # Rendered data is cached too.
+            str(cell)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del cells
+        print('    {:<40} {:>8.1f} bytes/cell'.format(
+            cls.__name__,
+            used / cellcount,
+        ))
+
+    cache = {}
+    colrcell = Colr('cell', 'red')('!', style='bright')
+    frozencell = colrcell.freeze()
+    stmts = (
+        ('cache[Colr]', lambda: cache.get(colrcell)),
+        ('cache[FrozenColr]', lambda: cache.get(frozencell)),
+    )
+    yield from stmts
+
+
+@benchmark()
+def bench_operators():
+    """ Operators and methods that return a new Colr from existing data,
+        like a table renderer building each frame.
+    """
+    cell = Colr('cell', 'red')
+    other = Colr(' | ', style='bright')
+    stmts = (
+        ('Colr + Colr', lambda: cell + other),
+        ('Colr + str', lambda: cell + ' '),
+        ('str + Colr', lambda: ' ' + cell),
+        ('Colr * 3', lambda: cell * 3),
+        ('Colr.format()', lambda: Colr('{}').format('x')),
+        ('Colr.ljust(10)', lambda: cell.ljust(10)),
+        ('Colr.join(...)', lambda: other.join('a', 'b', 'c')),
+    )
+    yield from stmts
+
+
+@benchmark(number=200)
+def bench_render():
+    """ Rainbow/gradient output, rendered with minimal codes between runs.
+    """
+    text = 'The quick brown fox jumps over the lazy dog. ' * 4
+    colr = Colr(text)
+    stmts = (
+        ('rainbow()', lambda: colr.rainbow()),
+        ('rainbow(back=name, style=name)',
+            lambda: colr.rainbow(back='blue', style='bright')),
+        ('gradient(name=black)', lambda: colr.gradient(name='black')),
+        ('join(*strs, fore=name)',
+            lambda: colr.join(text.split(), fore='red')),
+    )
+    for label, func in stmts:
+        yield label, func
+        output = str(func())
+        print('    {:<40} {:>8} bytes'.format(
+            '  escape codes',
+            len(output) - len(strip_codes(output)),
+        ))
+
+
+@benchmark(number=20)
+def bench_wrap():
+    """ Wrapping a colored log dump, keeping the colors on each line.
+        The rainbow changes codes for every character, without resets.
+    """
+    clr = Colr()
+    for i in range(2000):
+        clr('{} INFO '.format(i), 'blue')
+        clr('request handled for some user in {} ms, '.format(i), 'green')
+    rainbow = Colr(clr.stripped()).rainbow()
+    stmts = (
+        ('wrap(80) ({} chars)'.format(clr.visible_len()),
+            lambda: clr.wrap(80)),
+        ('fill(80)', lambda: clr.fill(80)),
+        ('rainbow().wrap(80)', lambda: rainbow.wrap(80)),
+    )
+    yield from stmts
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -7,30 +7,83 @@
     -Christopher Welborn 12-09-2015
 """
 
+import io
+import os
+import pickle
 import random
 import sys
+import tempfile
+import textwrap
 import unittest
+from unittest import mock
 
 from colr import (
     __version__,
     closing_code,
     color,
+    color_code_cache_clear,
+    color_code_cache_info,
     Colr,
+    ColrSpan,
+    ColrStyle,
     ColorCode,
+    TermLUT,
+    disable_lut,
+    enable_lut,
+    disable,
+    enable,
     fix_hex,
+    format_back,
+    format_cache_clear,
+    format_cache_info,
+    format_fore,
+    FrozenColr,
+    get_codes,
+    get_known_codes,
+    get_known_name,
+    get_lut,
+    downsample_code,
     hex2rgb,
+    hex2rgb_array,
     hex2term,
     hex2termhex,
+    hex2termnum,
     InvalidColr,
+    InvalidEscapeCode,
+    matchers,
+    merge_codes,
     name_data,
+    Palette,
+    load_palette,
+    palettes,
+    register_palette,
+    parse_colr_arg,
     rgb2hex,
+    rgb2hex_array,
+    rgb2lab,
     rgb2term,
     rgb2termhex,
+    rgb2termhex_array,
+    rgb2termnum,
+    rgb2termnum_array,
+    set_color_depth,
+    set_combined_codes,
+    split_codes,
+    rgb2termrgb,
     term2hex,
+    term2hex_map,
+    term2hex_table,
+    term2packed_table,
     term2rgb,
+    term2rgb_array,
+    term2rgb_table,
+    termnum2rgb,
     strip_codes,
+    visible_width,
 )
 from colr.trans import (
+    classify_code,
+    classify_codes,
     is_code,
     is_ext_code,
     is_rgb_code,
@@ -73,6 +126,65 @@ class ColrTests(ColrTestCase):
         """ Return True if a Colr() ends with a closing code. """
         return str(clr).endswith(closing_code)
 
+    def test_batch(self):
+        """ Batch conversions should match the single value functions,
+            with or without numpy.
+        """
+        def aslist(values):
+            """ Normalize numpy arrays and lists for comparison. """
+            values = getattr(values, 'tolist', lambda: values)()
+            return [
+                tuple(v) if isinstance(v, (list, tuple)) else v
+                for v in values
+            ]
+
+        rgbs = [
+            tuple(random.randint(0, 255) for _ in range(3))
+            for _ in range(200)
+        ]
+        rgbs.extend(v['rgb'] for v in self.conversions)
+        hexvals = [rgb2hex(*rgb) for rgb in rgbs]
+        codes = list(range(256))
+        for usenumpy in (True, False):
+            with mock.patch('colr.trans.has_numpy', new=usenumpy):
+                batches = (
+                    (hex2rgb_array, hexvals, hex2rgb),
+                    (rgb2hex_array, rgbs, rgb2hex),
+                    (rgb2termnum_array, rgbs, rgb2termnum),
+                    (rgb2termhex_array, rgbs, rgb2termhex),
+                    (term2rgb_array, codes, term2rgb),
+                )
+                for batchfunc, values, func in batches:
+                    self.assertCallEqual(
+                        aslist([
+                            func(*val) if isinstance(val, tuple)
+                            else func(val)
+                            for val in values
+                        ]),
+                        aslist(batchfunc(values)),
+                        func=batchfunc,
+                        kwargs={'numpy': usenumpy},
+                        msg='Batch results do not match single results.',
+                    )
+                self.assertCallEqual(
+                    [rgb2termnum(*rgb, match='lab') for rgb in rgbs],
+                    aslist(rgb2termnum_array(rgbs, match='lab')),
+                    func=rgb2termnum_array,
+                    kwargs={'match': 'lab', 'numpy': usenumpy},
+                    msg='Batch results do not match single results.',
+                )
+                for batchfunc, values in (
+                        (hex2rgb_array, ['fff']),
+                        (rgb2termnum_array, [(256, 0, 0)]),
+                        (term2rgb_array, [256])):
+                    with self.assertCallRaises(
+                            ValueError,
+                            func=batchfunc,
+                            args=values,
+                            kwargs={'numpy': usenumpy},
+                            msg='Failed to raise for invalid value.'):
+                        batchfunc(values)
+
     def test_bytes(self):
         """ bytes(Colr()) should encode self.data. """
         s = 'test'
@@ -100,6 +212,35 @@ class ColrTests(ColrTestCase):
                 ex
             ))
 
+        # Methods are added to the class, and work like chained().
+        self.assertEqual(
+            Colr().bright('test', 'red').bg_blue('ing'),
+            Colr().chained('test', 'red', style='bright').chained(
+                'ing',
+                back='blue',
+            ),
+        )
+        self.assertIn('bright', Colr.__dict__)
+        self.assertEqual(Colr().f_196('a'), Colr('a', 196))
+        self.assertEqual(Colr().red('a', fore='blue'), Colr('a', 'blue'))
+        # Unknown names fall back to str attributes.
+        self.assertEqual(Colr('test').upper(), 'TEST')
+        with self.assertRaises(AttributeError):
+            Colr().not_a_color()
+        self.assertNotIn('not_a_color', Colr.__dict__)
+        # Names with invalid or oddly written codes are never added.
+        for attr in ('f_999', 'b256_256', 'f_0001', 'f_ 1', 'bg___red'):
+            getattr(Colr(), attr)
+            self.assertFalse(
+                hasattr(Colr, attr),
+                msg='Method was added to the class: {!r}'.format(attr),
+            )
+        with self.assertRaises(InvalidColr):
+            Colr().f_999('test')
+        self.assertEqual(Colr().f_0001('a'), Colr('a', 1))
+        Colr().b_aliceblue()
+        self.assertIn('b_aliceblue', Colr.__dict__)
+
         # RGB codes should work.
         self.assertIsInstance(
             Colr().rgb(255, 255, 255),
@@ -162,6 +303,150 @@ class ColrTests(ColrTestCase):
         with self.assertRaises(InvalidColr):
             Colr(s, (257, 0, 0))
 
+    def test_color_code_cache(self):
+        """ color_code() should cache codes, without changing them. """
+        colr = Colr()
+        color_code_cache_clear()
+        args = (
+            {'fore': 'red', 'back': (1, 2, 3), 'style': 'bright'},
+            {'fore': [1, 2, 3]},
+            {'fore': 196, 'style': 'reset_all'},
+        )
+        for kwargs in args:
+            expected = colr._build_color_code(**kwargs)
+            for _ in range(3):
+                self.assertCallEqual(
+                    colr.color_code(**kwargs),
+                    expected,
+                    func=Colr.color_code,
+                    kwargs=kwargs,
+                    msg='Cached code does not match.',
+                )
+        info = color_code_cache_info()
+        self.assertEqual((info['hits'], info['misses']), (6, 3))
+        # Depth is part of the key.
+        self.assertEqual(
+            Colr(depth=16).color_code(fore=196),
+            '\033[91m',
+            msg='Cached code was used for a different depth.',
+        )
+        # Disabling still works for cached codes.
+        try:
+            disable()
+            self.assertEqual(Colr('test', fore='red'), Colr('test'))
+        finally:
+            enable()
+        self.assertEqual(str(Colr('test', 'red')), '\033[31mtest\033[0m')
+        # Least recently used codes are evicted.
+        with mock.patch('colr.colr._color_code_cache_size', new=2):
+            color_code_cache_clear()
+            for fore in ('red', 'blue', 'red', 'green'):
+                colr.color_code(fore=fore)
+            info = color_code_cache_info()
+            self.assertEqual(info['currsize'], 2)
+            self.assertEqual((info['hits'], info['misses']), (1, 3))
+            colr.color_code(fore='red')
+            self.assertEqual(color_code_cache_info()['hits'], 2)
+
+    def test_color_depth(self):
+        """ Codes should be downsampled to the requested color depth. """
+        cases = (
+            (((196,), {'depth': 16}), '\033[91mtest\033[0m'),
+            ((((255, 0, 0),), {'depth': 16}), '\033[91mtest\033[0m'),
+            (((None, 196), {'depth': 16}), '\033[101mtest\033[0m'),
+            (((1,), {'depth': 16}), '\033[31mtest\033[0m'),
+            ((((255, 0, 0),), {'depth': 256}), '\033[38;5;196mtest\033[0m'),
+            (((196,), {'depth': 256}), '\033[38;5;196mtest\033[0m'),
+            (((196,), {}), '\033[38;5;196mtest\033[0m'),
+        )
+        for (args, kwargs), expected in cases:
+            self.assertCallEqual(
+                str(Colr('test', *args, **kwargs)),
+                expected,
+                func=Colr,
+                args=('test', ) + args,
+                kwargs=kwargs,
+                msg='Failed to downsample code.',
+            )
+        self.assertEqual(
+            downsample_code('\033[48;2;0;0;255m', 16),
+            '\033[104m',
+            msg='Failed to downsample rgb back code.',
+        )
+        # Rgb codes should get the nearest basic color, not the basic color
+        # for the nearest cube color.
+        basiclabs = [rgb2lab(*rgb) for rgb in term2rgb_table[:16]]
+
+        def labdist(lab, num):
+            return sum((a - b) ** 2 for a, b in zip(lab, basiclabs[num]))
+
+        rand = random.Random(2)
+        for rgb in [(253, 119, 176)] + [
+                tuple(rand.randint(0, 255) for _ in range(3))
+                for _ in range(500)]:
+            code = downsample_code('\033[38;2;{};{};{}m'.format(*rgb), 16)
+            num = int(code[2:-1])
+            num = num - 30 if num < 90 else num - 90 + 8
+            lab = rgb2lab(*rgb)
+            self.assertEqual(
+                labdist(lab, num),
+                min(labdist(lab, i) for i in range(16)),
+                msg='Not the nearest basic color for {!r}: {!r}'.format(
+                    rgb,
+                    code,
+                ),
+            )
+        with self.assertRaises(ValueError):
+            Colr('test', depth=8)
+        try:
+            set_color_depth(16)
+            self.assertEqual(
+                str(Colr().f_196('test')),
+                '\033[91mtest\033[0m',
+                msg='Global color depth was not used.',
+            )
+        finally:
+            set_color_depth()
+        self.assertEqual(
+            str(Colr().f_196('test')),
+            '\033[38;5;196mtest\033[0m',
+            msg='Global color depth was not reset.',
+        )
+
+        # Colrs made from a Colr keep its depth/palette/combined settings.
+        clr = Colr('x', depth=16, palette='xterm', combined=True)
+        derived = {
+            '+ Colr': lambda c: c + Colr('y'),
+            '+ str': lambda c: c + 'y',
+            'str +': lambda c: 'y' + c,
+            '*': lambda c: c * 2,
+            '[:]': lambda c: c[:1],
+            'center()': lambda c: c.center(3),
+            'center(fore=...)': lambda c: c.center(3, fore='red'),
+            'ljust(text=...)': lambda c: c.ljust(3, text='y'),
+            'format()': lambda c: c.format(),
+            'join()': lambda c: c.join('a', 'b'),
+            'join(fore=...)': lambda c: c.join('a', 'b', fore='red'),
+            'rainbow()': lambda c: c.rainbow(),
+            'gradient()': lambda c: c.gradient(name='black'),
+            'gradient_rgb()': lambda c: c.gradient_rgb(),
+            'wrap()': lambda c: c.wrap(5)[0],
+            'fill()': lambda c: c.fill(5),
+            'freeze()': lambda c: c.freeze(),
+        }
+        for label, func in derived.items():
+            for source in (clr, clr.freeze()):
+                newclr = func(source)
+                self.assertEqual(
+                    (newclr.depth, newclr.palette, newclr.combined),
+                    (clr.depth, clr.palette, clr.combined),
+                    msg='Settings were lost for: {}'.format(label),
+                )
+                self.assertTrue(
+                    str(newclr.f_196('q')).endswith('\033[91mq\033[0m'),
+                    msg='Color depth was not used after: {}'.format(label),
+                )
+
     def test_colorcode(self):
         """ ColorCode should properly translate codes. """
 
@@ -186,6 +471,101 @@ class ColrTests(ColrTestCase):
                 msg='Failed to find known close match.'
             )
 
+    def test_colorcode_shared(self):
+        """ ColorCodes should be shared and immutable. """
+        ColorCode.cache_clear()
+        argsets = (
+            (196,),
+            ('196',),
+            ('ff0000',),
+            ('#f00',),
+            ((255, 0, 0),),
+            ((250, 5, 5),),
+        )
+        first = ColorCode(*argsets[0])
+        for argset in argsets:
+            self.assertIs(
+                first,
+                ColorCode(*argset),
+                msg='ColorCode{!r} was not shared.'.format(argset),
+            )
+        self.assertIs(
+            first,
+            ColorCode.from_rgb(250, 5, 5),
+            msg='ColorCode.from_rgb() was not shared.',
+        )
+        rgbcode = ColorCode((250, 5, 5), rgb_mode=True)
+        self.assertIsNot(
+            first,
+            rgbcode,
+            msg='rgb_mode ColorCode should not be the nearest term code.',
+        )
+        self.assertIs(
+            rgbcode,
+            ColorCode.from_rgb(250, 5, 5, rgb_mode=True),
+            msg='rgb_mode ColorCode was not shared.',
+        )
+        cacheinfo = ColorCode.cache_info()
+        self.assertEqual(
+            cacheinfo['palette'].currsize,
+            1,
+            msg='Palette cache has the wrong size.',
+        )
+        self.assertEqual(
+            cacheinfo['rgb'].hits,
+            1,
+            msg='rgb_mode cache has the wrong hit count.',
+        )
+
+        with self.assertRaises(AttributeError):
+            first.code = '1'
+        with self.assertRaises(TypeError):
+            ColorCode()
+        self.assertIs(
+            first,
+            pickle.loads(pickle.dumps(first)),
+            msg='Unpickled ColorCode was not shared.',
+        )
+        self.assertEqual(
+            rgbcode,
+            pickle.loads(pickle.dumps(rgbcode)),
+            msg='Unpickled rgb_mode ColorCode is not equal.',
+        )
+
+    def test_classify_code(self):
+        """ classify_code should classify and parse escape codes. """
+        expected = {
+            '\033[31m': ('basic', None, (31,)),
+            '\033[107m': ('basic', None, (107,)),
+            '\033[38;5;42m': ('extended', 'fore', (42,)),
+            '\033[48;5;255m': ('extended', 'back', (255,)),
+            '\033[38;2;0;0;255m': ('rgb', 'fore', (0, 0, 255)),
+            '\033[48;2;1;2;3m': ('rgb', 'back', (1, 2, 3)),
+            '\033[999m': ('basic', None, (999,)),
+            '\033[38;5;1000m': ('extended', 'fore', (1000,)),
+            '\033[1;2m': ('unknown', None, ()),
+            '\033[38;2;1;2m': ('unknown', None, ()),
+            '\033[31mtest': ('unknown', None, ()),
+            'test': ('unknown', None, ()),
+        }
+        for code, info in expected.items():
+            self.assertCallTupleEqual(
+                info,
+                tuple(classify_code(code)),
+                func=classify_code,
+                args=(code,),
+                msg='Failed to classify code.',
+            )
+        self.assertListEqual(
+            [tuple(info) for info in expected.values()],
+            [tuple(info) for info in classify_codes(expected)],
+            msg='Batch classify does not match.',
+        )
+        # Out of range numbers are parsed, so they can be rejected.
+        for code in ('\033[999m', '\033[38;5;1000m', '\033[48;2;0;256;0m'):
+            with self.assertRaises(InvalidEscapeCode):
+                get_known_name(code)
+
     def test_closingcode(self):
         """ The reset/closing code should be appended when necessary. """
         # No code should be appended.
@@ -234,6 +614,130 @@ class ColrTests(ColrTestCase):
                 msg='Failed to add closing code for falsey value.',
             )
 
+    def test_colrstyle(self):
+        """ ColrStyle should colorize text like color(), and pickle. """
+        argsets = (
+            {'fore': 'red'},
+            {'fore': (1, 2, 3), 'back': 'blue', 'style': 'bright'},
+            {'back': 'aliceblue', 'style': 'underline'},
+            {},
+        )
+        for kwargs in argsets:
+            style = ColrStyle(**kwargs)
+            for text in ('test', '', '\033[31mtest\033[0m'):
+                self.assertCallEqual(
+                    style(text),
+                    color(text, **kwargs),
+                    func=ColrStyle,
+                    kwargs=kwargs,
+                    msg='ColrStyle does not match color().',
+                )
+            self.assertEqual(pickle.loads(pickle.dumps(style)), style)
+        style = ColrStyle(fore='red', style='bright')
+        self.assertEqual(
+            str(Colr(', ').join('a', 'b', style=style)),
+            str(Colr(', ').join('a', 'b', fore='red', style='bright')),
+            msg='ColrStyle does not work with join().',
+        )
+        with self.assertRaises(InvalidColr):
+            ColrStyle(fore='not a color')
+        try:
+            disable()
+            self.assertEqual(style('test'), 'test')
+        finally:
+            enable()
+
+    def test_combined_codes(self):
+        """ Codes should be merged into one escape code when asked. """
+        merges = {
+            '\033[1m\033[48;5;20m\033[38;5;196m': '\033[1;48;5;20;38;5;196m',
+            '\033[0m\033[m\033[31m': '\033[0;0;31m',
+            '\033[31m': '\033[31m',
+            '\033[31mtest\033[0m': '\033[31mtest\033[0m',
+            '': '',
+        }
+        for codes, expected in merges.items():
+            self.assertCallEqual(
+                merge_codes(codes),
+                expected,
+                func=merge_codes,
+                args=(codes, ),
+                msg='Failed to merge codes.',
+            )
+        self.assertEqual(
+            str(Colr('test', 'red', (1, 2, 3), 'bright', combined=True)),
+            '\033[1;48;2;1;2;3;31mtest\033[0m',
+            msg='Colr did not merge codes.',
+        )
+        try:
+            set_combined_codes()
+            rainbow = str(Colr().rainbow('test', back='blue', style='bold'))
+            gradient = str(Colr('test').gradient(name='black', fore='red'))
+        finally:
+            set_combined_codes(False)
+        for s in (rainbow, gradient):
+            self.assertNotIn(
+                'm\033[',
+                s,
+                msg='Rainbow/gradient codes were not merged: {!r}'.format(s),
+            )
+        self.assertEqual(
+            str(Colr('test', 'red', 'blue')),
+            '\033[44m\033[31mtest\033[0m',
+            msg='Codes were still merged after set_combined_codes(False).',
+        )
+
+        # Merged codes should split back into their parts.
+        for codes, merged in merges.items():
+            if codes and ('test' not in codes):
+                self.assertCallEqual(
+                    ''.join(split_codes(merged)),
+                    codes.replace('\033[m', '\033[0m'),
+                    func=split_codes,
+                    args=(merged, ),
+                    msg='Failed to split codes.',
+                )
+        args = ('test', 'red', 'blue', 'bright')
+        self.assertListEqual(
+            list(get_known_codes(str(Colr(*args, combined=True)))),
+            list(get_known_codes(str(Colr(*args)))),
+            msg='Combined codes were not explained.',
+        )
+        self.assertEqual(
+            get_known_name('\033[1;44;31m'),
+            (
+                'combined',
+                (('style', 'bold'), ('back', 'blue'), ('fore', 'red')),
+            ),
+            msg='Combined code name was not found.',
+        )
+
+    def test_escape_code(self):
+        """ get_escape_code() should match the slow path for all values. """
+        colr = Colr()
+        values = [
+            'red', 'LightBlue', 'reset', 'bright', 'aliceblue', 'AliceBlue',
+            196, '196', 1, '1', 256, '256', '01', -1,
+            'fff', '#ff0000', 'xyz', '',
+            (255, 0, 0), [1, 2, 3], (256, 0, 0), ('1', '2', '3'), (1, 2),
+            None,
+        ]
+        for codetype in ('fore', 'back', 'style'):
+            for value in values:
+                try:
+                    expected = colr._parse_escape_code(codetype, value)
+                except Exception as ex:
+                    with self.assertRaises(type(ex)):
+                        colr.get_escape_code(codetype, value)
+                    continue
+                self.assertCallEqual(
+                    colr.get_escape_code(codetype, value),
+                    expected,
+                    func=colr.get_escape_code,
+                    args=(codetype, value),
+                    msg='Fast path does not match.',
+                )
+
     def test_fix_hex(self):
         """ fix_hex should translate short-form hex strings. """
         for argset in (('#f',), ('#ffffffXX',), ('',)):
@@ -354,6 +858,148 @@ class ColrTests(ColrTestCase):
             msg='Colr(\'{}\').format(Colr()) breaks formatting!',
         )
 
+    def test_format_cache(self):
+        """ Prebuilt/cached escape codes should match the formatted codes. """
+        format_cache_clear()
+        for n in range(256):
+            self.assertEqual(
+                format_fore(n, extended=True),
+                '\033[38;5;{}m'.format(n),
+            )
+            self.assertEqual(
+                format_back(n, extended=True),
+                '\033[48;5;{}m'.format(n),
+            )
+        for n in range(10):
+            self.assertEqual(format_fore(n), '\033[{}m'.format(30 + n))
+            self.assertEqual(
+                format_back(n, light=True),
+                '\033[{}m'.format(100 + n),
+            )
+        self.assertEqual(format_cache_info()['table']['hits'], 532)
+        for _ in range(3):
+            self.assertEqual(
+                format_back((1, 2, 3)),
+                '\033[48;2;1;2;3m',
+            )
+            self.assertEqual(
+                format_fore((1, 2, 3)),
+                '\033[38;2;1;2;3m',
+            )
+        rgbinfo = format_cache_info()['rgb']
+        self.assertEqual((rgbinfo.hits, rgbinfo.misses), (4, 2))
+        # Invalid values still raise errors, and are never cached.
+        for args in ((256, ), (10, ), (-1, ), ((0, 0, 256), )):
+            with self.assertRaises(InvalidColr):
+                format_fore(*args)
+        self.assertEqual(format_cache_info()['rgb'].currsize, 2)
+        # Non-int/tuple values use the slow path.
+        self.assertEqual(format_fore('1'), '\033[31m')
+        self.assertEqual(format_fore([1, 2, 3]), '\033[38;2;1;2;3m')
+        self.assertEqual(format_cache_info()['table']['misses'], 5)
+
+    def test_frozencolr(self):
+        """ FrozenColr should be immutable, hash once, and return itself
+            from operations that don't change it.
+        """
+        self.assertFalse(hasattr(Colr(), '__dict__'))
+        frozen = FrozenColr('ok', 'green')
+        self.assertEqual(frozen, Colr('ok', 'green'))
+        self.assertEqual(Colr('ok', 'green'), frozen)
+        self.assertEqual(hash(frozen), hash(Colr('ok', 'green')))
+        self.assertEqual(Colr('ok', 'green').freeze(), frozen)
+        with self.assertRaises(AttributeError):
+            frozen.data = 'changed'
+        appended = frozen.bright('!')
+        self.assertIsInstance(appended, FrozenColr)
+        self.assertEqual(appended, Colr('ok', 'green')('!', style='bright'))
+        self.assertEqual(frozen, Colr('ok', 'green'))
+        for same in (frozen(), frozen + '', '' + frozen, frozen * 1,
+                     frozen[:], frozen.freeze()):
+            self.assertIs(same, frozen)
+        with mock.patch.object(Colr, '__hash__') as colrhash:
+            colrhash.return_value = 1
+            frozen = FrozenColr('ok', 'green')
+            cache = {frozen: 'cached'}
+            self.assertEqual(cache[frozen], 'cached')
+            self.assertEqual(colrhash.call_count, 1)
+        # Copies don't share spans with the original.
+        original = Colr('a', 'red')
+        frozen = pickle.loads(pickle.dumps(original.freeze()))
+        self.assertIsInstance(frozen, FrozenColr)
+        self.assertEqual(frozen, original)
+        original.blue('b')
+        self.assertEqual(frozen, Colr('a', 'red'))
+        # The hash from another process is not kept.
+        frozen = FrozenColr('a', 'red')
+        frozen._hash = hash(frozen) + 1
+        self.assertNotIn('_hash', frozen.__getstate__())
+        cache = {FrozenColr('a', 'red'): 1}
+        self.assertEqual(cache.get(pickle.loads(pickle.dumps(frozen))), 1)
+        # State pickled with a hash (from another process).
+        unpickled = FrozenColr()
+        unpickled.__setstate__(
+            dict(frozen.__getstate__(), _hash=frozen._hash)
+        )
+        self.assertEqual(
+            cache.get(unpickled),
+            1,
+            msg='Unpickled FrozenColr kept a stale hash.',
+        )
+
+    def test_getitem(self):
+        """ Colr indexes/slices should use the text without codes, and keep
+            the colors for each character.
+        """
+        clr = Colr('abc', 'red')('def', 'blue', style='bright')('ghi')
+        self.assertEqual(
+            clr[1:5],
+            Colr('bc', 'red')('de', 'blue', style='bright'),
+        )
+        self.assertEqual(clr[-2:], Colr('hi'))
+        self.assertEqual(clr[3], Colr('d', 'blue', style='bright'))
+        self.assertEqual(clr[-9], Colr('a', 'red'))
+        self.assertEqual(
+            clr[::4],
+            Colr('a', 'red')('e', 'blue', style='bright')('i'),
+        )
+        self.assertEqual(
+            clr[5:1:-1],
+            Colr('fed', 'blue', style='bright')('c', 'red'),
+        )
+        self.assertEqual(clr[:].stripped(), clr.stripped())
+        self.assertEqual(clr[4:2], Colr())
+        for badindex in (9, -10):
+            with self.assertRaises(IndexError):
+                clr[badindex]
+        # Codes already in the text are used for its characters.
+        clr = Colr()
+        clr.data = '\033[31mred\033[1mbold\033[0m none'
+        self.assertEqual(
+            clr[2:4].data,
+            '\033[31md\033[0m\033[1m\033[31mb\033[0m',
+        )
+        self.assertEqual(clr[-4:], Colr('none'))
+        # Only the codes that are still active are kept, even when codes
+        # are never reset.
+        clr = Colr()
+        clr.data = ''.join(
+            '\033[{}m\033[4{}m\033[1m{}'.format(30 + (i % 8), i % 8, i % 10)
+            for i in range(2000)
+        )
+        self.assertEqual(
+            clr[1999].data,
+            '\033[1m\033[47m\033[37m9\033[0m',
+        )
+        clr.data += '\033[22m\033[39mx'
+        self.assertEqual(clr[-1].data, '\033[47mx\033[0m')
+        clr = Colr('x' * 2000).rainbow()
+        self.assertLess(
+            len(clr[1990].data),
+            40,
+            msg='Slice has codes that are not active.',
+        )
+
     def test_hash(self):
         """ hash(Colr()) should return a unique hash for self.data. """
         a, b = hash(Colr('test', 'red')), hash(Colr('test', 'red'))
@@ -499,27 +1145,191 @@ class ColrTests(ColrTestCase):
 
     def test_is_code(self):
         """ colr.trans.is_code should recognize a color code. """
-        validcodes = ('\033[31m', '\033[41m')
-        invalidcode = '\033[38;5;27m'
+        validcodes = ('\033[31m', '\033[41m', '\033[107m')
+        invalidcodes = ('\033[38;5;27m', '\033[108m', '\033[999m')
         for validcode in validcodes:
             self.assertTrue(is_code(validcode))
-        self.assertFalse(is_code(invalidcode))
+        for invalidcode in invalidcodes:
+            self.assertFalse(is_code(invalidcode))
 
     def test_is_ext_code(self):
         """ colr.trans.is_ext_code should recognize a color code. """
         validcodes = ('\033[38;5;42m', '\033[48;5;42m')
-        invalidcode = '\033[10m'
+        invalidcodes = ('\033[10m', '\033[38;5;256m', '\033[48;5;1000m')
         for validcode in validcodes:
             self.assertTrue(is_ext_code(validcode))
-        self.assertFalse(is_ext_code(invalidcode))
+        for invalidcode in invalidcodes:
+            self.assertFalse(is_ext_code(invalidcode))
 
     def test_is_rgb_code(self):
         """ colr.trans.is_rgb_code should recognize a color code. """
         validcodes = ('\033[38;2;0;0;255m', '\033[48;2;0;0;255m')
-        invalidcode = '\033[10m'
+        invalidcodes = ('\033[10m', '\033[38;2;0;0;256m')
         for validcode in validcodes:
             self.assertTrue(is_rgb_code(validcode))
-        self.assertFalse(is_rgb_code(invalidcode))
+        for invalidcode in invalidcodes:
+            self.assertFalse(is_rgb_code(invalidcode))
+
+    def test_iter_join(self):
+        """ Colr.join() should flatten nested iterables lazily, and
+            iter_join()/join_to() should stream the same output.
+        """
+        def nested():
+            return ['a', ('b', ['c', (c for c in 'de')]), range(2)]
+
+        self.assertEqual(
+            Colr(',').join(nested(), 'f'),
+            Colr('a,b,c,d,e,0,1,f'),
+        )
+        for kwargs in ({}, {'fore': 'red'}, {'style': ColrStyle('blue')}):
+            expected = str(Colr(', ').join(nested(), **kwargs))
+            self.assertEqual(
+                ''.join(Colr(', ').iter_join(nested(), **kwargs)),
+                expected,
+            )
+            file = io.StringIO()
+            clr = Colr(', ')
+            self.assertIs(clr.join_to(file, nested(), **kwargs), clr)
+            self.assertEqual(file.getvalue(), expected)
+        # Items are only pulled from generators as they are needed.
+        items = (str(i) for i in range(10))
+        chunks = Colr('-').iter_join(items)
+        self.assertEqual([next(chunks) for _ in range(3)], ['0', '-', '1'])
+        self.assertEqual(next(items), '2')
+
+    def test_lut(self):
+        """ TermLUT should match the matcher it was built from, and load
+            from a cache file.
+        """
+        with tempfile.TemporaryDirectory() as cachedir:
+            # A full 8-bit grid gives exact results, but takes a while to
+            # build with the lab matcher. Use a small grid.
+            lut = get_lut('lab', bits=4, cache_dir=cachedir)
+            self.assertIsNotNone(lut.path, msg='Table was not saved.')
+            loaded = TermLUT.load(lut.path, 'lab', bits=4)
+            self.assertIsNotNone(loaded, msg='Failed to load saved table.')
+            self.assertEqual(
+                bytes(lut.table),
+                bytes(loaded.table),
+                msg='Loaded table does not match the saved table.',
+            )
+            self.assertIsNone(
+                TermLUT.load(lut.path, 'lab', bits=5),
+                msg='Loaded a table with the wrong size.',
+            )
+
+            # Cell centers should always match the matcher.
+            for rgb in ((8, 8, 8), (248, 8, 136), (104, 184, 24)):
+                self.assertCallEqual(
+                    rgb2termnum(*rgb, match='lab'),
+                    lut[rgb],
+                    func=TermLUT.lookup,
+                    args=rgb,
+                    msg='Lookup table does not match the matcher.',
+                )
+
+            # A replaced matcher should not use the cached table.
+            with mock.patch.dict(matchers, {'lab': lambda r, g, b: 0}):
+                replaced = get_lut('lab', bits=4, cache_dir=cachedir)
+            self.assertNotEqual(
+                replaced.path,
+                lut.path,
+                msg='Cache file was shared with a replaced matcher.',
+            )
+            self.assertEqual(
+                bytes(replaced.table),
+                bytes(len(replaced)),
+                msg='Table was not built from the replaced matcher.',
+            )
+
+            expected = TermLUT.build(matchers['lab'], 'lab', bits=3)
+            enabled = enable_lut('lab', bits=4, cache_dir=cachedir)
+            try:
+                self.assertIs(
+                    lut,
+                    enabled,
+                    msg='Lookup table was built twice.',
+                )
+                self.assertEqual(
+                    bytes(get_lut('lab', bits=3, use_cache=False).table),
+                    bytes(expected.table),
+                    msg='Table was built from an enabled lookup table.',
+                )
+                rgb = (1, 2, 3)
+                self.assertCallEqual(
+                    lut[rgb],
+                    rgb2termnum(*rgb, match='lab'),
+                    func=rgb2termnum,
+                    args=rgb,
+                    kwargs={'match': 'lab'},
+                    msg='Enabled lookup table was not used.',
+                )
+            finally:
+                disable_lut('lab')
+
+    def test_match_lab(self):
+        """ The 'lab' matching mode should find the perceptually nearest
+            color in all 256 terminal colors.
+        """
+        palette = [term2rgb(i) for i in range(256)]
+
+        def distance(a, b):
+            return sum((x - y) ** 2 for x, y in zip(rgb2lab(*a), rgb2lab(*b)))
+
+        for _ in range(50):
+            rgb = tuple(random.randint(0, 255) for _ in range(3))
+            code = rgb2termnum(*rgb, match='lab')
+            nearest = min(distance(rgb, c) for c in palette)
+            self.assertCallEqual(
+                nearest,
+                distance(rgb, palette[code]),
+                func=rgb2termnum,
+                args=rgb,
+                kwargs={'match': 'lab'},
+                msg='Did not find the nearest color.',
+            )
+
+        # Grays should use the grayscale ramp, not the color cube.
+        graymatches = {
+            '646464': '241',
+            '8a8a8a': '245',
+            'e0e0e0': '254',
+        }
+        for hexval, code in graymatches.items():
+            argset = (hexval,)
+            kwset = {'match': 'lab'}
+            self.assertCallEqual(
+                code,
+                hex2term(*argset, **kwset),
+                func=hex2term,
+                args=argset,
+                kwargs=kwset,
+                msg='Failed to match the grayscale ramp.',
+            )
+            self.assertCallEqual(
+                code,
+                ColorCode(*argset, **kwset).code,
+                func=ColorCode,
+                args=argset,
+                kwargs=kwset,
+                msg='Failed to match the grayscale ramp.',
+            )
+            self.assertCallEqual(
+                term2hex(code),
+                parse_colr_arg(*argset, **kwset),
+                func=parse_colr_arg,
+                args=argset,
+                kwargs=kwset,
+                msg='Failed to match the grayscale ramp.',
+            )
+
+        with self.assertCallRaises(
+                ValueError,
+                func=rgb2termnum,
+                args=(0, 0, 0),
+                kwargs={'match': 'NOTAMODE'},
+                msg='Failed to raise for unknown matching mode.'):
+            rgb2termnum(0, 0, 0, match='NOTAMODE')
 
     def test_name_data(self):
         """ Colr should use name_data.names when all other style names fail.
@@ -549,6 +1359,288 @@ class ColrTests(ColrTestCase):
             msg='Failed to create Colr from chained name_data method.'
         )
 
+    def test_palette(self):
+        """ Palettes should change matching, and share their indexes. """
+        red = (0xdc, 0x32, 0x2f)
+        self.assertEqual(
+            rgb2termnum(*red, palette='solarized'),
+            1,
+            msg='Palette colors were not used for matching.',
+        )
+        self.assertEqual(
+            ColorCode(red, palette='solarized').hexval,
+            'dc322f',
+            msg='ColorCode did not use the palette colors.',
+        )
+        for match in (None, 'basic', 'cube', 'lab'):
+            self.assertCallEqual(
+                rgb2termnum(*red, match=match, palette='xterm'),
+                rgb2termnum(*red, match=match),
+                func=rgb2termnum,
+                args=red,
+                kwargs={'match': match, 'palette': 'xterm'},
+                msg='Default palette should match like no palette.',
+            )
+        for method, args in (('hex', ('#808080', 'test')), ('rainbow', ())):
+            self.assertEqual(
+                str(getattr(Colr('test', palette='xterm'), method)(*args)),
+                str(getattr(Colr('test'), method)(*args)),
+                msg='Default palette changed {}() codes.'.format(method),
+            )
+        self.assertEqual(
+            str(Colr(palette='solarized').hex('dc322f', 'test')),
+            '\033[38;5;1mtest\033[0m',
+            msg='Colr did not use the palette.',
+        )
+        with self.assertRaises(ValueError):
+            rgb2termnum(0, 0, 0, palette='not a palette')
+        with self.assertRaises(ValueError):
+            Palette('bad', {256: '000000'})
+
+        # Palettes from dicts and files, with the same colors.
+        colors = {0: '101010', 15: 'f0f0f0'}
+        dictpalette = register_palette('test-dict', colors)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'test-file.Xresources')
+                with open(path, 'w') as f:
+                    f.write('\n'.join((
+                        '! Comments and other settings are ignored.',
+                        '*.foreground: #ffffff',
+                        '*.color0: #101010',
+                        '*.color15: #f0f0f0',
+                    )))
+                filepalette = load_palette(path)
+            self.assertIs(
+                palettes['test-file'],
+                filepalette,
+                msg='Palette was not registered by file name.',
+            )
+            self.assertEqual(
+                dictpalette,
+                filepalette,
+                msg='Palettes with the same colors should be equal.',
+            )
+            self.assertEqual(filepalette.colors[15], (0xf0, 0xf0, 0xf0))
+            self.assertIs(
+                dictpalette.index(),
+                filepalette.index(),
+                msg='Palettes with the same colors should share indexes.',
+            )
+            self.assertEqual(
+                rgb2termnum(0x11, 0x11, 0x11, palette='test-file'),
+                0,
+                msg='Loaded palette colors were not used for matching.',
+            )
+        finally:
+            palettes.pop('test-dict', None)
+            palettes.pop('test-file', None)
+
+    def test_render_runs(self):
+        """ Only changed codes should be used between runs of text. """
+        runs = (
+            ('a', 'red', None, 'bright'),
+            ('b', 'blue', None, 'bright'),
+            ('', 'green', None, None),
+            ('c', 'blue', None, None),
+            ('d', 'blue', None, None),
+            ('e', None, None, None),
+            ('f', None, (1, 2, 3), None),
+        )
+        self.assertEqual(
+            Colr()._render_runs(runs),
+            ''.join((
+                '\033[1m\033[31ma',
+                '\033[34mb',
+                '\033[0m\033[34mcd',
+                '\033[0me',
+                '\033[48;2;1;2;3mf',
+                '\033[0m',
+            )),
+            msg='Runs were not rendered with minimal codes.',
+        )
+        joinvals = {
+            Colr().join('a', 'b', 'c', fore='red'): '\033[31mabc\033[0m',
+            Colr('-').join('a', 'b', fore='red'): (
+                '\033[31ma\033[0m-\033[31mb\033[0m'
+            ),
+            Colr().join(Colr('a', 'red'), 'b', fore='red'): (
+                '\033[31m\033[31ma\033[0m\033[31mb\033[0m'
+            ),
+        }
+        for joined, expected in joinvals.items():
+            self.assertEqual(str(joined), expected)
+        s = 'This is a test.'
+        for rainbow in (
+                Colr(s).rainbow(),
+                Colr(s).rainbow(back='blue', style='bright'),
+                Colr(s).gradient(name='black', fore='red')):
+            rainbow = str(rainbow)
+            self.assertEqual(strip_codes(rainbow), s)
+            self.assertEqual(
+                get_codes(rainbow).count(closing_code),
+                1,
+                msg='Expected a single reset: {!r}'.format(rainbow),
+            )
+            self.assertTrue(rainbow.endswith(closing_code))
+
+    def test_rgb2termnum(self):
+        """ rgb2termnum and friends should match the str-based functions.
+        """
+        for v in self.conversions:
+            argset = v['rgb']
+            self.assertCallEqual(
+                int(v['code']),
+                rgb2termnum(*argset),
+                func=rgb2termnum,
+                args=argset,
+                msg='Failed to translate.',
+            )
+            argset = (v['hexval'],)
+            self.assertCallEqual(
+                int(v['code']),
+                hex2termnum(*argset),
+                func=hex2termnum,
+                args=argset,
+                msg='Failed to translate.',
+            )
+            argset = (int(v['code']),)
+            self.assertCallTupleEqual(
+                v['rgb'],
+                termnum2rgb(*argset),
+                func=termnum2rgb,
+                args=argset,
+                msg='Failed to translate.',
+            )
+
+        for val in range(256):
+            for argset in ((val, 0, 0), (0, val, 0), (0, 0, val)):
+                self.assertCallEqual(
+                    rgb2term(*argset),
+                    str(rgb2termnum(*argset)),
+                    func=rgb2termnum,
+                    args=argset,
+                    msg='Int code does not match str code.',
+                )
+                self.assertCallTupleEqual(
+                    hex2rgb(rgb2termhex(*argset)),
+                    rgb2termrgb(*argset),
+                    func=rgb2termrgb,
+                    args=argset,
+                    msg='Nearest rgb does not match nearest hex.',
+                )
+
+        for argset in ((256, 0, 0), (0, -1, 0)):
+            with self.assertCallRaises(
+                    ValueError,
+                    func=rgb2termnum,
+                    args=argset,
+                    msg='Failed to raise for invalid values.'):
+                rgb2termnum(*argset)
+        with self.assertCallRaises(
+                ValueError,
+                func=termnum2rgb,
+                args=(256,),
+                msg='Failed to raise for invalid code.'):
+            termnum2rgb(256)
+
+    def test_segments(self):
+        """ Appended pieces should join into the same .data, and copies
+            should not share them.
+        """
+        appended = Colr()
+        expected = ''
+        for i in range(100):
+            appended.red(str(i))
+            expected = ''.join((expected, Colr(str(i), 'red').data))
+        self.assertEqual(appended.data, expected)
+        self.assertEqual(
+            str(appended.blue('x')),
+            str(expected + Colr('x', 'blue')),
+        )
+        appended.data = 'reset'
+        self.assertEqual(appended('!').data, 'reset!')
+
+        original = Colr('a', 'red')
+        copied = pickle.loads(pickle.dumps(original))
+        copied.blue('b')
+        self.assertEqual(original, Colr('a', 'red'))
+        self.assertEqual(copied, Colr('a', 'red').blue('b'))
+        # Caches are built again instead of being pickled, or restored.
+        original.stripped(), original.visible_width()
+        self.assertFalse(
+            set(original.__getstate__()) & set(Colr._cache_attrs),
+            msg='Caches were pickled.',
+        )
+        stale = dict(original.__getstate__(), _data='x', _stripped='x')
+        unpickled = Colr.__new__(Colr)
+        unpickled.__setstate__(stale)
+        self.assertEqual(unpickled.stripped(), 'a')
+        self.assertEqual(unpickled.data, original.data)
+        # Older pickles only have the rendered `data`.
+        unpickled = Colr.__new__(Colr)
+        unpickled.__setstate__({'data': original.data})
+        self.assertEqual(unpickled, original)
+        self.assertEqual(
+            unpickled.red('y'),
+            Colr('a', 'red').red('y'),
+            msg='Older pickle state is missing Colr settings.',
+        )
+
+    def test_spans(self):
+        """ Colr should render its spans the same as color(), and get the
+            visible text without stripping codes from it.
+        """
+        clr = Colr('a', 'red')('b', back='blue', style='bright')('c')
+        self.assertEqual(
+            clr.data,
+            ''.join((
+                Colr().color('a', 'red'),
+                Colr().color('b', back='blue', style='bright'),
+                'c',
+            ))
+        )
+        self.assertEqual(
+            clr._segments[0],
+            ColrSpan(Colr().color_code('red'), 'a', closing_code),
+        )
+        with mock.patch('colr.colr.strip_codes') as strip:
+            self.assertEqual(clr.stripped(), 'abc')
+            # Operators keep the spans, or adopt rendered data.
+            self.assertEqual((clr + Colr('d', 'blue')).stripped(), 'abcd')
+            self.assertEqual(('>' + clr * 2 + '<').stripped(), '>abcabc<')
+            self.assertEqual(clr[1:].stripped(), 'bc')
+            strip.assert_not_called()
+        # Rainbows and gradients keep their codes out of the text too.
+        text = 'rainbow\ngradient'
+        effects = (
+            Colr(text).rainbow(),
+            Colr('>').rainbow(text, back='blue', linemode=False),
+            Colr(text).gradient(name='white'),
+            Colr(text).gradient_rgb(start=(255, 0, 0), stop=(0, 0, 255)),
+        )
+        for effect in effects:
+            with mock.patch('colr.colr.strip_codes') as strip:
+                stripped = effect.stripped()
+                self.assertEqual(effect[1:4].stripped(), stripped[1:4])
+                strip.assert_not_called()
+            self.assertEqual(strip_codes(effect.data), stripped)
+            self.assertFalse(
+                any('\033' in span.text for span in effect._segments),
+                msg='Codes were rendered into the text: {!r}'.format(effect),
+            )
+        blue = Colr('d', 'blue')
+        with mock.patch.object(Colr, '__init__') as init:
+            self.assertEqual(str(clr + blue), str(clr) + str(blue))
+            self.assertEqual(str(clr.rjust(4)), ' ' + str(clr))
+            self.assertEqual(str(clr.format()), str(clr))
+            init.assert_not_called()
+        # Text that already has codes is still stripped.
+        clr = Colr(Colr('in', 'red'), 'blue')('out')
+        self.assertEqual(clr.stripped(), 'inout')
+        clr.data = Colr('new', 'green').data
+        self.assertEqual(clr.stripped(), 'new')
+
     def test_strip_codes(self):
         """ strip_codes() should strip all color and reset codes. """
         s = '\n'.join((
@@ -594,6 +1686,47 @@ class ColrTests(ColrTestCase):
             msg='Stripped Colr has different content.',
         )
 
+    def test_term_tables(self):
+        """ Int-indexed palette tables should match term2hex_map. """
+        self.assertEqual(
+            len(term2hex_map),
+            len(term2hex_table),
+            msg='Palette table sizes do not match.',
+        )
+        for code in range(256):
+            hexval = term2hex_map['{:02}'.format(code)]
+            self.assertEqual(
+                hexval,
+                term2hex_table[code],
+                msg='Hex table does not match for: {}'.format(code),
+            )
+            self.assertTupleEqual(
+                hex2rgb(hexval),
+                term2rgb_table[code],
+                msg='RGB table does not match for: {}'.format(code),
+            )
+            self.assertEqual(
+                int(hexval, 16),
+                term2packed_table[code],
+                msg='Packed table does not match for: {}'.format(code),
+            )
+            for argset in ((code,), (str(code),), ('{:02}'.format(code),)):
+                self.assertCallEqual(
+                    hexval,
+                    term2hex(*argset),
+                    func=term2hex,
+                    args=argset,
+                    msg='Failed to translate.',
+                )
+        argset = (256, 'default')
+        self.assertCallEqual(
+            'default',
+            term2hex(*argset),
+            func=term2hex,
+            args=argset,
+            msg='Failed to return the default value.',
+        )
+
     def test_trans(self):
         """ Translation functions should translate codes properly. """
         for v in self.conversions:
@@ -682,6 +1815,149 @@ class ColrTests(ColrTestCase):
                     msg='Failed on close match.',
                 )
 
+    def test_visible_len(self):
+        """ Colr.visible_len() should not count escape codes, and the
+            stripped text should be kept until the Colr changes.
+        """
+        clr = Colr(Colr('red', 'red'), 'blue')
+        self.assertEqual(len(clr), len(clr.data))
+        self.assertEqual(clr.visible_len(), 3)
+        with mock.patch('colr.colr.strip_codes', wraps=strip_codes) as strip:
+            for _ in range(3):
+                self.assertEqual(clr.stripped(), 'red')
+                self.assertEqual(clr.visible_len(), 3)
+                self.assertEqual(clr.center(5).visible_len(), 5)
+            # Only the new Colrs from center() are stripped.
+            self.assertEqual(strip.call_count, 3)
+        clr.green('!')
+        self.assertEqual(clr.stripped(), 'red!')
+        self.assertEqual(clr.visible_len(), 4)
+        clr.data = 'reset'
+        self.assertEqual(clr.visible_len(), 5)
+        self.assertEqual(
+            clr.ljust(7, squeeze=True, text='x').stripped(),
+            'resetx ',
+        )
+
+    def test_visible_width(self):
+        """ visible_width() should count wide characters as 2 columns and
+            combining characters as 0, and justify methods should pad by
+            that width.
+        """
+        widths = (
+            ('', 0),
+            ('plain', 5),
+            (Colr('plain', 'red'), 5),
+            ('\u65e5\u672c', 4),
+            ('\U0001f600!', 3),
+            ('e\u0301', 1),
+            ('\u00e9\u00ad', 2),
+            ('\u200bx', 1),
+        )
+        for s, expected in widths:
+            self.assertEqual(
+                visible_width(s),
+                expected,
+                msg='Wrong width for: {!r}'.format(s),
+            )
+            self.assertEqual(
+                Colr(s, 'blue').visible_width(),
+                expected,
+                msg='Wrong Colr width for: {!r}'.format(s),
+            )
+        # The width is kept until the Colr is changed.
+        wide = Colr('\u65e5\u672c', 'red')
+        self.assertEqual(wide.visible_width(), 4)
+        with mock.patch('colr.colr._char_width') as charwidth:
+            self.assertEqual(wide.visible_width(), 4)
+            charwidth.assert_not_called()
+        self.assertEqual(wide.blue('\u65e5').visible_width(), 6)
+        wide.data = 'x'
+        self.assertEqual(wide.visible_width(), 1)
+        cell = Colr('\u65e5\u672c', 'red')
+        self.assertEqual(cell.visible_len(), 2)
+        self.assertEqual(cell.ljust(6).stripped(), '\u65e5\u672c  ')
+        self.assertEqual(cell.rjust(6).stripped(), '  \u65e5\u672c')
+        self.assertEqual(
+            strip_codes(format(cell, '*^8')),
+            '**\u65e5\u672c**',
+        )
+        self.assertEqual(
+            Colr('x').ljust(4, text='\u00e9\u00e9', squeeze=True).stripped(),
+            'x\u00e9\u00e9 ',
+        )
+        self.assertEqual(
+            Colr('e\u0301').center(3, fore='red').stripped(),
+            ' e\u0301 ',
+        )
+
+    def test_wrap(self):
+        """ Colr.wrap()/fill() should wrap the text without escape codes,
+            and each line should reopen and close its codes.
+        """
+        clr = Colr('The quick brown ', 'red')(
+            'fox jumps over',
+            'blue',
+            style='bright',
+        )(' the lazy dog.')
+        lines = clr.wrap(10)
+        self.assertListEqual(
+            [line.stripped() for line in lines],
+            ['The quick', 'brown fox', 'jumps over', 'the lazy', 'dog.'],
+        )
+        self.assertEqual(
+            lines[1],
+            Colr('brown ', 'red')('fox', 'blue', style='bright'),
+        )
+        self.assertEqual(
+            lines[2],
+            Colr('jumps over', 'blue', style='bright'),
+        )
+        self.assertEqual(lines[4], Colr('dog.'))
+        self.assertEqual(
+            clr.fill(10),
+            Colr('\n').join(lines),
+        )
+        # Text with codes in it, newlines, and indentation are handled.
+        clr = Colr('  {}\n\n{}'.format(
+            Colr('abcdefgh', 'red'),
+            Colr('\u65e5\u672c\u8a9e', 'blue'),
+        ))
+        self.assertListEqual(
+            [line.stripped() for line in clr.wrap(5)],
+            ['  abc', 'defgh', '', '\u65e5\u672c', '\u8a9e'],
+        )
+        self.assertListEqual(
+            [str(line) for line in clr.wrap(5)[:2]],
+            [
+                '  {}'.format(Colr('abc', 'red')),
+                str(Colr('defgh', 'red')),
+            ],
+        )
+        self.assertListEqual(Colr().wrap(5), [])
+        with self.assertRaises(ValueError):
+            clr.wrap(0)
+        # Tabs are expanded like textwrap, counting columns across colors.
+        clr = Colr('ab\tc', 'red')('d\tefgh ij', 'blue')('\tk\tlmnop\tq')
+        lines = clr.wrap(12)
+        self.assertListEqual(
+            [line.stripped() for line in lines],
+            textwrap.wrap(clr.stripped(), 12),
+        )
+        self.assertEqual(lines[0], Colr('ab      c', 'red')('d', 'blue'))
+        self.assertLessEqual(
+            max(line.visible_width() for line in Colr('a\tb\tc').wrap(10)),
+            10,
+            msg='Tabs were wrapped past the width.',
+        )
+        # Codes that are never reset don't pile up on later lines.
+        lines = Colr('word ' * 2000).rainbow().wrap(80)
+        self.assertLess(
+            max(len(line.data) for line in lines),
+            80 * 20,
+            msg='Wrapped lines have codes that are not active.',
+        )
+
 
 # # These are failing tests, to check the format for ColrTestCase messages.
 # class FailingTests(ColrTestCase):